@@ -0,0 +1,250 @@
+import asyncio
+import threading
+import time
+from functools import partial
+from chat_server import BaseChatServer, LISTEN_BACKLOG, HEARTBEAT_TICK, enable_keepalive
+from protocol import FrameDecoder, ProtocolError
+from codec import CODEC_JSON
+
+# transport内部缓冲区的高水位，超过后暂停写入，剩余的帧留在有界发送队列中
+WRITE_BUFFER_HIGH = 64 * 1024
+
+
+class ChatProtocol(asyncio.BufferedProtocol):
+    """单个客户端连接，数据由事件循环直接写入帧解码器的缓冲区"""
+
+    def __init__(self, server):
+        self.server = server
+        self.id = None
+        # 空闲连接不预先分配读缓冲区，收到数据时再按需扩容
+        self.decoder = FrameDecoder(initial_size=0)
+        self.transport = None
+        self.address = None
+        self.outbound = server.new_outbound_queue()
+        self.rooms = set()
+        self.codec = CODEC_JSON
+        self.decompressor = None
+        self.last_seen = time.monotonic()  # 最后一次收到数据的时间
+        self.pinged = 0.0  # 最后一次发ping的时间
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')
+        transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            enable_keepalive(sock)
+        self.server.add_client(self)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.flush()
+
+    def flush(self):
+        """在transport未暂停时把发送队列中积压的帧一次性交给transport"""
+        if not self.paused and not self.transport.is_closing():
+            frames = self.outbound.pop_all()
+            if frames:
+                start = time.perf_counter()
+                self.transport.writelines(frames)
+                self.outbound.write_time.record(time.perf_counter() - start)
+
+    def stats(self):
+        stats = self.outbound.stats()
+        # transport缓冲区中还未写入内核的数据也算作积压
+        stats['queue_bytes'] += self.transport.get_write_buffer_size()
+        stats['address'] = f"{self.address[0]}:{self.address[1]}"
+        stats['rooms'] = sorted(self.rooms)
+        stats['codec'] = self.codec
+        stats['decompression'] = self.decompressor.stats() if self.decompressor is not None else None
+        return stats
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        self.process_frames()
+
+    def process_frames(self):
+        try:
+            for payload in self.decoder.frames():
+                self.server.capture_frame(self, payload)
+                wait = self.server.check_rate(self)
+                if wait is None:
+                    if self.transport.is_closing():
+                        return
+                    continue
+                if wait:
+                    # 限速：暂停读取并推迟处理这个帧，缓冲区中剩下的帧等恢复后再处理
+                    self.transport.pause_reading()
+                    self.server.loop.call_later(wait, self._resume_delayed, bytes(payload))
+                    return
+                self.server.handle_payload(payload, self)
+        except ProtocolError as e:
+            print(f"客户端 {self.address} 协议错误: {e}")
+            self.transport.close()
+
+    def _resume_delayed(self, payload):
+        if self.transport.is_closing():
+            return
+        try:
+            self.server.handle_payload(payload, self)
+        except ProtocolError as e:
+            print(f"客户端 {self.address} 协议错误: {e}")
+            self.transport.close()
+            return
+        self.transport.resume_reading()
+        self.process_frames()
+
+    def connection_lost(self, exc):
+        self.server.remove_client(self)
+
+
+class AsyncChatServer(BaseChatServer):
+    """
+    基于asyncio的服务器引擎
+    所有连接由后台线程中的一个事件循环处理，不再为每个客户端创建线程
+    """
+    engine = 'asyncio'
+
+    def __init__(self, host='0.0.0.0', port=8080, **options):
+        super().__init__(host, port, **options)
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._dirty = set()  # 有待发送数据的连接
+        self._flush_scheduled = False
+
+    def start_server(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(started,), name='event_loop')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        return self.running
+
+    def _run_loop(self, started):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._server = self.loop.run_until_complete(self.loop.create_server(
+                lambda: ChatProtocol(self), self.host, self.port, backlog=LISTEN_BACKLOG,
+                reuse_port=self.reuse_port or None
+            ))
+            self.running = True
+            print(f"服务器启动在 {self.host}:{self.port} (asyncio)")
+            self.loop.call_later(1.0, self._check_lagging)
+            if self.heartbeat_interval > 0:
+                self.loop.call_later(HEARTBEAT_TICK, self._tick_heartbeats)
+        except Exception as e:
+            print(f"服务器启动失败: {e}")
+            self.loop.close()
+            self.history.close()
+            self.close_search()
+            self.stop_capture()
+            return
+        finally:
+            started.set()
+
+        try:
+            self.loop.run_forever()
+        finally:
+            # 事件循环停止后关闭监听和所有连接
+            self._server.close()
+            for protocol in self.clients.snapshot():
+                protocol.transport.abort()
+            self.clients.clear()
+            self.rooms.clear()
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+    def add_client(self, protocol):
+        self.register_client(protocol)
+        print(f"新客户端连接: {protocol.address}")
+
+    def send_frame(self, protocols, frame):
+        for protocol in protocols:
+            if protocol.outbound.put(frame):
+                self._dirty.add(protocol)
+            else:
+                self.disconnect_client(protocol)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """
+        同一个刷新窗口内的广播合并为每个连接一次写操作
+        flush_interval为0时在本轮事件循环结束时刷新
+        """
+        if self._dirty and not self._flush_scheduled:
+            self._flush_scheduled = True
+            if self.flush_interval > 0:
+                self.loop.call_later(self.flush_interval, self._flush_dirty)
+            else:
+                self.loop.call_soon(self._flush_dirty)
+
+    def _flush_dirty(self):
+        self._flush_scheduled = False
+        dirty, self._dirty = self._dirty, set()
+        for protocol in dirty:
+            protocol.flush()
+
+    def disconnect_client(self, protocol, reason='接收过慢'):
+        """断开跟不上的慢客户端或已失联的客户端"""
+        if not protocol.transport.is_closing():
+            print(f"客户端 {protocol.address} {reason}，断开连接")
+            protocol.transport.abort()
+
+    def _check_lagging(self):
+        """定期检查长时间无法写出的连接"""
+        for protocol in self.clients.snapshot():
+            if protocol.paused and protocol.outbound.policy == 'disconnect' and protocol.outbound.lagging():
+                self.disconnect_client(protocol)
+        if self.running:
+            self.loop.call_later(1.0, self._check_lagging)
+
+    def _tick_heartbeats(self):
+        self.check_heartbeats()
+        if self.running:
+            self.loop.call_later(HEARTBEAT_TICK, self._tick_heartbeats)
+
+    def get_client_stats(self):
+        """在事件循环线程中收集统计，供Flask线程调用"""
+        if not self.running:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._collect_stats(), self.loop)
+        return future.result(timeout=5)
+
+    async def _collect_stats(self):
+        return [dict(protocol.stats(), rate_limit=self.rate_limiter.connection_counters(protocol.id))
+                for protocol in self.clients.snapshot()]
+
+    def remove_client(self, protocol):
+        if self.unregister_client(protocol):
+            print(f"客户端断开连接: {protocol.address}")
+
+    def call_later(self, delay, callback):
+        self.loop.call_later(delay, callback)
+
+    def broadcast_threadsafe(self, message_data, room=None):
+        if self.running:
+            self.loop.call_soon_threadsafe(partial(self.broadcast_message, message_data, room=room))
+
+    def deliver_threadsafe(self, frame, room=None):
+        # 连接只能在事件循环线程中访问
+        if self.running:
+            self.loop.call_soon_threadsafe(self.deliver_remote, frame, room)
+
+    def stop_server(self):
+        self.running = False
+        if self.loop and self._thread and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+        self.history.close()
+        self.close_search()
+        self.stop_capture()
+        print("服务器已停止")
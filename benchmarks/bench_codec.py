@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+消息编码性能测试
+
+对比JSON（json.dumps/json.loads）与二进制编码（codec.py）在几种典型消息上的：
+1. 每条消息的字节数（不含4字节长度前缀）
+2. 编码、解码耗时
+用法: python benchmarks/bench_codec.py [--count 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import encode_binary, decode_binary
+
+
+def chat_message(username, text, room='大厅', seq=123456):
+    ip = '192.168.1.105'
+    timestamp = '2024-05-20 14:03:27'
+    return {
+        'type': 'message',
+        'content': f"{ip} | {timestamp} | {username}: {text}",
+        'timestamp': timestamp,
+        'ip': ip,
+        'username': username,
+        'room': room,
+        'seq': seq,
+    }
+
+
+MESSAGES = [
+    ('短聊天消息', chat_message('小王', '好的，收到')),
+    ('英文聊天消息', chat_message('alice', 'deploy finished, please check the dashboard', 'ops')),
+    ('长聊天消息', chat_message('小李', '今天下午三点在会议室讨论新版本的发布计划，请大家提前看一下文档。' * 8)),
+    ('系统消息', {'type': 'system', 'content': '192.168.1.105 | 2024-05-20 14:03:27 | 加入房间 大厅',
+              'timestamp': '2024-05-20 14:03:27', 'room': '大厅', 'seq': 123457}),
+    ('客户端发送', {'type': 'message', 'username': '小王', 'content': '好的，收到', 'room': '大厅'}),
+    ('welcome', {'type': 'welcome', 'epoch': '3f9a1c2b7d4e', 'seq': 123456, 'room': '大厅',
+                 'codecs': ['binary', 'json']}),
+]
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='消息编码性能测试')
+    parser.add_argument('--count', type=int, default=100000, help='每种消息编解码的次数')
+    args = parser.parse_args()
+
+    print(f"{'消息':<10} {'JSON字节':>8} {'二进制字节':>10} {'节省':>6} "
+          f"{'JSON编码':>9} {'二进制编码':>10} {'JSON解码':>9} {'二进制解码':>10} (us)")
+    totals = [0, 0]
+    for name, message in MESSAGES:
+        json_payload = json.dumps(message).encode('utf-8')
+        binary_payload = encode_binary(message)
+        assert decode_binary(memoryview(binary_payload)) == message
+        totals[0] += len(json_payload)
+        totals[1] += len(binary_payload)
+
+        json_encode = timed(lambda: json.dumps(message).encode('utf-8'), args.count)
+        binary_encode = timed(lambda: encode_binary(message), args.count)
+        # 与服务器/客户端一样从memoryview解码
+        json_view = memoryview(json_payload)
+        binary_view = memoryview(binary_payload)
+        json_decode = timed(lambda: json.loads(str(json_view, 'utf-8')), args.count)
+        binary_decode = timed(lambda: decode_binary(binary_view), args.count)
+
+        saved = 1 - len(binary_payload) / len(json_payload)
+        print(f"{name:<10} {len(json_payload):>8} {len(binary_payload):>10} {saved:>6.0%} "
+              f"{json_encode * 1e6:>9.2f} {binary_encode * 1e6:>10.2f} "
+              f"{json_decode * 1e6:>9.2f} {binary_decode * 1e6:>10.2f}")
+    print(f"合计: JSON {totals[0]} 字节, 二进制 {totals[1]} 字节, 节省 {1 - totals[1] / totals[0]:.0%}")
+
+
+if __name__ == "__main__":
+    main()
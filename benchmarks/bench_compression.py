@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+连接压缩性能测试
+
+模拟一个连接上先后发出的几类消息，统计压缩率和每帧的CPU耗时：
+1. 普通聊天消息（低于阈值，不压缩）
+2. 粘贴的日志
+3. 加入房间时补发的history帧
+同时对比逐帧独立压缩（不共用压缩窗口）的效果。
+用法: python benchmarks/bench_compression.py [--count 2000] [--threshold 512]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import StreamCompressor, StreamDecompressor, is_compressed
+from history import HistoryBuffer
+from protocol import HEADER_SIZE, encode_message
+
+
+def chat_frame(rng, index):
+    ip = f"192.168.1.{rng.randint(2, 254)}"
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    username = f"user{rng.randint(1, 50)}"
+    text = rng.choice(['好的', '收到，马上处理', '下午开会吗？', 'deploy done', '稍等一下，我看看日志'])
+    return encode_message({'type': 'message', 'content': f"{ip} | {timestamp} | {username}: {text}",
+                           'timestamp': timestamp, 'ip': ip, 'username': username, 'room': '大厅', 'seq': index})
+
+
+def log_frame(rng, index):
+    lines = [f"2024-05-20 14:{minute:02d}:{rng.randint(0, 59):02d} {rng.choice(['INFO', 'WARN', 'ERROR'])} "
+             f"worker-{rng.randint(1, 8)} GET /api/orders/{rng.randint(1000, 99999)} "
+             f"status={rng.choice([200, 200, 200, 404, 500])} latency={rng.randint(1, 900)}ms"
+             for minute in range(rng.randint(10, 40))]
+    return encode_message({'type': 'message', 'content': '\n'.join(lines), 'username': 'ops', 'seq': index})
+
+
+def history_frame(rng, size):
+    history = HistoryBuffer(size)
+    for index in range(size):
+        history.record({'type': 'message', 'content': f"192.168.1.{rng.randint(2, 254)} | 2024-05-20 14:03:27 | "
+                                                      f"user{rng.randint(1, 50)}: 消息内容 {index}",
+                        'username': f"user{rng.randint(1, 50)}", 'room': '大厅'}, '大厅')
+    frames, _ = history.since(0, ('大厅',))
+    return history.encode_history(frames, reset=False, truncated=False)
+
+
+def run(name, frames, threshold):
+    compressor = StreamCompressor(threshold=threshold)
+    decompressor = StreamDecompressor()
+    raw = sum(len(frame) for frame in frames)
+    start = time.perf_counter()
+    out = [compressor.compress_frame(frame) for frame in frames]
+    elapsed = time.perf_counter() - start
+    for original, frame in zip(frames, out):
+        payload = memoryview(frame)[HEADER_SIZE:]
+        if is_compressed(payload):
+            assert decompressor.decompress(payload) == original[HEADER_SIZE:]
+    wire = sum(len(frame) for frame in out)
+    # 逐帧独立压缩作为对比
+    single = sum(len(zlib.compress(frame[HEADER_SIZE:])) + HEADER_SIZE + 1 if len(frame) - HEADER_SIZE >= threshold
+                 else len(frame) for frame in frames)
+    stats = compressor.stats()
+    print(f"{name:<10} {len(frames):>6} {raw / len(frames):>10,.0f} {wire / raw:>10.1%} {single / raw:>10.1%} "
+          f"{elapsed * 1e6 / len(frames):>10.1f} {stats['compressed_frames']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='连接压缩性能测试')
+    parser.add_argument('--count', type=int, default=2000, help='每类消息的数量')
+    parser.add_argument('--threshold', type=int, default=512, help='压缩阈值（消息体字节数）')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'消息':<10} {'帧数':>6} {'平均字节':>10} {'流式压缩后':>10} {'逐帧压缩后':>10} {'us/帧':>10} {'压缩帧数':>8}")
+    run('聊天消息', [chat_frame(rng, index) for index in range(args.count)], args.threshold)
+    run('粘贴日志', [log_frame(rng, index) for index in range(args.count // 10)], args.threshold)
+    run('历史补发', [history_frame(rng, 200) for _ in range(20)], args.threshold)
+    mixed = [log_frame(rng, index) if index % 20 == 0 else chat_frame(rng, index) for index in range(args.count)]
+    run('混合', mixed, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+服务器引擎对比测试（多线程 vs asyncio）
+
+服务器运行在子进程中，测试进程建立N个空闲连接后统计服务器的内存和线程数，
+再由其中一个连接发送消息，测量广播到达全部连接的延迟。
+用法: python benchmarks/bench_engines.py [--connections 2000] [--rounds 20] [--engines threaded,asyncio]
+"""
+import argparse
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from protocol import FrameDecoder, encode_message, decode_message
+
+
+def raise_fd_limit():
+    """尽量提高文件描述符上限，10k连接需要"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+def serve(engine, port, options=None):
+    """子进程：启动指定引擎并一直运行到父进程关闭stdin"""
+    raise_fd_limit()
+    from chat_server import ChatServer
+    from async_server import AsyncChatServer
+    from cluster import MultiProcessChatServer
+    server_class = {'threaded': ChatServer, 'asyncio': AsyncChatServer, 'multiprocess': MultiProcessChatServer}[engine]
+    server = server_class(host='127.0.0.1', port=port, **(options or {}))
+    if not server.start_server():
+        sys.exit(1)
+    sys.stdin.read()
+    server.stop_server()
+
+
+def process_status(pid):
+    """读取进程的常驻内存(KB)和线程数，仅支持Linux"""
+    status = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                status[key] = value.strip()
+    except OSError:
+        return None, None
+    return int(status['VmRSS'].split()[0]), int(status['Threads'])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def drain_until(selector, decoders, expected, marker, timeout=30, arrivals=None):
+    """读取所有连接直到每个连接都收到content包含marker的消息，返回每个连接的到达时间"""
+    arrivals = {} if arrivals is None else arrivals
+    deadline = time.perf_counter() + timeout
+    while len(arrivals) < expected and time.perf_counter() < deadline:
+        for key, _ in selector.select(timeout=1):
+            sock = key.fileobj
+            decoder = decoders[sock]
+            if decoder.recv_into(sock) == 0:
+                selector.unregister(sock)
+                continue
+            for payload in decoder.frames():
+                if sock not in arrivals and marker in decode_message(payload).get('content', ''):
+                    arrivals[sock] = time.perf_counter()
+    return arrivals
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def spawn_server(engine, port, options=None):
+    """在子进程中启动服务器，避免与测试客户端争用GIL"""
+    command = [sys.executable, os.path.abspath(__file__), '--serve', engine, str(port)]
+    if options:
+        command.append(json.dumps(options))
+    return subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, cwd=ROOT)
+
+
+def stop_server(child):
+    child.stdin.close()
+    try:
+        child.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        child.kill()
+
+
+def bench_engine(engine, connections, rounds):
+    port = free_port()
+    child = spawn_server(engine, port)
+    try:
+        if not wait_for_port(port):
+            print(f"{engine}: 服务器启动失败")
+            return None
+        time.sleep(0.2)
+        base_rss, base_threads = process_status(child.pid)
+
+        selector = selectors.DefaultSelector()
+        decoders = {}
+        start = time.perf_counter()
+        for _ in range(connections):
+            sock = socket.create_connection(('127.0.0.1', port))
+            decoders[sock] = FrameDecoder(initial_size=0)
+            selector.register(sock, selectors.EVENT_READ)
+        connect_time = time.perf_counter() - start
+
+        # 预热：反复广播直到服务器已经接受并登记了全部连接
+        sender = next(iter(decoders))
+        warmed = {}
+        deadline = time.perf_counter() + 60
+        while len(warmed) < connections and time.perf_counter() < deadline:
+            sender.sendall(encode_message({'username': 'bench', 'content': 'warmup'}))
+            drain_until(selector, decoders, connections, 'warmup', timeout=1, arrivals=warmed)
+        if len(warmed) < connections:
+            print(f"{engine}: 部分连接未收到广播")
+        rss, threads = process_status(child.pid)
+
+        latencies = []
+        for i in range(rounds):
+            marker = f'round-{i}-'
+            sent = time.perf_counter()
+            sender.sendall(encode_message({'username': 'bench', 'content': marker}))
+            arrivals = drain_until(selector, decoders, connections, marker)
+            latencies.append(max(arrivals.values()) - sent)
+
+        selector.close()
+        for sock in decoders:
+            sock.close()
+        return {
+            'connect_time': connect_time,
+            'rss_mb': rss / 1024 if rss else None,
+            'kb_per_conn': (rss - base_rss) / connections if rss else None,
+            'threads': threads,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        }
+    finally:
+        stop_server(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器引擎对比测试')
+    parser.add_argument('--connections', type=int, default=2000, help='空闲连接数')
+    parser.add_argument('--rounds', type=int, default=20, help='广播轮数')
+    parser.add_argument('--engines', default='threaded,asyncio', help='要测试的引擎，逗号分隔')
+    parser.add_argument('--serve', nargs='+', metavar='ARG', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], int(args.serve[1]), json.loads(args.serve[2]) if len(args.serve) > 2 else None)
+        return
+
+    limit = raise_fd_limit()
+    if limit and limit < args.connections + 100:
+        print(f"文件描述符上限 {limit} 不足以建立 {args.connections} 个连接")
+
+    print(f"连接数: {args.connections}, 广播轮数: {args.rounds}")
+    print(f"{'引擎':>10} {'建连(秒)':>9} {'RSS(MB)':>9} {'KB/连接':>9} {'线程数':>7} {'广播p50(ms)':>12} {'广播p99(ms)':>12}")
+    for engine in args.engines.split(','):
+        result = bench_engine(engine, args.connections, args.rounds)
+        if result:
+            print(f"{engine:>10} {result['connect_time']:>9.2f} {result['rss_mb'] or 0:>9.1f} "
+                  f"{result['kb_per_conn'] or 0:>9.1f} {result['threads'] or 0:>7} "
+                  f"{result['p50_ms']:>12.2f} {result['p99_ms']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
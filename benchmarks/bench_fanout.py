@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+广播扇出吞吐量测试
+
+N个客户端全部接收，其中S个客户端尽快连续发送消息，统计不同刷新间隔(flush_interval)下
+每秒送达的消息数和端到端延迟，用来权衡几毫秒的延迟与更高的吞吐量。
+用法: python benchmarks/bench_fanout.py [--clients 200] [--senders 4] [--messages 2000]
+                                        [--intervals 0,0.002,0.005,0.01] [--engines threaded,asyncio]
+"""
+import argparse
+import selectors
+import socket
+import threading
+import time
+
+from bench_engines import (free_port, wait_for_port, raise_fd_limit, percentile,
+                           spawn_server, stop_server)
+from protocol import FrameDecoder, encode_message, decode_message
+
+
+def run(engine, interval, clients, senders, messages, size):
+    port = free_port()
+    child = spawn_server(engine, port, {'flush_interval': interval})
+    try:
+        if not wait_for_port(port):
+            print(f"{engine}: 服务器启动失败")
+            return None
+        socks = [socket.create_connection(('127.0.0.1', port)) for _ in range(clients)]
+        time.sleep(0.5)
+
+        expected = senders * messages * clients
+        latencies = []
+        received = [0]
+        done = threading.Event()
+
+        def reader():
+            selector = selectors.DefaultSelector()
+            decoders = {}
+            for sock in socks:
+                decoders[sock] = FrameDecoder(initial_size=0)
+                selector.register(sock, selectors.EVENT_READ)
+            deadline = time.perf_counter() + 120
+            while received[0] < expected and time.perf_counter() < deadline:
+                for key, _ in selector.select(timeout=1):
+                    decoder = decoders[key.fileobj]
+                    if decoder.recv_into(key.fileobj) == 0:
+                        selector.unregister(key.fileobj)
+                        continue
+                    now = time.perf_counter()
+                    for payload in decoder.frames():
+                        # 测试期间只有测试消息，抽样解析以免测试进程自己成为瓶颈
+                        received[0] += 1
+                        if received[0] % 97 == 0:
+                            content = decode_message(payload).get('content', '')
+                            marker = content.partition('bench: ')[2]
+                            latencies.append(now - float(marker[2:].split(';')[0]))
+            selector.close()
+            done.set()
+
+        thread = threading.Thread(target=reader)
+        thread.daemon = True
+        thread.start()
+
+        padding = 'x' * size
+        start = time.perf_counter()
+        for i in range(messages):
+            for sender in socks[:senders]:
+                sender.sendall(encode_message({
+                    'username': 'bench',
+                    'content': f't={time.perf_counter()};{padding}'
+                }))
+        done.wait(150)
+        elapsed = time.perf_counter() - start
+
+        for sock in socks:
+            sock.close()
+        return {
+            'delivered': received[0],
+            'expected': expected,
+            'msgs_per_sec': received[0] / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1000 if latencies else 0,
+            'p99_ms': percentile(latencies, 99) * 1000 if latencies else 0,
+        }
+    finally:
+        stop_server(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='广播扇出吞吐量测试')
+    parser.add_argument('--clients', type=int, default=200, help='接收客户端数')
+    parser.add_argument('--senders', type=int, default=4, help='其中同时发送的客户端数')
+    parser.add_argument('--messages', type=int, default=2000, help='每个发送者发送的消息数')
+    parser.add_argument('--size', type=int, default=100, help='消息内容长度')
+    parser.add_argument('--intervals', default='0,0.002,0.005,0.01', help='flush_interval列表（秒）')
+    parser.add_argument('--engines', default='threaded,asyncio', help='要测试的引擎，逗号分隔')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    print(f"客户端: {args.clients}, 发送者: {args.senders}, 每个发送者消息数: {args.messages}")
+    print(f"{'引擎':>10} {'刷新间隔':>8} {'送达':>10} {'送达/秒':>12} {'p50(ms)':>9} {'p99(ms)':>9}")
+    for engine in args.engines.split(','):
+        for interval in [float(value) for value in args.intervals.split(',')]:
+            result = run(engine, interval, args.clients, args.senders, args.messages, args.size)
+            if result:
+                print(f"{engine:>10} {interval * 1000:>6.0f}ms "
+                      f"{result['delivered']:>10} {result['msgs_per_sec']:>12,.0f} "
+                      f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
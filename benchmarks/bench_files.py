@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+文件传输测试
+
+1. 上传（分块写盘、边收边校验）和下载（sendfile）的吞吐量
+2. 聊天消息的广播延迟：没有文件传输时，与同时有多个大文件在下载时对比，
+   文件走单独的连接和线程，聊天延迟应基本不受影响
+服务器在子进程中运行，避免与测试客户端争用GIL。
+用法: python benchmarks/bench_files.py [--size-mb 200] [--parallel 4] [--engine threaded]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_engines import free_port, wait_for_port, percentile
+from filetransfer import FileServer, upload_file, download_file
+from protocol import FrameDecoder, encode_message, decode_message
+
+MESSAGES = 300
+
+
+def serve(engine, port, file_port, directory, ready, stop):
+    from chat_server import ChatServer
+    from async_server import AsyncChatServer
+    import builtins
+    builtins.print = lambda *args, **kwargs: None
+    server = {'threaded': ChatServer, 'asyncio': AsyncChatServer}[engine](host='127.0.0.1', port=port)
+    server.start_server()
+    files = FileServer(server, host='127.0.0.1', port=file_port, directory=directory)
+    files.start()
+    ready.set()
+    stop.wait()
+    files.stop()
+    server.stop_server()
+
+
+def chat_latency(port, count):
+    """一个连接发消息，另一个连接收到广播的延迟（毫秒）"""
+    sender = socket.create_connection(('127.0.0.1', port))
+    receiver = socket.create_connection(('127.0.0.1', port))
+    decoder = FrameDecoder()
+    time.sleep(0.3)
+    latencies = []
+    for index in range(count):
+        marker = f"bench {index}"
+        start = time.perf_counter()
+        sender.sendall(encode_message({'type': 'message', 'username': 'bench', 'content': marker}))
+        found = False
+        while not found:
+            if decoder.recv_into(receiver) == 0:
+                raise ConnectionError("服务器断开连接")
+            for payload in decoder.frames():
+                message = decode_message(payload)
+                if message.get('type') == 'message' and message['content'].endswith(marker):
+                    found = True
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.005)
+    sender.close()
+    receiver.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文件传输测试')
+    parser.add_argument('--size-mb', type=int, default=200, help='测试文件大小（MB）')
+    parser.add_argument('--parallel', type=int, default=4, help='测量聊天延迟时同时进行的下载数')
+    parser.add_argument('--engine', default='threaded', choices=('threaded', 'asyncio'), help='服务器引擎')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-files-')
+    port, file_port = free_port(), free_port()
+    context = multiprocessing.get_context('spawn')
+    ready, stop = context.Event(), context.Event()
+    child = context.Process(target=serve, args=(args.engine, port, file_port, os.path.join(workdir, 'store'),
+                                                ready, stop))
+    child.start()
+    try:
+        if not ready.wait(15) or not wait_for_port(port):
+            print("服务器启动失败")
+            return
+        source = os.path.join(workdir, 'source.bin')
+        with open(source, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+        start = time.perf_counter()
+        file_id = upload_file('127.0.0.1', file_port, source, 'bench')
+        upload = time.perf_counter() - start
+        start = time.perf_counter()
+        download_file('127.0.0.1', file_port, file_id, os.path.join(workdir, 'copy.bin'))
+        download = time.perf_counter() - start
+        print(f"上传 {args.size_mb} MB: {upload:.2f} 秒 ({args.size_mb / upload:,.0f} MB/s，含计算SHA-256)")
+        print(f"下载 {args.size_mb} MB: {download:.2f} 秒 ({args.size_mb / download:,.0f} MB/s，含校验)")
+
+        idle = chat_latency(port, MESSAGES)
+        running = threading.Event()
+        running.set()
+
+        def keep_downloading(index):
+            target = os.path.join(workdir, f'parallel-{index}.bin')
+            while running.is_set():
+                download_file('127.0.0.1', file_port, file_id, target)
+                os.remove(target)
+
+        threads = [threading.Thread(target=keep_downloading, args=(index,), daemon=True)
+                   for index in range(args.parallel)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        busy = chat_latency(port, MESSAGES)
+        running.clear()
+        for thread in threads:
+            thread.join()
+
+        print(f"\n{'聊天广播延迟(ms)':<22} {'p50':>8} {'p90':>8} {'p99':>8}")
+        for name, values in (('没有文件传输', idle), (f'{args.parallel}个下载同时进行', busy)):
+            print(f"{name:<22} {percentile(values, 50):>8.2f} {percentile(values, 90):>8.2f} "
+                  f"{percentile(values, 99):>8.2f}")
+    finally:
+        stop.set()
+        child.join(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+帧编解码性能测试
+
+通过socketpair发送大量帧，统计不同消息大小下每秒能解出的帧数。
+用法: python benchmarks/bench_framing.py [--count 20000] [--sizes 64,512,1024,4096,65536]
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import FrameDecoder, encode_message, decode_message
+
+
+def make_payload(size):
+    """构造一条编码后消息体约为size字节的聊天消息"""
+    overhead = len(encode_message({'type': 'message', 'content': ''})) - 4
+    return encode_message({'type': 'message', 'content': 'x' * max(0, size - overhead)})
+
+
+def bench_socket(frame, count):
+    """经过真实socket收发，返回(帧/秒, MB/秒)"""
+    sender, receiver = socket.socketpair()
+    # 把多帧拼成一批发送，模拟TCP把多次广播合并到一次读取的情况
+    batch = frame * max(1, 65536 // len(frame))
+    frames_per_batch = len(batch) // len(frame)
+    batches = count // frames_per_batch + 1
+    total = batches * frames_per_batch
+
+    def send_all():
+        for _ in range(batches):
+            sender.sendall(batch)
+        sender.close()
+
+    thread = threading.Thread(target=send_all)
+    decoder = FrameDecoder()
+    received = 0
+    start = time.perf_counter()
+    thread.start()
+    while decoder.recv_into(receiver):
+        for payload in decoder.frames():
+            received += 1
+    elapsed = time.perf_counter() - start
+    thread.join()
+    receiver.close()
+    assert received == total, f"丢失帧: {received}/{total}"
+    return total / elapsed, total * len(frame) / elapsed / 1e6
+
+
+def bench_decode(frame, count):
+    """只测解码器本身（数据已在内存中），返回(帧/秒, 含JSON解析的帧/秒)"""
+    stream = frame * count
+    chunk = 65536
+
+    def run(parse):
+        decoder = FrameDecoder()
+        received = 0
+        start = time.perf_counter()
+        for offset in range(0, len(stream), chunk):
+            decoder.feed(memoryview(stream)[offset:offset + chunk])
+            for payload in decoder.frames():
+                if parse:
+                    decode_message(payload)
+                received += 1
+        elapsed = time.perf_counter() - start
+        assert received == count
+        return count / elapsed
+
+    return run(False), run(True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='帧编解码性能测试')
+    parser.add_argument('--count', type=int, default=20000, help='每种大小发送的帧数')
+    parser.add_argument('--sizes', default='64,512,1024,4096,65536,1048576',
+                        help='消息体大小列表（字节），逗号分隔')
+    args = parser.parse_args()
+
+    print(f"{'消息大小':>10} {'socket 帧/秒':>14} {'socket MB/秒':>12} {'解码 帧/秒':>12} {'解码+JSON 帧/秒':>16}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        frame = make_payload(size)
+        count = max(100, min(args.count, 256 * 1024 * 1024 // len(frame)))
+        socket_fps, socket_mbps = bench_socket(frame, count)
+        decode_fps, parse_fps = bench_decode(frame, count)
+        print(f"{size:>10} {socket_fps:>14,.0f} {socket_mbps:>12,.1f} {decode_fps:>12,.0f} {parse_fps:>16,.0f}")
+
+    # 编码速度
+    message = {'type': 'message', 'content': '你好' * 50, 'username': '用户'}
+    start = time.perf_counter()
+    for _ in range(args.count):
+        encode_message(message)
+    print(f"编码: {args.count / (time.perf_counter() - start):,.0f} 帧/秒")
+
+
+if __name__ == "__main__":
+    main()
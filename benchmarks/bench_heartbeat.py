@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+心跳检测开销测试
+
+N个连接，每个tick有一部分连接收到数据（只更新最后收到数据的时间），对比两种找出
+需要发ping或断开的连接的方式，每个tick的耗时：
+1. 时间轮（timer_wheel.py）：只处理到期槽位中的连接，到期后按最后收到数据的时间重新登记
+2. 线性扫描：每个tick遍历所有连接比较最后收到数据的时间
+时间轮每个tick的工作量与到期的连接数（约 N * tick / 心跳间隔）成正比，线性扫描与N成正比。
+用法: python benchmarks/bench_heartbeat.py [--connections 1000,10000,100000] [--ticks 200] [--interval 30]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timer_wheel import TimerWheel
+
+TICK = 0.5
+
+
+class Connection:
+    def __init__(self, key):
+        self.id = key
+        self.last_seen = 0.0
+
+
+def simulate(count, ticks, interval, use_wheel):
+    rng = random.Random(1)
+    clock = [0.0]
+    connections = [Connection(key) for key in range(count)]
+    wheel = TimerWheel(TICK, clock=lambda: clock[0])
+    if use_wheel:
+        for connection in connections:
+            wheel.schedule(connection.id, interval)
+    # 每个tick约5%的连接收到数据
+    active = [rng.sample(range(count), count // 20) for _ in range(16)]
+    cost = 0.0
+    idle_found = 0
+    for tick in range(1, ticks + 1):
+        now = clock[0] = tick * TICK
+        for key in active[tick % len(active)]:
+            connections[key].last_seen = now
+        start = time.perf_counter()
+        if use_wheel:
+            for key in wheel.advance(now):
+                connection = connections[key]
+                idle = now - connection.last_seen
+                if idle >= interval:
+                    idle_found += 1
+                    connection.last_seen = now  # 视为已处理（发ping）
+                    idle = 0.0
+                wheel.schedule(key, interval - idle)
+        else:
+            for connection in connections:
+                if now - connection.last_seen >= interval:
+                    idle_found += 1
+                    connection.last_seen = now
+        cost += time.perf_counter() - start
+    return cost / ticks, idle_found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='心跳检测开销测试')
+    parser.add_argument('--connections', default='1000,10000,100000', help='连接数列表，逗号分隔')
+    parser.add_argument('--ticks', type=int, default=200, help='模拟的tick数（每tick 0.5秒）')
+    parser.add_argument('--interval', type=float, default=30.0, help='心跳间隔（秒）')
+    args = parser.parse_args()
+
+    print(f"{'连接数':>8} {'时间轮 ms/tick':>15} {'线性扫描 ms/tick':>17} {'发现空闲':>10}")
+    for count in [int(value) for value in args.connections.split(',')]:
+        wheel_cost, wheel_idle = simulate(count, args.ticks, args.interval, True)
+        scan_cost, scan_idle = simulate(count, args.ticks, args.interval, False)
+        print(f"{count:>8,} {wheel_cost * 1000:>15.3f} {scan_cost * 1000:>17.3f} {wheel_idle:>10,}")
+
+
+if __name__ == "__main__":
+    main()
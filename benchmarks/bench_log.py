@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+磁盘消息日志性能测试
+
+1. 追加吞吐量：不同刷盘间隔下每秒追加的消息数（fsync_interval=0 为每条都刷盘，其余为组提交）
+2. 随机范围读取延迟：随机选取起点读取连续N条记录，统计p50/p99
+用法: python benchmarks/bench_log.py [--messages 200000] [--size 200] [--intervals 0,0.01,0.05]
+                                     [--range 100] [--reads 2000] [--dir 临时目录]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_log import MessageLog
+from protocol import encode_message
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_append(base_dir, interval, messages, frame):
+    directory = tempfile.mkdtemp(dir=base_dir)
+    log = MessageLog(directory, fsync_interval=interval)
+    rooms = ['大厅', 'room-1', 'room-2', None]
+    start = time.perf_counter()
+    for seq in range(1, messages + 1):
+        log.append(seq, rooms[seq & 3], frame)
+    log.flush()
+    elapsed = time.perf_counter() - start
+    return log, elapsed, log.stats()
+
+
+def bench_reads(log, reads, length):
+    first, last = log.first_seq, log.last_seq
+    latencies = []
+    for _ in range(reads):
+        begin = random.randint(first, max(first, last - length + 1))
+        start = time.perf_counter()
+        records = log.read_range(begin, begin + length - 1)
+        latencies.append(time.perf_counter() - start)
+        assert len(records) == min(length, last - begin + 1)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='磁盘消息日志性能测试')
+    parser.add_argument('--messages', type=int, default=200000, help='追加的消息数')
+    parser.add_argument('--size', type=int, default=200, help='消息内容长度')
+    parser.add_argument('--intervals', default='0,0.01,0.05', help='fsync_interval列表（秒），0为每条刷盘')
+    parser.add_argument('--range', type=int, default=100, help='每次范围读取的消息数')
+    parser.add_argument('--reads', type=int, default=2000, help='范围读取次数')
+    parser.add_argument('--dir', default=None, help='日志所在目录（默认系统临时目录）')
+    args = parser.parse_args()
+
+    frame = encode_message({'type': 'message', 'content': 'x' * args.size, 'username': 'bench', 'seq': 0})
+    base_dir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        print(f"消息数: {args.messages}, 帧大小: {len(frame)} 字节")
+        print(f"{'刷盘间隔':>8} {'追加/秒':>12} {'MB/秒':>8} {'刷盘次数':>8} {'段数':>5}")
+        log = None
+        for interval in [float(value) for value in args.intervals.split(',')]:
+            # 每条刷盘太慢，只写少量消息估算
+            messages = min(args.messages, 2000) if interval <= 0 else args.messages
+            current, elapsed, stats = bench_append(base_dir, interval, messages, frame)
+            print(f"{interval * 1000:>6.0f}ms {messages / elapsed:>12,.0f} "
+                  f"{stats['bytes'] / elapsed / 1e6:>8.1f} {stats['fsyncs']:>8} {stats['segments']:>5}")
+            if log is None or current.last_seq > log.last_seq:
+                if log is not None:
+                    log.close()
+                log = current
+            else:
+                current.close()
+
+        latencies = bench_reads(log, args.reads, args.range)
+        print(f"随机读取 {args.range} 条（共 {log.last_seq} 条）: "
+              f"p50 {percentile(latencies, 50) * 1e6:.0f}us, p99 {percentile(latencies, 99) * 1e6:.0f}us")
+        log.close()
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
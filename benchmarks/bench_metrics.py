@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+性能指标开销测试
+
+1. 每次记录的耗时：Histogram.record、Counter.inc，以及作为对照的time.perf_counter()
+2. 直方图百分位的精度：与对全部样本排序得到的精确值对比（对数正态分布的模拟延迟）
+3. 多线程同时记录时的吞吐量（多线程引擎中每个读线程都会记录）
+用法: python benchmarks/bench_metrics.py [--samples 1000000] [--threads 4]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import MetricsRegistry, render
+
+
+def per_call(function, argument, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function(argument)
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description='性能指标开销测试')
+    parser.add_argument('--samples', type=int, default=1000000, help='样本数')
+    parser.add_argument('--threads', type=int, default=4, help='并发记录的线程数')
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram('bench_seconds', '测试', stage='bench')
+    counter = registry.counter('bench_total', '测试')
+    rng = random.Random(1)
+    samples = [rng.lognormvariate(-8, 1.5) for _ in range(args.samples)]
+
+    print(f"{'操作':<24} {'ns/次':>8}")
+    print(f"{'perf_counter()':<24} {per_call(lambda _: time.perf_counter(), None, args.samples):>8.0f}")
+    print(f"{'Counter.inc':<24} {per_call(counter.inc, 1, args.samples):>8.0f}")
+    start = time.perf_counter()
+    for value in samples:
+        histogram.record(value)
+    print(f"{'Histogram.record':<24} {(time.perf_counter() - start) / len(samples) * 1e9:>8.0f}")
+
+    samples.sort()
+    print(f"\n{'百分位':>8} {'精确(us)':>12} {'直方图(us)':>12} {'误差':>8}")
+    for pct in (50, 90, 99, 99.9, 99.99):
+        exact = samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+        estimate = histogram.percentile(pct)
+        print(f"{pct:>8} {exact * 1e6:>12.1f} {estimate * 1e6:>12.1f} {(estimate - exact) / exact:>8.1%}")
+
+    start = time.perf_counter()
+    text = render(registry.snapshot())
+    print(f"\n导出: {len(text.splitlines())} 行, {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    shared = registry.histogram('bench_seconds', '测试', stage='threads')
+    per_thread = args.samples // args.threads
+
+    def worker():
+        for value in samples[:per_thread]:
+            shared.record(value)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"{args.threads}线程并发记录: {per_thread * args.threads / elapsed:,.0f} 次/秒，"
+          f"计数 {shared.count:,}（应为 {per_thread * args.threads:,}）")
+
+
+if __name__ == "__main__":
+    main()
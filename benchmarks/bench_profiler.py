@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+采样分析开销测试
+
+1. 每次采样的耗时与线程数的关系（多线程引擎每个连接一个读线程，线程多时采样更贵）
+2. 采样对工作线程吞吐量的影响：不采样与不同采样间隔下，一个CPU密集的线程每秒完成的工作量
+用法: python benchmarks/bench_profiler.py [--threads 10,100,1000] [--depth 20] [--intervals 0.01,0.005,0.001]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiler import sample
+
+
+def idle(depth, stop):
+    """模拟阻塞在recv上的读线程，栈深为depth"""
+    if depth > 0:
+        return idle(depth - 1, stop)
+    stop.wait()
+
+
+def busy(counter, stop):
+    while not stop.is_set():
+        for value in range(1000):
+            value * value
+        counter[0] += 1
+
+
+def throughput(seconds, interval):
+    counter = [0]
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(counter, stop))
+    worker.start()
+    time.sleep(0.2)
+    start_count = counter[0]
+    if interval:
+        profile = sample(seconds, interval)
+        overhead = profile.summary()['overhead']
+    else:
+        time.sleep(seconds)
+        overhead = 0.0
+    done = counter[0] - start_count
+    stop.set()
+    worker.join()
+    return done / seconds, overhead
+
+
+def main():
+    parser = argparse.ArgumentParser(description='采样分析开销测试')
+    parser.add_argument('--threads', default='10,100,1000', help='空闲线程数，逗号分隔')
+    parser.add_argument('--depth', type=int, default=20, help='空闲线程的栈深')
+    parser.add_argument('--intervals', default='0.01,0.005,0.001', help='采样间隔（秒），逗号分隔')
+    parser.add_argument('--seconds', type=float, default=2.0, help='每项测试的采样时长')
+    args = parser.parse_args()
+
+    print(f"{'线程数':>8} {'每次采样(us)':>14} {'5ms间隔开销':>12}")
+    for count in (int(value) for value in args.threads.split(',')):
+        stop = threading.Event()
+        threads = [threading.Thread(target=idle, args=(args.depth, stop), daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        profile = sample(args.seconds, 0.005)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        per_sample = profile.sampling_seconds / profile.samples * 1e6
+        print(f"{count:>8} {per_sample:>14.0f} {profile.summary()['overhead']:>12.1%}")
+
+    baseline, _ = throughput(args.seconds, 0)
+    print(f"\n{'采样间隔':>8} {'工作量/秒':>12} {'吞吐变化':>10} {'采样开销':>10}")
+    print(f"{'不采样':>8} {baseline:>12,.0f} {'':>10} {'':>10}")
+    for interval in (float(value) for value in args.intervals.split(',')):
+        rate, overhead = throughput(args.seconds, interval)
+        print(f"{interval * 1000:>6g}ms {rate:>12,.0f} {(rate - baseline) / baseline:>+10.1%} {overhead:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
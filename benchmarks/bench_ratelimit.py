@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+限速效果测试
+
+N个普通客户端每秒各发几条消息，同时一个客户端尽快连续发送（刷屏），统计：
+1. 普通客户端消息的广播延迟（由一个只接收的连接测量）
+2. 服务器实际广播的刷屏消息数
+分别在不限速、drop、delay三种配置下运行。所有连接都来自127.0.0.1，因此只限制每个连接，不限制IP。
+用法: python benchmarks/bench_ratelimit.py [--clients 20] [--duration 5] [--rate 10] [--engines threaded,asyncio]
+"""
+import argparse
+import selectors
+import socket
+import threading
+import time
+
+from bench_engines import free_port, wait_for_port, percentile, spawn_server, stop_server
+from protocol import FrameDecoder, encode_message, decode_message
+
+
+def run(engine, rate_limit, clients, duration):
+    port = free_port()
+    child = spawn_server(engine, port, {'rate_limit': rate_limit})
+    try:
+        if not wait_for_port(port):
+            print(f"{engine}: 服务器启动失败")
+            return None
+        listener = socket.create_connection(('127.0.0.1', port))
+        normals = [socket.create_connection(('127.0.0.1', port)) for _ in range(clients)]
+        flooder = socket.create_connection(('127.0.0.1', port))
+        flooder.settimeout(1)
+        time.sleep(0.5)
+
+        stop = threading.Event()
+        latencies = []
+        flood_received = [0]
+        flood_sent = [0]
+
+        def reader():
+            # 普通客户端也要读走广播，否则会被当作慢客户端
+            selector = selectors.DefaultSelector()
+            decoders = {}
+            for sock in [listener] + normals:
+                decoders[sock] = FrameDecoder(initial_size=0)
+                selector.register(sock, selectors.EVENT_READ)
+            deadline = None
+            while deadline is None or time.perf_counter() < deadline:
+                if stop.is_set() and deadline is None:
+                    deadline = time.perf_counter() + 2  # 等待推迟处理的消息
+                for key, _ in selector.select(timeout=0.2):
+                    sock = key.fileobj
+                    if decoders[sock].recv_into(sock) == 0:
+                        selector.unregister(sock)
+                        continue
+                    for payload in decoders[sock].frames():
+                        if sock is not listener:
+                            continue
+                        content = decode_message(payload).get('content', '')
+                        body = content.rsplit(': ', 1)[-1]
+                        if body.startswith('flood'):
+                            flood_received[0] += 1
+                        elif body.startswith('normal '):
+                            latencies.append(time.perf_counter() - float(body.split()[1]))
+            selector.close()
+
+        def flood():
+            frame = encode_message({'username': 'flood', 'content': 'flood' + 'x' * 100})
+            while not stop.is_set():
+                try:
+                    flooder.sendall(frame)
+                    flood_sent[0] += 1
+                except socket.timeout:
+                    pass  # delay策略下服务器暂停读取，发送缓冲区会被填满
+                except OSError:
+                    return
+
+        threads = [threading.Thread(target=reader), threading.Thread(target=flood)]
+        for thread in threads:
+            thread.start()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            for sock in normals:
+                sock.sendall(encode_message({'username': 'normal', 'content': f'normal {time.perf_counter()}'}))
+            time.sleep(0.2)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for sock in [listener, flooder] + normals:
+            sock.close()
+        if not latencies:
+            return None
+        return {
+            'normal': len(latencies),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'flood_sent': flood_sent[0],
+            'flood_received': flood_received[0],
+        }
+    finally:
+        stop_server(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='限速效果测试')
+    parser.add_argument('--clients', type=int, default=20, help='普通客户端数（每个每秒5条）')
+    parser.add_argument('--duration', type=float, default=5.0, help='每种配置的测试时长（秒）')
+    parser.add_argument('--rate', type=float, default=10.0, help='每个连接每秒允许的消息数')
+    parser.add_argument('--engines', default='threaded,asyncio', help='要测试的引擎，逗号分隔')
+    args = parser.parse_args()
+
+    configs = [
+        ('不限速', None),
+        ('drop', {'rate': args.rate, 'burst': args.rate * 3, 'policy': 'drop'}),
+        ('delay', {'rate': args.rate, 'burst': args.rate * 3, 'policy': 'delay'}),
+    ]
+    print(f"普通客户端: {args.clients}, 时长: {args.duration}秒, 限额: 每秒{args.rate:g}条")
+    print(f"{'引擎':>10} {'配置':>8} {'普通消息':>8} {'延迟p50(ms)':>12} {'延迟p99(ms)':>12} {'刷屏发出':>10} {'刷屏广播':>10}")
+    for engine in args.engines.split(','):
+        for name, rate_limit in configs:
+            result = run(engine, rate_limit, args.clients, args.duration)
+            if result:
+                print(f"{engine:>10} {name:>8} {result['normal']:>8} {result['p50_ms']:>12.2f} "
+                      f"{result['p99_ms']:>12.2f} {result['flood_sent']:>10,} {result['flood_received']:>10,}")
+
+
+if __name__ == "__main__":
+    main()
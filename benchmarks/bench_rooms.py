@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+房间路由扇出开销测试
+
+在不同的总连接数下，测量向不同大小的房间广播一条消息的耗时（编码+路由+入队），
+说明开销只随房间大小增长，而与服务器上的总连接数无关。
+连接是不带socket的内存对象，只测路由本身，不含网络IO。
+用法: python benchmarks/bench_rooms.py [--totals 1000,10000,50000] [--sizes 10,100,1000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_server import ChatServer, ClientConnection
+
+
+class NullWriter:
+    """代替写线程，只丢弃通知"""
+
+    def notify(self, connection):
+        pass
+
+
+def build_server(total, room_size):
+    server = ChatServer()
+    server.writer = NullWriter()
+    for index in range(total):
+        connection = ClientConnection(None, ('10.0.0.1', index), server.new_outbound_queue())
+        server.register_client(connection)
+        # 总连接按room_size分成多个房间
+        server.rooms.join(f'room-{index // room_size}', connection)
+    return server
+
+
+def bench(server, room, rounds):
+    message = {'type': 'message', 'content': 'x' * 100, 'room': room}
+    start = time.perf_counter()
+    for _ in range(rounds):
+        server.broadcast_message(message, room=room)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='房间路由扇出开销测试')
+    parser.add_argument('--totals', default='1000,10000,50000', help='服务器总连接数列表')
+    parser.add_argument('--sizes', default='10,100,1000', help='房间大小列表')
+    parser.add_argument('--rounds', type=int, default=200, help='每组广播次数')
+    args = parser.parse_args()
+
+    totals = [int(value) for value in args.totals.split(',')]
+    sizes = [int(value) for value in args.sizes.split(',')]
+    print(f"{'总连接数':>8} {'房间大小':>8} {'房间广播(us)':>14} {'每成员(us)':>11} {'全员广播(us)':>14}")
+    for total in totals:
+        for size in sizes:
+            if size > total:
+                continue
+            server = build_server(total, size)
+            per_room = bench(server, 'room-0', args.rounds)
+            everyone = bench(server, None, max(1, args.rounds // 10))
+            print(f"{total:>8} {size:>8} {per_room * 1e6:>14.1f} {per_room * 1e6 / size:>11.2f} "
+                  f"{everyone * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+全文搜索性能测试
+
+生成N条中英文混合的模拟聊天消息建立索引，统计：
+1. 建索引速度，以及广播路径上入队(submit)与直接建索引(add)的单条耗时对比
+2. 不同类型查询的延迟p50/p99（常见词、少见词、多词、带过滤条件、只按用户名过滤）
+用法: python benchmarks/bench_search.py [--messages 1000000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex
+
+WORDS_CN = ('数据库 服务器 部署 上线 回滚 开会 下午 明天 今天 测试 性能 优化 接口 文档 需求 版本 发布 告警 '
+            '日志 监控 网络 延迟 内存 磁盘 备份 迁移 升级 故障 修复 排查 客户 反馈 周报 代码 评审 合并 分支 '
+            '缓存 队列 线程 进程 配置 权限 账号 密码 证书 域名 防火墙 交换机 打印机 会议室 午饭 加班').split()
+WORDS_EN = ('deploy rollback redis mysql nginx kafka docker k8s api bug fix release hotfix ci pipeline '
+            'timeout latency cpu memory disk backup ok thanks lgtm ping pong').split()
+
+
+def make_message(rng, index, start_time):
+    words = [rng.choice(WORDS_CN) if rng.random() < 0.75 else rng.choice(WORDS_EN)
+             for _ in range(rng.randint(3, 12))]
+    if rng.random() < 0.001:
+        words.append('独角兽项目')  # 少见词
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time + index * 0.5))
+    return {
+        'type': 'message',
+        'username': f"user{rng.randint(1, 200)}",
+        'ip': f"192.168.{rng.randint(1, 4)}.{rng.randint(2, 254)}",
+        'timestamp': timestamp,
+        'content': ' '.join(words) if rng.random() < 0.3 else ''.join(words),
+    }
+
+
+def measure(fn, rounds):
+    latencies = []
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全文搜索性能测试')
+    parser.add_argument('--messages', type=int, default=1000000, help='索引的消息数')
+    parser.add_argument('--queries', type=int, default=200, help='每种查询的次数')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start_time = time.time() - args.messages * 0.5
+    messages = [make_message(rng, index, start_time) for index in range(args.messages)]
+
+    index = SearchIndex()
+    # 广播路径上只入队；与直接建索引的耗时对比
+    sample = messages[:10000]
+    begin = time.perf_counter()
+    for seq, message in enumerate(sample, 1):
+        index.submit(message, seq, '大厅')
+    submit_cost = (time.perf_counter() - begin) / len(sample)
+    index = SearchIndex(max_documents=args.messages)
+
+    begin = time.perf_counter()
+    for seq, message in enumerate(messages, 1):
+        index.add(message, seq, '大厅')
+    elapsed = time.perf_counter() - begin
+    stats = index.stats()
+    print(f"索引 {args.messages:,} 条消息用时 {elapsed:.1f}s（{args.messages / elapsed:,.0f} 条/秒），"
+          f"{stats['terms']:,} 个词")
+    print(f"单条耗时: 广播路径入队 {submit_cost * 1e6:.2f}us, 后台建索引 {elapsed / args.messages * 1e6:.1f}us")
+
+    middle = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time + args.messages * 0.25))
+    end = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time + args.messages * 0.3))
+    queries = [
+        ('常见词', lambda: index.search('数据库')),
+        ('少见词', lambda: index.search('独角兽')),
+        ('两个词', lambda: index.search('数据库 迁移')),
+        ('中英混合', lambda: index.search('redis 超时 timeout')),
+        ('词+用户名', lambda: index.search('部署', username='user7')),
+        ('词+时间范围', lambda: index.search('告警', since=middle, until=end)),
+        ('第5页', lambda: index.search('服务器', page=5)),
+        ('只按用户名', lambda: index.search('', username='user42')),
+    ]
+    print(f"{'查询':<10} {'命中数':>10} {'p50(ms)':>9} {'p99(ms)':>9}")
+    for name, query in queries:
+        p50, p99, result = measure(query, args.queries)
+        print(f"{name:<10} {result['total']:>10,} {p50 * 1000:>9.2f} {p99 * 1000:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+批量发送测试
+
+一个ChatClient连续发送N条消息，对比逐条 send_message 与每批B条 send_messages（一次写出）：
+报告发送端的消息/秒，以及另一个客户端收到全部消息为止的消息/秒。服务器在单独的子进程中运行，不限速。
+指定 --url 时改为测试正在运行的应用（main.py）的HTTP接口：/send_message 逐条请求与 /send_messages 批量请求，
+此时需要聊天服务器已在 --chat-port 上运行，且限速足够宽松，否则测到的是限速而不是发送路径。
+用法: python benchmarks/bench_send.py [--messages 20000] [--batches 1,10,50,100] [--url http://127.0.0.1:5000]
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_engines import free_port, wait_for_port, spawn_server, stop_server
+
+MARKER = 'sendbench'
+
+
+def wait_received(receiver, cursor, count, timeout=60):
+    """等待receiver收到count条测试消息，返回新的游标和收到的条数"""
+    received = 0
+    deadline = time.monotonic() + timeout
+    while received < count and time.monotonic() < deadline:
+        messages = receiver.get_new_messages(cursor, 1.0)
+        if messages:
+            cursor = messages[-1]['id']
+            received += sum(1 for message in messages if MARKER in (message.get('content') or ''))
+    return cursor, received
+
+
+def bench_client(port, messages, batches):
+    import builtins
+    quiet = builtins.print
+    builtins.print = lambda *args, **kwargs: None
+    from chat_client import ChatClient
+    sender = ChatClient('127.0.0.1', port, 'sender')
+    receiver = ChatClient('127.0.0.1', port, 'receiver', max_messages=messages * 2)
+    sender.connect()
+    receiver.connect()
+    time.sleep(0.5)
+    builtins.print = quiet
+    cursor = receiver.messages.last_id
+
+    print(f"{messages} 条消息，ChatClient直接发送")
+    print(f"{'每批':>6} {'发送(条/秒)':>12} {'送达(条/秒)':>12} {'送达':>8}")
+    for batch in batches:
+        start = time.perf_counter()
+        if batch == 1:
+            for index in range(messages):
+                sender.send_message(f"{MARKER} {index}")
+        else:
+            for offset in range(0, messages, batch):
+                sender.send_messages([{'content': f"{MARKER} {index}"}
+                                      for index in range(offset, min(offset + batch, messages))])
+        sent = time.perf_counter() - start
+        cursor, received = wait_received(receiver, cursor, messages)
+        delivered = time.perf_counter() - start
+        print(f"{batch:>6} {messages / sent:>12,.0f} {received / delivered:>12,.0f} {received:>8}")
+        time.sleep(0.2)
+    sender.disconnect()
+    receiver.disconnect()
+
+
+def post(opener, url, data):
+    request = urllib.request.Request(url, json.dumps(data).encode('utf-8'),
+                                     {'Content-Type': 'application/json'})
+    with opener.open(request, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def bench_http(url, chat_port, messages, batches):
+    """通过应用的HTTP接口发送，各用一个独立会话（cookie）"""
+    url = url.rstrip('/')
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    result = post(opener, url + '/connect_client', {'host': '127.0.0.1', 'port': chat_port, 'username': 'bench'})
+    if not result.get('success'):
+        print(f"连接失败: {result.get('message')}")
+        return
+
+    print(f"{messages} 条消息，经过 {url}")
+    print(f"{'每批':>6} {'请求数':>8} {'发送(条/秒)':>12} {'失败':>6}")
+    try:
+        for batch in batches:
+            failed = 0
+            requests = 0
+            start = time.perf_counter()
+            if batch == 1:
+                for index in range(messages):
+                    failed += not post(opener, url + '/send_message', {'content': f"{MARKER} {index}"})['success']
+                    requests += 1
+            else:
+                for offset in range(0, messages, batch):
+                    result = post(opener, url + '/send_messages', {'messages': [
+                        f"{MARKER} {index}" for index in range(offset, min(offset + batch, messages))]})
+                    results = result.get('results') or []
+                    failed += min(batch, messages - offset) - sum(1 for item in results if item['success'])
+                    requests += 1
+            elapsed = time.perf_counter() - start
+            print(f"{batch:>6} {requests:>8} {messages / elapsed:>12,.0f} {failed:>6}")
+    finally:
+        post(opener, url + '/disconnect_client', {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量发送测试')
+    parser.add_argument('--messages', type=int, default=20000, help='每种方式发送的消息数')
+    parser.add_argument('--batches', default='1,10,50,100', help='每批消息数，逗号分隔，1表示逐条发送')
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'), help='服务器引擎')
+    parser.add_argument('--url', help='测试正在运行的应用的HTTP接口，例如 http://127.0.0.1:5000')
+    parser.add_argument('--chat-port', type=int, default=8080, help='--url 模式下应用连接的聊天服务器端口')
+    args = parser.parse_args()
+    batches = [int(value) for value in args.batches.split(',')]
+
+    if args.url:
+        bench_http(args.url, args.chat_port, args.messages, batches)
+        return
+    port = free_port()
+    server = spawn_server(args.engine, port, {'queue_frames': 100000})
+    try:
+        if not wait_for_port(port):
+            print("服务器启动失败")
+            return
+        bench_client(port, args.messages, batches)
+    finally:
+        stop_server(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+会话池测试
+
+一个进程中维护N个ChatClient会话，对比两种接收方式：
+1. threads：每个客户端自己的接收线程（原来的方式）
+2. pool：SessionPool，所有连接由一个ClientReactor线程接收
+报告每个会话的内存（RSS增量/N）、进程线程数，以及一条广播送达全部N个会话的延迟。
+每种方式在单独的子进程中测量，服务器也在单独的子进程中运行。
+用法: python benchmarks/bench_sessions.py [--sessions 50,200,500] [--messages 50]
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_engines import free_port, wait_for_port, percentile, process_status, spawn_server, stop_server, \
+    raise_fd_limit
+
+MARKER = 'sessions-bench'
+
+
+def measure(mode, port, count, messages, results):
+    import builtins
+    builtins.print = lambda *args, **kwargs: None
+    raise_fd_limit()
+    from chat_client import ChatClient
+    from client_pool import SessionPool, new_token
+
+    gc.collect()
+    rss_before, _ = process_status(os.getpid())
+    pool = SessionPool(max_sessions=count) if mode == 'pool' else None
+    clients = []
+    for index in range(count):
+        if pool is not None:
+            client = ChatClient('127.0.0.1', port, f'user{index}', **pool.client_limits)
+            pool.connect(new_token(), client)
+        else:
+            client = ChatClient('127.0.0.1', port, f'user{index}')
+            client.connect()
+        clients.append(client)
+    # 等所有连接都收到welcome
+    deadline = time.monotonic() + 30
+    while any(client.epoch is None for client in clients) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.5)
+    gc.collect()
+    rss_after, threads = process_status(os.getpid())
+
+    sender = ChatClient('127.0.0.1', port, 'sender')
+    sender.connect()
+    time.sleep(0.3)
+    cursors = [client.messages.last_id for client in clients]
+    latencies = []
+    lost = 0
+    for index in range(messages):
+        start = time.perf_counter()
+        sender.send_message(f"{MARKER} {index}")
+        marker = f"{MARKER} {index}"
+        for position, client in enumerate(clients):
+            found = False
+            while not found:
+                received = client.get_new_messages(cursors[position], 2.0)
+                if not received:
+                    lost += 1
+                    break
+                cursors[position] = received[-1]['id']
+                found = any(message.get('content', '').endswith(marker) for message in received)
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.02)
+
+    sender.disconnect()
+    if pool is not None:
+        pool.close()
+    else:
+        for client in clients:
+            client.disconnect()
+    results.put({
+        'rss_kb': rss_after - rss_before,
+        'threads': threads,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'lost': lost,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='会话池测试')
+    parser.add_argument('--sessions', default='50,200,500', help='会话数，逗号分隔')
+    parser.add_argument('--messages', type=int, default=50, help='测量送达延迟的消息数')
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'), help='服务器引擎')
+    args = parser.parse_args()
+
+    port = free_port()
+    server = spawn_server(args.engine, port, {'queue_frames': 100000})
+    try:
+        if not wait_for_port(port):
+            print("服务器启动失败")
+            return
+        context = multiprocessing.get_context('spawn')
+        print(f"{'方式':<8} {'会话数':>6} {'每会话内存(KB)':>14} {'线程数':>6} {'送达全部p50(ms)':>16} {'p99(ms)':>9} {'丢失':>5}")
+        for count in (int(value) for value in args.sessions.split(',')):
+            for mode in ('threads', 'pool'):
+                results = context.Queue()
+                child = context.Process(target=measure, args=(mode, port, count, args.messages, results))
+                child.start()
+                result = results.get(timeout=300)
+                child.join()
+                print(f"{mode:<8} {count:>6} {result['rss_kb'] / count:>14.1f} {result['threads']:>6} "
+                      f"{result['p50']:>16.2f} {result['p99']:>9.2f} {result['lost']:>5}")
+    finally:
+        stop_server(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+WebSocket网关测试
+
+N个客户端同时在线，其中一个按固定间隔发消息，测量所有客户端收到广播的延迟和总投递速率，
+对比客户端直接连接聊天服务器（TCP）与浏览器方式经过WebSocket网关两种情况，
+后者的差值就是网关转接的开销。服务器和网关在同一个子进程中运行，避免与测试客户端争用GIL。
+用法: python benchmarks/bench_websocket.py [--clients 300] [--messages 200] [--engine asyncio]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_engines import free_port, wait_for_port, percentile
+from protocol import FrameDecoder, encode_message, decode_message
+from ws_gateway import OP_TEXT, OP_CLOSE, accept_key, unmask
+
+MARKER = 'wsbench'
+
+
+def serve(engine, port, ws_port, ready, stop):
+    from chat_server import ChatServer
+    from async_server import AsyncChatServer
+    from ws_gateway import WebSocketGateway
+    import builtins
+    builtins.print = lambda *args, **kwargs: None
+    server = {'threaded': ChatServer, 'asyncio': AsyncChatServer}[engine](
+        host='127.0.0.1', port=port, queue_frames=100000, queue_bytes=256 * 1024 * 1024)
+    server.start_server()
+    gateway = WebSocketGateway('127.0.0.1', port, host='127.0.0.1', port=ws_port)
+    gateway.start()
+    ready.set()
+    stop.wait()
+    gateway.stop()
+    server.stop_server()
+
+
+class TcpClient:
+    """直接连接聊天服务器"""
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.decoder = FrameDecoder()
+
+    def send(self, message):
+        self.writer.write(encode_message(message))
+
+    async def receive(self):
+        """返回下一批消息，连接关闭时返回None"""
+        data = await self.reader.read(65536)
+        if not data:
+            return None
+        self.decoder.feed(data)
+        return [decode_message(payload) for payload in self.decoder.frames()]
+
+
+class WebSocketClient:
+    """像浏览器一样经过网关：握手、发送带掩码的文本帧、解析服务器的帧"""
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.writer.write((f"GET / HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\n"
+                           f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                           f"Sec-WebSocket-Version: 13\r\n\r\n").encode('latin-1'))
+        response = await self.reader.readuntil(b'\r\n\r\n')
+        if b' 101 ' not in response.split(b'\r\n', 1)[0] or accept_key(key).encode('ascii') not in response:
+            raise ConnectionError(f"握手失败: {response[:80]!r}")
+
+    def send(self, message):
+        payload = json.dumps(message).encode('utf-8')
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = bytes((0x80 | OP_TEXT, 0x80 | length))
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | OP_TEXT, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | OP_TEXT, 0x80 | 127, length)
+        self.writer.write(header + mask + unmask(payload, mask))
+
+    async def receive(self):
+        try:
+            first, second = await self.reader.readexactly(2)
+            length = second & 0x7F
+            if length == 126:
+                (length,) = struct.unpack('!H', await self.reader.readexactly(2))
+            elif length == 127:
+                (length,) = struct.unpack('!Q', await self.reader.readexactly(8))
+            payload = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        if first & 0x0F == OP_CLOSE:
+            return None
+        return [json.loads(payload)]
+
+
+async def run(transport, port, clients, messages, interval):
+    """返回 (每条投递的延迟毫秒列表, 总耗时秒)"""
+    client_class = WebSocketClient if transport == 'websocket' else TcpClient
+    receivers = []
+    for _ in range(clients):
+        client = client_class()
+        await client.connect(port)
+        receivers.append(client)
+    sender = receivers[0]
+    latencies = []
+    done = asyncio.Event()
+    expected = clients * messages
+
+    async def consume(client):
+        while True:
+            batch = await client.receive()
+            if batch is None:
+                return
+            now = time.perf_counter()
+            for message in batch:
+                content = message.get('content', '') if message.get('type') == 'message' else ''
+                if MARKER in content:
+                    latencies.append((now - float(content.rsplit(' ', 1)[1])) * 1000)
+                    if len(latencies) == expected:
+                        done.set()
+
+    tasks = [asyncio.ensure_future(consume(client)) for client in receivers]
+    await asyncio.sleep(0.5)
+    start = time.perf_counter()
+    for _ in range(messages):
+        sender.send({'type': 'message', 'username': 'bench', 'content': f"{MARKER} {time.perf_counter()}"})
+        await asyncio.sleep(interval)
+    try:
+        await asyncio.wait_for(done.wait(), 30)
+    except asyncio.TimeoutError:
+        print(f"  {transport}: 超时，只收到 {len(latencies)}/{expected} 条")
+    elapsed = time.perf_counter() - start
+    for task in tasks:
+        task.cancel()
+    for client in receivers:
+        client.writer.close()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebSocket网关测试')
+    parser.add_argument('--clients', type=int, default=300, help='同时在线的客户端数')
+    parser.add_argument('--messages', type=int, default=200, help='发送的消息数')
+    parser.add_argument('--interval', type=float, default=0.01, help='发送间隔（秒）')
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'), help='服务器引擎')
+    args = parser.parse_args()
+
+    port, ws_port = free_port(), free_port()
+    context = multiprocessing.get_context('spawn')
+    ready, stop = context.Event(), context.Event()
+    child = context.Process(target=serve, args=(args.engine, port, ws_port, ready, stop))
+    child.start()
+    try:
+        if not ready.wait(15) or not wait_for_port(port) or not wait_for_port(ws_port):
+            print("服务器启动失败")
+            return
+        print(f"{args.clients} 个客户端，{args.messages} 条消息，引擎 {args.engine}")
+        print(f"{'连接方式':<12} {'投递数':>8} {'投递/秒':>10} {'p50(ms)':>9} {'p90(ms)':>9} {'p99(ms)':>9}")
+        for transport, target in (('tcp', port), ('websocket', ws_port)):
+            latencies, elapsed = asyncio.run(run(transport, target, args.clients, args.messages, args.interval))
+            if not latencies:
+                continue
+            print(f"{transport:<12} {len(latencies):>8} {len(latencies) / elapsed:>10,.0f} "
+                  f"{percentile(latencies, 50):>9.2f} {percentile(latencies, 90):>9.2f} "
+                  f"{percentile(latencies, 99):>9.2f}")
+    finally:
+        stop.set()
+        child.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
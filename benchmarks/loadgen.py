@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+无界面负载生成器
+
+启动N个模拟客户端，使用与界面客户端相同的协议（welcome/hello协商编码、压缩和心跳，回复ping），
+其中S个客户端按给定速率发送给定大小的消息，所有客户端都接收。统计：
+1. 端到端扇出延迟（从发送到每个接收者收到）的百分位
+2. 每秒送达的消息数和丢失率（每条消息应送达全部N个客户端）
+3. 服务器进程（含worker子进程）的CPU占用和最大RSS，仅Linux
+
+模拟客户端可以运行在多个线程、一个asyncio事件循环或多个进程（每个进程一个事件循环）中，
+客户端数较多时用多进程，避免负载生成器自己先成为瓶颈。
+--clients 给出多个值时依次测试，丢失率超过 --max-loss 后停止，用来找出服务器能承载的连接数。
+结果保存为JSON，--compare 指定之前的结果文件时打印对比。
+
+用法: python benchmarks/loadgen.py [--engine asyncio] [--clients 100,500,1000] [--senders 10] [--rate 5]
+                                 [--size 100] [--duration 10] [--driver asyncio|threads|processes]
+                                 [--processes 4] [--codec binary|json] [--no-compress]
+                                 [--target host:port] [--output result.json] [--compare old.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_engines import free_port, wait_for_port, raise_fd_limit, spawn_server, stop_server
+from protocol import FrameDecoder, encode_message, decode_message
+from codec import CODEC_JSON
+from compression import COMPRESSION_ZLIB, StreamCompressor, StreamDecompressor, is_compressed
+from metrics import MetricsRegistry, merge, percentile_of
+
+# 消息正文的标记，区分负载消息和系统消息
+MARKER = 'lg'
+LATENCY = 'loadgen_latency_seconds'
+# 发送结束后继续接收的时间（秒），等待仍在路上的消息
+DRAIN_SECONDS = 2.0
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LoadClient:
+    """一个模拟客户端的协议状态，不负责IO"""
+
+    def __init__(self, index, codec, compress):
+        self.index = index
+        self.username = f'lg{index}'
+        self.preferred_codec = codec
+        self.compress = compress
+        self.codec = CODEC_JSON
+        self.compressor = None
+        self.decompressor = None
+        self.ready = False  # 已处理welcome，可以发送消息
+        self.seq = 0
+
+    def handle_payload(self, payload, recorder, send):
+        """处理收到的一个帧，需要回复时调用send(frame)"""
+        if is_compressed(payload):
+            payload = self.decompressor.decompress(payload)
+        message = decode_message(payload)
+        message_type = message.get('type')
+        if message_type == 'message':
+            body = message.get('content', '').split(': ', 1)[-1]
+            if body.startswith(MARKER + ' '):
+                sent_at = float(body.split(' ', 2)[1])
+                if sent_at >= recorder.start_at:
+                    recorder.record(time.time() - sent_at)
+        elif message_type == 'welcome':
+            send(self.hello(message))
+        elif message_type == 'ping':
+            send(self.encode({'type': 'pong'}))
+
+    def hello(self, welcome):
+        """与界面客户端相同的协商：服务器支持时使用希望的编码和压缩，并开启心跳"""
+        hello = {'type': 'hello'}
+        if self.preferred_codec != CODEC_JSON and self.preferred_codec in (welcome.get('codecs') or ()):
+            hello['codec'] = self.preferred_codec
+        if self.compress and COMPRESSION_ZLIB in (welcome.get('compression') or ()):
+            hello['compress'] = COMPRESSION_ZLIB
+            self.decompressor = StreamDecompressor()
+        if welcome.get('heartbeat'):
+            hello['heartbeat'] = True
+        frame = encode_message(hello)
+        self.codec = hello.get('codec', CODEC_JSON)
+        if 'compress' in hello:
+            self.compressor = StreamCompressor()
+        self.ready = True
+        return frame
+
+    def encode(self, message_data):
+        """编码要发出的消息；压缩流有状态，调用顺序必须与发送顺序一致"""
+        frame = encode_message(message_data, self.codec)
+        if self.compressor is not None:
+            frame = self.compressor.compress_frame(frame)
+        return frame
+
+    def next_message(self, size):
+        self.seq += 1
+        body = f"{MARKER} {time.time():.6f} {self.index}-{self.seq} "
+        return self.encode({'type': 'message', 'username': self.username,
+                            'content': body + 'x' * max(0, size - len(body))})
+
+
+class Recorder:
+    """收发计数和延迟直方图；快照可以跨进程合并"""
+
+    def __init__(self, start_at=float('inf')):
+        self.registry = MetricsRegistry()
+        self.latency = self.registry.histogram(LATENCY, '端到端扇出延迟')
+        self.sent = self.registry.counter('loadgen_sent_total', '测量期间发出的消息数')
+        self.errors = self.registry.counter('loadgen_errors_total', '连接失败或中途断开的客户端数')
+        self.start_at = start_at
+        self.max_latency = 0.0
+
+    def record(self, latency):
+        self.latency.record(latency)
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+    def snapshot(self):
+        return {'metrics': self.registry.snapshot(), 'max_latency': self.max_latency}
+
+
+def pace(rate, start_at, stop_at):
+    """发送时刻：从start_at起每1/rate秒一次，直到stop_at"""
+    interval = 1.0 / rate
+    moment = start_at
+    while moment < stop_at:
+        yield moment
+        moment += interval
+
+
+# ---- asyncio驱动 ----
+
+class LoadProtocol(asyncio.BufferedProtocol):
+    """与服务器的ChatProtocol一样，数据直接读入帧解码器的缓冲区"""
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+        self.decoder = FrameDecoder(initial_size=0)
+        self.transport = None
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        try:
+            for payload in self.decoder.frames():
+                self.client.handle_payload(payload, self.recorder, self.transport.write)
+        except ValueError:
+            self.recorder.errors.inc()
+            self.transport.abort()
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(True)
+
+
+async def async_client(client, host, port, args, recorder, connected, stop_at, sender):
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_connection(lambda: LoadProtocol(client, recorder), host, port)
+    except OSError:
+        recorder.errors.inc()
+        connected.append(False)
+        return
+    connected.append(True)
+
+    async def send_loop():
+        # 等待start_at（由主进程确定）后开始按速率发送
+        while recorder.start_at == float('inf') or not client.ready:
+            await asyncio.sleep(0.01)
+        for moment in pace(args.rate, recorder.start_at, stop_at[0]):
+            delay = moment - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if transport.is_closing():
+                return
+            transport.write(client.next_message(args.size))
+            recorder.sent.inc()
+
+    sending = asyncio.ensure_future(send_loop()) if sender else None
+    # 一直接收到发送结束后DRAIN_SECONDS秒，中途断开计为错误
+    while time.time() < stop_at[0] + DRAIN_SECONDS:
+        if protocol.closed.done():
+            recorder.errors.inc()
+            break
+        await asyncio.sleep(0.1)
+    if sending is not None:
+        sending.cancel()
+    transport.close()
+
+
+async def async_driver(indexes, sender_indexes, host, port, args, recorder, on_connected, get_start):
+    """在一个事件循环中运行一组客户端；stop_at在确定start_at后才知道，用列表传递"""
+    connected = []
+    stop_at = [float('inf')]
+    tasks = [asyncio.ensure_future(async_client(LoadClient(index, args.codec, not args.no_compress), host, port,
+                                                args, recorder, connected, stop_at, index in sender_indexes))
+             for index in indexes]
+    while len(connected) < len(indexes):
+        await asyncio.sleep(0.01)
+    on_connected(sum(connected))
+    while True:
+        start_at = get_start()
+        if start_at:
+            break
+        await asyncio.sleep(0.01)
+    recorder.start_at = start_at
+    stop_at[0] = start_at + args.duration
+    await asyncio.gather(*tasks)
+
+
+def run_asyncio(indexes, sender_indexes, host, port, args, on_connected, get_start):
+    recorder = Recorder()
+    asyncio.run(async_driver(indexes, sender_indexes, host, port, args, recorder, on_connected, get_start))
+    return recorder.snapshot()
+
+
+def process_main(indexes, sender_indexes, host, port, args, connected_queue, start_value, results):
+    """负载进程入口：连接完成后报告，等主进程给出开始时间"""
+    raise_fd_limit()
+    snapshot = run_asyncio(indexes, sender_indexes, host, port, args, connected_queue.put,
+                           lambda: start_value.value)
+    results.put(snapshot)
+
+
+# ---- 多线程驱动 ----
+
+def thread_client(client, host, port, args, recorder, connected, stop_at, sender):
+    try:
+        sock = socket.create_connection((host, port))
+    except OSError:
+        recorder.errors.inc()
+        connected.append(False)
+        return
+    connected.append(True)
+    sock.settimeout(0.5)
+    # 压缩流有状态：回复（hello、pong）和发送线程的消息必须按编码的顺序写出
+    send_lock = threading.Lock()
+
+    def send_loop():
+        while recorder.start_at == float('inf') or not client.ready:
+            time.sleep(0.01)
+        try:
+            for moment in pace(args.rate, recorder.start_at, stop_at[0]):
+                delay = moment - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                with send_lock:
+                    sock.sendall(client.next_message(args.size))
+                recorder.sent.inc()
+        except OSError:
+            pass
+
+    if sender:
+        threading.Thread(target=send_loop, daemon=True).start()
+    decoder = FrameDecoder()
+    try:
+        while time.time() < stop_at[0] + DRAIN_SECONDS:
+            try:
+                if decoder.recv_into(sock) == 0:
+                    recorder.errors.inc()
+                    break
+            except socket.timeout:
+                continue
+            for payload in decoder.frames():
+                with send_lock:
+                    client.handle_payload(payload, recorder, sock.sendall)
+    except (OSError, ValueError):
+        recorder.errors.inc()
+    finally:
+        sock.close()
+
+
+def run_threads(indexes, sender_indexes, host, port, args, on_connected, get_start):
+    recorder = Recorder()
+    connected = []
+    stop_at = [float('inf')]
+    threads = [threading.Thread(target=thread_client, daemon=True,
+                                args=(LoadClient(index, args.codec, not args.no_compress), host, port, args,
+                                      recorder, connected, stop_at, index in sender_indexes))
+               for index in indexes]
+    for thread in threads:
+        thread.start()
+    while len(connected) < len(indexes):
+        time.sleep(0.01)
+    on_connected(sum(connected))
+    while not get_start():
+        time.sleep(0.01)
+    stop_at[0] = get_start() + args.duration
+    recorder.start_at = get_start()
+    for thread in threads:
+        thread.join()
+    return recorder.snapshot()
+
+
+# ---- 服务器资源占用 ----
+
+def process_tree(pid):
+    """pid及其所有子孙进程，读取/proc，仅Linux"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, ()))
+    return tree
+
+
+def tree_usage(pid):
+    """进程树的CPU时间（秒）和RSS（MB）"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    page = os.sysconf('SC_PAGE_SIZE')
+    cpu = rss = 0.0
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # ')'之后第12、13个字段是utime、stime，第22个是rss（页数）
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+        rss += int(fields[21]) * page / 1024 / 1024
+    return cpu, rss
+
+
+class ServerMonitor:
+    """测量期间定期采样服务器进程树的CPU和RSS"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.supported = pid is not None and os.path.exists(f'/proc/{pid}/stat')
+        self.peak_rss = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.supported:
+            return
+        self._cpu, _ = tree_usage(self.pid)
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(0.2):
+            self.peak_rss = max(self.peak_rss, tree_usage(self.pid)[1])
+
+    def stop(self):
+        if not self.supported:
+            return None
+        self._stop.set()
+        self._thread.join()
+        cpu, rss = tree_usage(self.pid)
+        return {
+            'cpu_percent': round((cpu - self._cpu) / (time.time() - self._started) * 100, 1),
+            'peak_rss_mb': round(max(self.peak_rss, rss), 1),
+        }
+
+
+# ---- 一次测试 ----
+
+def run_load(args, clients, host, port, server_pid):
+    senders = set(range(min(args.senders, clients)))
+    monitor = ServerMonitor(server_pid)
+    connect_started = time.time()
+
+    if args.driver == 'processes':
+        context = multiprocessing.get_context('spawn')
+        connected_queue = context.Queue()
+        results = context.Queue()
+        start_value = context.Value('d', 0.0)
+        groups = [list(range(clients))[offset::args.processes] for offset in range(args.processes)]
+        groups = [group for group in groups if group]
+        processes = [context.Process(target=process_main, daemon=True,
+                                     args=(group, senders, host, port, args, connected_queue, start_value, results))
+                     for group in groups]
+        for process in processes:
+            process.start()
+        connected = sum(connected_queue.get() for _ in processes)
+        connect_seconds = time.time() - connect_started
+        time.sleep(0.5)  # 等服务器登记完所有连接
+        monitor.start()
+        start_value.value = time.time() + 0.2
+        snapshots = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    else:
+        state = {'connected': None, 'start': 0.0}
+        driver = run_asyncio if args.driver == 'asyncio' else run_threads
+        outcome = []
+
+        def on_connected(count):
+            state['connected'] = count
+
+        thread = threading.Thread(target=lambda: outcome.append(driver(
+            list(range(clients)), senders, host, port, args, on_connected, lambda: state['start'])))
+        thread.start()
+        while state['connected'] is None:
+            time.sleep(0.01)
+        connected = state['connected']
+        connect_seconds = time.time() - connect_started
+        time.sleep(0.5)
+        monitor.start()
+        state['start'] = time.time() + 0.2
+        thread.join()
+        snapshots = outcome
+    server = monitor.stop()
+
+    merged = merge(snapshot['metrics'] for snapshot in snapshots)
+    values = {entry['name']: entry for entry in merged}
+    latency = values.get(LATENCY, {'buckets': [], 'count': 0})
+    sent = values['loadgen_sent_total']['value']
+    expected = sent * connected
+    delivered = latency['count']
+    percentiles = {f"p{pct:g}": round(percentile_of(latency['buckets'], delivered, pct) * 1000, 3)
+                   for pct in LATENCY_PERCENTILES} if delivered else {}
+    percentiles['max'] = round(max(snapshot['max_latency'] for snapshot in snapshots) * 1000, 3)
+    return {
+        'clients': clients,
+        'connected': connected,
+        'connect_seconds': round(connect_seconds, 3),
+        'sent': sent,
+        'expected': expected,
+        'delivered': delivered,
+        'delivered_per_sec': round(delivered / args.duration, 1),
+        'loss': round(1 - delivered / expected, 5) if expected else None,
+        'errors': values['loadgen_errors_total']['value'],
+        'latency_ms': percentiles,
+        'server': server,
+    }
+
+
+def print_result(result):
+    latency = result['latency_ms']
+    server = result['server'] or {}
+    loss = f"{result['loss']:.2%}" if result['loss'] is not None else '-'
+    print(f"{result['clients']:>7} {result['connected']:>7} {result['sent']:>8,} {result['delivered_per_sec']:>12,.0f} "
+          f"{loss:>8} {latency.get('p50', 0):>9.2f} {latency.get('p99', 0):>9.2f} {latency['max']:>9.2f} "
+          f"{server.get('cpu_percent', 0):>7.1f} {server.get('peak_rss_mb', 0):>8.1f}")
+
+
+def compare(previous, current):
+    """按客户端数对比两次运行的主要指标"""
+    old_runs = {run['clients']: run for run in previous['runs']}
+    print(f"\n与 {previous['timestamp']} 的结果对比:")
+    fields = (('送达/秒', lambda run: run['delivered_per_sec']),
+              ('丢失率', lambda run: run['loss']),
+              ('p50(ms)', lambda run: run['latency_ms'].get('p50')),
+              ('p99(ms)', lambda run: run['latency_ms'].get('p99')),
+              ('CPU%', lambda run: (run['server'] or {}).get('cpu_percent')),
+              ('RSS(MB)', lambda run: (run['server'] or {}).get('peak_rss_mb')))
+    for run in current['runs']:
+        old = old_runs.get(run['clients'])
+        if old is None:
+            continue
+        changes = []
+        for name, read in fields:
+            before, after = read(old), read(run)
+            if before is None or after is None:
+                continue
+            delta = f"{(after - before) / before:+.1%}" if before else '-'
+            changes.append(f"{name} {before:g}→{after:g} ({delta})")
+        print(f"  {run['clients']} 客户端: " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='无界面负载生成器')
+    parser.add_argument('--engine', default='asyncio', help='服务器引擎: threaded, asyncio, multiprocess')
+    parser.add_argument('--server-options', default='{}', help='传给服务器的其他参数（JSON对象）')
+    parser.add_argument('--target', help='测试已经运行的服务器 host:port，不再启动本地服务器')
+    parser.add_argument('--clients', default='100,500', help='客户端数，逗号分隔时依次测试')
+    parser.add_argument('--senders', type=int, default=10, help='发送消息的客户端数')
+    parser.add_argument('--rate', type=float, default=5.0, help='每个发送者每秒发送的消息数')
+    parser.add_argument('--size', type=int, default=100, help='消息正文字节数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每次测试的发送时长（秒）')
+    parser.add_argument('--driver', default='asyncio', choices=('asyncio', 'threads', 'processes'),
+                        help='模拟客户端的运行方式')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='processes驱动的进程数')
+    parser.add_argument('--codec', default='binary', choices=('binary', 'json'), help='希望使用的编码')
+    parser.add_argument('--no-compress', action='store_true', help='不协商压缩')
+    parser.add_argument('--max-loss', type=float, default=0.01, help='丢失率超过该值后停止后续测试')
+    parser.add_argument('--output', help='结果保存到该JSON文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果对比')
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    counts = [int(value) for value in args.clients.split(',')]
+    if limit and limit < max(counts) * 2 + 100 and not args.target:
+        print(f"文件描述符上限 {limit} 可能不足以在本机建立 {max(counts)} 个连接（客户端和服务器各占一个）")
+
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': config, 'runs': []}
+    print(f"引擎: {args.target or args.engine}, 驱动: {args.driver}, 发送者: {args.senders} × {args.rate:g}条/秒, "
+          f"消息: {args.size}字节, 时长: {args.duration:g}秒")
+    print(f"{'客户端':>7} {'已连接':>7} {'发送':>8} {'送达/秒':>12} {'丢失':>8} {'p50(ms)':>9} {'p99(ms)':>9} "
+          f"{'max(ms)':>9} {'CPU%':>7} {'RSS(MB)':>8}")
+    for clients in counts:
+        child = None
+        if args.target:
+            host, port = args.target.rsplit(':', 1)
+            port = int(port)
+        else:
+            host, port = '127.0.0.1', free_port()
+            child = spawn_server(args.engine, port, json.loads(args.server_options))
+        try:
+            if child and not wait_for_port(port):
+                print(f"{args.engine}: 服务器启动失败")
+                break
+            result = run_load(args, clients, host, port, child.pid if child else None)
+        finally:
+            if child:
+                stop_server(child)
+        report['runs'].append(result)
+        print_result(result)
+        if result['loss'] is None or result['loss'] > args.max_loss:
+            print(f"丢失率超过 {args.max_loss:.0%}，停止测试")
+            break
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+录制流量重放
+
+把服务器录制的真实流量（见capture.py，/capture 或 /start_server 的 capture_path）重放到各个服务器引擎：
+每个录制的连接对应一个新连接，按录制的时间逐字节发出原来的帧（含协商和压缩流），并接收服务器的广播。
+--speed 1 按原速重放，N 为N倍速，0 为不等待、尽快发出（此时连接断开推迟到最后，否则广播还没送达连接就已关闭）。统计每个引擎：
+1. 重放用时、每秒送达的消息数
+2. 聊天消息从发出到各连接收到的延迟百分位（按用户名和正文匹配）
+3. 服务器进程的CPU和最大RSS（仅Linux）
+第一个引擎作为基准，其余引擎显示与它的差异；--compare 指定之前保存的JSON结果时按引擎对比，用来发现性能回退。
+所有重放连接都来自本机，目标服务器的按IP限速会比录制时更早触发，本地启动的服务器不限速。
+
+用法: python benchmarks/replay.py capture.chatcap [更多录制文件...] [--engines threaded,asyncio]
+                                [--speed 1] [--target host:port] [--output result.json] [--compare old.json]
+      python benchmarks/replay.py capture.chatcap --info
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_engines import free_port, wait_for_port, raise_fd_limit, spawn_server, stop_server
+from loadgen import ServerMonitor
+from capture import OPEN, FRAME, CLOSE, read_capture
+from codec import content_prefix
+from compression import StreamDecompressor, is_compressed
+from metrics import Histogram
+from protocol import FrameDecoder, ProtocolError, encode_frame, decode_message
+
+# 最后一个事件之后继续接收的时间（秒），期间没有新消息送达时提前结束
+DRAIN_SECONDS = 5.0
+QUIET_SECONDS = 1.0
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class Event:
+    __slots__ = ('time', 'conn', 'kind', 'data', 'chat_key', 'compress')
+
+    def __init__(self, timestamp, conn, kind, data):
+        self.time = timestamp
+        self.conn = conn
+        self.kind = kind
+        self.data = data
+        self.chat_key = None   # 聊天消息的(用户名, 正文)，用来匹配广播计算延迟
+        self.compress = False  # 协商压缩的hello，之后服务器发来的帧可能是压缩的
+
+
+def load_capture(paths):
+    """
+    读取一个或多个录制文件（多进程模式下每个worker一个）并按时间合并，每个文件内保持原来的顺序；
+    同时解码每个连接发出的帧，找出聊天消息和协商压缩的hello
+    """
+    streams = []
+    for file_index, path in enumerate(paths):
+        streams.append([Event(timestamp, (file_index, conn_id), kind, data)
+                        for kind, timestamp, conn_id, data in read_capture(path)])
+    events = list(heapq.merge(*streams, key=lambda event: event.time))
+
+    decompressors = {}
+    for event in events:
+        if event.kind != FRAME:
+            continue
+        payload = event.data
+        try:
+            if is_compressed(payload):
+                payload = decompressors[event.conn].decompress(payload)
+            message = decode_message(payload)
+        except (KeyError, ValueError, ProtocolError):
+            # 录制开始前协商的压缩流等无法解码的帧，重放时仍然原样发出
+            continue
+        if not isinstance(message, dict):
+            continue
+        message_type = message.get('type', 'message')
+        if message_type == 'hello' and message.get('compress'):
+            event.compress = True
+            decompressors[event.conn] = StreamDecompressor()
+        elif message_type == 'message':
+            event.chat_key = (message.get('username', '未知用户'), message.get('content', ''))
+    return events
+
+
+def describe(events):
+    """录制内容的概况"""
+    connections = {event.conn for event in events if event.kind == OPEN}
+    frames = [event for event in events if event.kind == FRAME]
+    chats = sum(1 for event in frames if event.chat_key)
+    duration = events[-1].time - events[0].time if events else 0.0
+    per_second = {}
+    for event in frames:
+        second = int(event.time)
+        per_second[second] = per_second.get(second, 0) + 1
+    return {
+        'duration': round(duration, 1),
+        'connections': len(connections),
+        'frames': len(frames),
+        'chat_messages': chats,
+        'bytes': sum(len(event.data) for event in frames),
+        'peak_frames_per_sec': max(per_second.values()) if per_second else 0,
+        'largest_frame': max((len(event.data) for event in frames), default=0),
+    }
+
+
+class ReplayProtocol(asyncio.BufferedProtocol):
+    def __init__(self, replayer):
+        self.replayer = replayer
+        self.decoder = FrameDecoder(initial_size=0)
+        self.decompressor = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        try:
+            self.decoder.buffer_updated(nbytes)
+            for payload in self.decoder.frames():
+                if is_compressed(payload):
+                    payload = self.decompressor.decompress(payload)
+                self.replayer.received(decode_message(payload))
+        except (ValueError, AttributeError, ProtocolError):
+            self.replayer.errors += 1
+            self.transport.abort()
+
+    def connection_lost(self, exc):
+        pass
+
+
+class Replayer:
+    def __init__(self, events, speed, host, port):
+        self.events = events
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.latency = Histogram()
+        self.sent_at = {}  # (用户名, 正文) -> 最近一次发出的时间
+        self.connections = {}
+        self.closing = []  # 全速重放时推迟断开的连接
+        self.sent_frames = 0
+        self.skipped = 0  # 连接已断开或没有连上，无法发出的帧
+        self.delivered = 0
+        self.matched = 0
+        self.errors = 0
+        self.last_delivery = 0.0
+
+    def received(self, message):
+        now = time.perf_counter()
+        self.delivered += 1
+        self.last_delivery = now
+        if message.get('type') != 'message':
+            return
+        content = message.get('content', '')
+        prefix = content_prefix(message)
+        if content.startswith(prefix):
+            sent = self.sent_at.get((message.get('username'), content[len(prefix):]))
+            if sent is not None:
+                self.matched += 1
+                self.latency.record(now - sent)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        origin = self.events[0].time
+        for event in self.events:
+            if self.speed:
+                delay = start + (event.time - origin) / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if event.kind == OPEN:
+                try:
+                    _, protocol = await loop.create_connection(lambda: ReplayProtocol(self), self.host, self.port)
+                except OSError:
+                    self.errors += 1
+                    continue
+                self.connections[event.conn] = protocol
+            elif event.kind == FRAME:
+                protocol = self.connections.get(event.conn)
+                if protocol is None or protocol.transport.is_closing():
+                    self.skipped += 1
+                    continue
+                if event.compress:
+                    protocol.decompressor = StreamDecompressor()
+                if event.chat_key:
+                    self.sent_at[event.chat_key] = time.perf_counter()
+                protocol.transport.write(encode_frame(event.data))
+                self.sent_frames += 1
+                if not self.speed and self.sent_frames % 100 == 0:
+                    # 全速重放时定期让出事件循环，接收不至于积压
+                    await asyncio.sleep(0)
+            elif event.kind == CLOSE:
+                protocol = self.connections.pop(event.conn, None)
+                if protocol is None:
+                    continue
+                if self.speed:
+                    protocol.transport.close()
+                else:
+                    self.closing.append(protocol)
+        sent_done = time.perf_counter()
+
+        # 等待仍在路上的广播
+        deadline = sent_done + DRAIN_SECONDS
+        while time.perf_counter() < deadline:
+            if time.perf_counter() - max(self.last_delivery, sent_done) > QUIET_SECONDS:
+                break
+            await asyncio.sleep(0.05)
+        for protocol in list(self.connections.values()) + self.closing:
+            protocol.transport.close()
+        end = max(self.last_delivery, sent_done)
+        return sent_done - start, end - start
+
+
+def replay(events, speed, host, port, server_pid):
+    replayer = Replayer(events, speed, host, port)
+    monitor = ServerMonitor(server_pid)
+    monitor.start()
+    send_seconds, total_seconds = asyncio.run(replayer.run())
+    server = monitor.stop()
+    latency = {f"p{pct:g}": round(replayer.latency.percentile(pct) * 1000, 3)
+               for pct in LATENCY_PERCENTILES} if replayer.latency.count else {}
+    return {
+        'send_seconds': round(send_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'sent_frames': replayer.sent_frames,
+        'skipped_frames': replayer.skipped,
+        'delivered': replayer.delivered,
+        'delivered_per_sec': round(replayer.delivered / total_seconds, 1) if total_seconds else None,
+        'latency_samples': replayer.matched,
+        'latency_ms': latency,
+        'errors': replayer.errors,
+        'server': server,
+    }
+
+
+def change(before, after):
+    if not before or after is None:
+        return ''
+    return f"({(after - before) / before:+.1%})"
+
+
+def print_result(name, result, baseline=None):
+    latency = result['latency_ms']
+    server = result['server'] or {}
+    base_latency = (baseline or {}).get('latency_ms', {})
+    base_server = (baseline or {}).get('server') or {}
+    print(f"{name:>12} {result['total_seconds']:>8.2f} {result['sent_frames']:>8,} {result['delivered']:>9,} "
+          f"{result['delivered_per_sec'] or 0:>10,.0f} {latency.get('p50', 0):>9.2f} {latency.get('p99', 0):>9.2f} "
+          f"{server.get('cpu_percent', 0):>7.1f} {server.get('peak_rss_mb', 0):>8.1f}")
+    if baseline is not None:
+        print(f"{'':>12} {change(baseline['total_seconds'], result['total_seconds']):>8} {'':>8} "
+              f"{change(baseline['delivered'], result['delivered']):>9} "
+              f"{change(baseline['delivered_per_sec'], result['delivered_per_sec']):>10} "
+              f"{change(base_latency.get('p50'), latency.get('p50')):>9} "
+              f"{change(base_latency.get('p99'), latency.get('p99')):>9} "
+              f"{change(base_server.get('cpu_percent'), server.get('cpu_percent')):>7} "
+              f"{change(base_server.get('peak_rss_mb'), server.get('peak_rss_mb')):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='录制流量重放')
+    parser.add_argument('captures', nargs='+', help='录制文件，多进程模式下的各worker文件一起给出')
+    parser.add_argument('--engines', default='threaded,asyncio', help='依次重放到这些引擎，逗号分隔')
+    parser.add_argument('--server-options', default='{}', help='传给服务器的其他参数（JSON对象）')
+    parser.add_argument('--target', help='重放到已经运行的服务器 host:port')
+    parser.add_argument('--speed', type=float, default=1.0, help='重放速度倍数，0为尽快发出')
+    parser.add_argument('--info', action='store_true', help='只显示录制内容的概况')
+    parser.add_argument('--output', help='结果保存到该JSON文件')
+    parser.add_argument('--compare', help='与之前保存的JSON结果对比')
+    args = parser.parse_args()
+
+    events = load_capture(args.captures)
+    if not events:
+        print("录制文件中没有记录")
+        return
+    info = describe(events)
+    print(f"录制: {info['duration']}秒, {info['connections']} 个连接, {info['frames']:,} 帧 "
+          f"(聊天消息 {info['chat_messages']:,}), {info['bytes']:,} 字节, "
+          f"峰值 {info['peak_frames_per_sec']} 帧/秒, 最大帧 {info['largest_frame']:,} 字节")
+    if args.info:
+        return
+
+    raise_fd_limit()
+    speed = f"{args.speed:g}x" if args.speed else '全速'
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'captures': args.captures, 'speed': args.speed,
+              'capture': info, 'runs': {}}
+    targets = [args.target] if args.target else args.engines.split(',')
+    print(f"重放速度: {speed}")
+    print(f"{'引擎':>12} {'用时(秒)':>8} {'发出帧':>8} {'送达':>9} {'送达/秒':>10} {'p50(ms)':>9} {'p99(ms)':>9} "
+          f"{'CPU%':>7} {'RSS(MB)':>8}")
+    baseline = None
+    for name in targets:
+        child = None
+        if args.target:
+            host, port = args.target.rsplit(':', 1)
+            port = int(port)
+        else:
+            host, port = '127.0.0.1', free_port()
+            child = spawn_server(name, port, json.loads(args.server_options))
+        try:
+            if child and not wait_for_port(port):
+                print(f"{name}: 服务器启动失败")
+                continue
+            result = replay(events, args.speed, host, port, child.pid if child else None)
+        finally:
+            if child:
+                stop_server(child)
+        report['runs'][name] = result
+        print_result(name, result, baseline)
+        baseline = baseline or result
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"\n与 {previous['timestamp']} 的结果对比（上行为之前的结果）:")
+        for name, result in report['runs'].items():
+            if name in previous['runs']:
+                print_result(name, previous['runs'][name])
+                print_result(name, result, previous['runs'][name])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+服务器互联测试
+
+在本机启动多台服务器并连成环（环路会让每条消息从两条路径到达），每台服务器连接若干客户端，
+所有客户端同时发送消息，检查：
+1. 每个客户端收到了所有服务器上所有发送者的消息，且每条恰好一次（去重和防环路）
+2. 同一发送者的消息顺序不变
+3. 转发的记录被合并成较少的批次
+用法: python benchmarks/stress_federation.py [--servers 3] [--clients 2] [--messages 300]
+"""
+import argparse
+import contextlib
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_server import ChatServer
+from async_server import AsyncChatServer
+from federation import Federation
+from protocol import FrameDecoder, encode_message, decode_message
+
+SERVER_CLASSES = {'threaded': ChatServer, 'asyncio': AsyncChatServer}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_ring(count, engines, batch_interval):
+    """启动count台服务器，第i台主动连接第i+1台的联邦端口，首尾相连成环"""
+    ports = [free_port() for _ in range(count)]
+    peer_ports = [free_port() for _ in range(count)]
+    servers = []
+    federations = []
+    for index in range(count):
+        # 测试客户端同时收发，放大发送队列，避免慢消费者策略丢弃消息干扰结果
+        server = SERVER_CLASSES[engines[index % len(engines)]](host='127.0.0.1', port=ports[index],
+                                                               queue_frames=1000000, queue_bytes=1 << 30)
+        if not server.start_server():
+            raise RuntimeError(f"服务器 {index} 启动失败")
+        federation = Federation(server, '127.0.0.1', peer_ports[index],
+                                peers=[f"127.0.0.1:{peer_ports[(index + 1) % count]}"],
+                                batch_interval=batch_interval)
+        federation.start()
+        servers.append(server)
+        federations.append(federation)
+    return ports, servers, federations
+
+
+def wait_for_links(federations, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(len(federation.links) == 2 for federation in federations):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def run(count, clients_per_server, messages, engines, batch_interval):
+    ports, servers, federations = start_ring(count, engines, batch_interval)
+    if count > 2 and not wait_for_links(federations):
+        raise RuntimeError("对等连接未全部建立")
+    time.sleep(0.5)
+
+    socks = [socket.create_connection(('127.0.0.1', port)) for port in ports for _ in range(clients_per_server)]
+    received = [[] for _ in socks]
+    expected = len(socks) * messages
+
+    def read(index, sock):
+        decoder = FrameDecoder()
+        sock.settimeout(10)
+        try:
+            while len(received[index]) < expected:
+                if decoder.recv_into(sock) == 0:
+                    return
+                for payload in decoder.frames():
+                    message = decode_message(payload)
+                    if message.get('type') == 'message':
+                        received[index].append(message['username'])
+        except OSError:
+            pass
+
+    readers = [threading.Thread(target=read, args=(index, sock), daemon=True) for index, sock in enumerate(socks)]
+    for thread in readers:
+        thread.start()
+    time.sleep(0.5)
+
+    start = time.perf_counter()
+    for number in range(messages):
+        for index, sock in enumerate(socks):
+            # 用户名携带发送者和序号，便于检查顺序
+            sock.sendall(encode_message({'username': f"{index}-{number}", 'content': 'federation'}))
+    for thread in readers:
+        thread.join(timeout=30)
+    elapsed = time.perf_counter() - start
+
+    errors = 0
+    for messages_seen in received:
+        per_sender = {}
+        for username in messages_seen:
+            sender, _, number = username.partition('-')
+            per_sender.setdefault(sender, []).append(int(number))
+        if len(per_sender) != len(socks) or any(numbers != list(range(messages)) for numbers in per_sender.values()):
+            errors += 1
+
+    stats = [federation.stats() for federation in federations]
+    for sock in socks:
+        sock.close()
+    for federation in federations:
+        federation.stop()
+    for server in servers:
+        server.stop_server()
+    return elapsed, expected, received, errors, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器互联测试')
+    parser.add_argument('--servers', type=int, default=3, help='服务器数量（连成环）')
+    parser.add_argument('--clients', type=int, default=2, help='每台服务器的客户端数')
+    parser.add_argument('--messages', type=int, default=300, help='每个客户端发送的消息数')
+    parser.add_argument('--engines', default='threaded,asyncio', help='服务器引擎，按顺序轮流使用')
+    parser.add_argument('--batch-interval', type=float, default=0.005, help='转发批次的合并窗口（秒）')
+    args = parser.parse_args()
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        elapsed, expected, received, errors, stats = run(
+            args.servers, args.clients, args.messages, args.engines.split(','), args.batch_interval)
+
+    delivered = sum(len(messages) for messages in received)
+    records = sum(peer['sent_records'] for federation in stats for peer in federation['peers'])
+    batches = sum(peer['sent_batches'] for federation in stats for peer in federation['peers'])
+    duplicates = sum(federation['duplicate_records'] for federation in stats)
+    print(f"{args.servers} 台服务器, {len(received)} 个客户端, 每个客户端应收 {expected} 条, 用时 {elapsed:.2f}s")
+    print(f"送达 {delivered}/{expected * len(received)}, 缺失/重复/乱序的客户端 {errors}")
+    print(f"转发记录 {records} 条, 合并为 {batches} 个批次, 丢弃重复/环路记录 {duplicates} 条")
+    ok = errors == 0 and delivered == expected * len(received)
+    print('通过' if ok else '失败')
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+连接注册表压力测试
+
+1. 注册表本身：多个线程反复增删连接，同时另一些线程不断取快照遍历
+2. 真实服务器：多个线程反复建立/断开上千个连接，同时持续广播，
+   检查稳定连接收到的消息没有丢失、服务器最终只剩稳定连接、离开通知被合并
+用法: python benchmarks/stress_registry.py [--churn 5000] [--engines threaded,asyncio]
+"""
+import argparse
+import contextlib
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registry import ClientRegistry
+from protocol import FrameDecoder, encode_message, decode_message
+
+
+class Dummy:
+    id = None
+
+
+def stress_registry(threads, operations):
+    registry = ClientRegistry()
+    errors = []
+    stop = threading.Event()
+    iterations = [0]
+
+    def churn():
+        try:
+            for _ in range(operations):
+                connection = Dummy()
+                registry.add(connection)
+                assert registry.remove(connection.id) is connection
+                assert registry.remove(connection.id) is None
+        except Exception as e:
+            errors.append(e)
+
+    def iterate():
+        while not stop.is_set():
+            snapshot = registry.snapshot()
+            assert isinstance(snapshot, tuple)
+            for connection in snapshot:
+                assert connection.id is not None
+            iterations[0] += 1
+
+    workers = [threading.Thread(target=churn) for _ in range(threads)]
+    readers = [threading.Thread(target=iterate) for _ in range(2)]
+    start = time.perf_counter()
+    for thread in workers + readers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = threads * operations
+    print(f"注册表: {total} 次增删, {iterations[0]} 次快照遍历, 用时 {elapsed:.2f}s "
+          f"({total * 2 / elapsed:,.0f} 次操作/秒), 剩余 {len(registry)}, 错误 {len(errors)}")
+    return not errors and len(registry) == 0
+
+
+def stress_server(engine, churn, churn_threads, broadcasts):
+    from chat_server import ChatServer
+    from async_server import AsyncChatServer
+
+    server_class = {'threaded': ChatServer, 'asyncio': AsyncChatServer}[engine]
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    server = server_class(host='127.0.0.1', port=port)
+    if not server.start_server():
+        return False, f"{engine}: 服务器启动失败"
+
+    stable = [socket.create_connection(('127.0.0.1', port)) for _ in range(5)]
+    received = {sock: 0 for sock in stable}
+    leave_notices = [0]
+    done = threading.Event()
+
+    def read(sock):
+        decoder = FrameDecoder()
+        while not done.is_set():
+            try:
+                if decoder.recv_into(sock) == 0:
+                    return
+            except OSError:
+                return
+            for payload in decoder.frames():
+                message = decode_message(payload)
+                if message.get('type') == 'system':
+                    if sock is stable[0]:
+                        leave_notices[0] += 1
+                elif 'stress-' in message.get('content', ''):
+                    received[sock] += 1
+
+    def connect_disconnect():
+        for _ in range(churn // churn_threads):
+            try:
+                sock = socket.create_connection(('127.0.0.1', port))
+                sock.close()
+            except OSError:
+                pass
+
+    readers = [threading.Thread(target=read, args=(sock,), daemon=True) for sock in stable]
+    churners = [threading.Thread(target=connect_disconnect) for _ in range(churn_threads)]
+    for thread in readers + churners:
+        thread.start()
+
+    start = time.perf_counter()
+    sender = stable[0]
+    for i in range(broadcasts):
+        sender.sendall(encode_message({'username': 'stress', 'content': f'stress-{i}'}))
+        time.sleep(0.001)
+    for thread in churners:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # 等待剩余消息送达、服务器处理完所有断开
+    deadline = time.time() + 10
+    while time.time() < deadline and (min(received.values()) < broadcasts or len(server.clients) != len(stable)):
+        time.sleep(0.1)
+    time.sleep(0.5)
+    remaining = len(server.clients)
+    done.set()
+    server.stop_server()
+    for sock in stable:
+        sock.close()
+
+    lost = broadcasts - min(received.values())
+    ok = lost == 0 and remaining == len(stable)
+    return ok, (f"{engine}: {churn} 次连接/断开, {broadcasts} 条广播, 用时 {elapsed:.2f}s, "
+                f"丢失 {lost}, 剩余连接 {remaining}/{len(stable)}, 离开通知 {leave_notices[0]} 条"
+                f" -> {'通过' if ok else '失败'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='连接注册表压力测试')
+    parser.add_argument('--churn', type=int, default=5000, help='连接/断开次数')
+    parser.add_argument('--threads', type=int, default=8, help='并发的连接/断开线程数')
+    parser.add_argument('--broadcasts', type=int, default=500, help='压力期间的广播条数')
+    parser.add_argument('--engines', default='threaded,asyncio', help='要测试的引擎，逗号分隔')
+    args = parser.parse_args()
+
+    ok = stress_registry(args.threads, args.churn * 10)
+
+    results = []
+    for engine in args.engines.split(','):
+        # 服务器每个连接都会打印日志，压力测试时丢弃
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            passed, report = stress_server(engine, args.churn, args.threads, args.broadcasts)
+        print(report)
+        results.append(passed)
+    return 0 if ok and all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+"""
+流量录制
+
+把服务器收到的真实流量（连接建立、每个帧、连接断开及其时间）写入录制文件，
+供 benchmarks/replay.py 按原来的节奏（或加速）重放到任意服务器引擎，对比延迟和吞吐量。
+
+录制的是客户端发来的原始消息体（可能是二进制编码或压缩流的一部分），重放时逐字节发出，
+服务器看到的协商和压缩流与录制时完全相同。只录制开始录制之后建立的连接，
+之前的连接缺少协商过程，无法重放。录制文件包含聊天内容，注意妥善保管。
+通过网页接口开始录制时只能给出文件名，文件一律保存在录制目录（默认为当前目录下的captures）中，
+不能借此覆盖其他位置的文件。录制文件达到max_bytes（默认1GB）时自动结束录制，避免占满磁盘。
+
+文件格式: 8字节文件头 MAGIC，之后是连续的记录
+    1字节类型 + 8字节时间（time.time()） + 4字节连接号 + 4字节长度 + 内容
+类型: O=连接建立（内容为客户端IP），F=收到的帧（消息体，不含长度前缀），C=连接断开
+"""
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'CHATCAP1'
+RECORD = struct.Struct('!cdII')
+OPEN = b'O'
+FRAME = b'F'
+CLOSE = b'C'
+# 写入缓冲区大小，录制期间不为每个帧做一次系统调用
+WRITE_BUFFER = 1024 * 1024
+DEFAULT_CAPTURE_DIR = 'captures'
+DEFAULT_MAX_CAPTURE_BYTES = 1024 * 1024 * 1024
+
+
+def capture_file_path(name, directory=DEFAULT_CAPTURE_DIR):
+    """把客户端给出的文件名解析为录制目录中的路径，名称包含目录或不合法时抛出ValueError"""
+    if not isinstance(name, str) or not name or name in ('.', '..') or \
+            '/' in name or '\\' in name or '\0' in name or os.path.basename(name) != name:
+        raise ValueError(f"录制文件名无效（只能是文件名，不能包含目录）: {name!r}")
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+class CaptureWriter:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_CAPTURE_BYTES):
+        if max_bytes <= 0:
+            raise ValueError(f"录制文件大小上限必须大于0: {max_bytes}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.full = False  # 因达到大小上限而结束
+        self.file = open(path, 'wb', buffering=WRITE_BUFFER)
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.connections = set()  # 录制期间建立、尚未断开的连接
+        self.started = time.time()
+        self.records = 0
+        self.bytes = len(MAGIC)
+
+    def open(self, conn_id, ip):
+        with self.lock:
+            self.connections.add(conn_id)
+            self._write(OPEN, conn_id, ip.encode('utf-8'))
+
+    def frame(self, conn_id, payload):
+        with self.lock:
+            if conn_id in self.connections:
+                self._write(FRAME, conn_id, payload)
+
+    def close(self, conn_id):
+        with self.lock:
+            if conn_id in self.connections:
+                self.connections.discard(conn_id)
+                self._write(CLOSE, conn_id, b'')
+
+    def _write(self, kind, conn_id, data):
+        if self.file is None:
+            return
+        if self.bytes + RECORD.size + len(data) > self.max_bytes:
+            self.file.close()
+            self.file = None
+            self.full = True
+            print(f"录制文件达到大小上限 {self.max_bytes} 字节，录制已结束: {self.path}")
+            return
+        self.file.write(RECORD.pack(kind, time.time(), conn_id, len(data)))
+        self.file.write(data)
+        self.records += 1
+        self.bytes += RECORD.size + len(data)
+
+    def stop(self):
+        """结束录制，返回统计"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        return self.stats()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'active': self.file is not None,
+            'seconds': round(time.time() - self.started, 1),
+            'records': self.records,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'full': self.full,
+            'connections': len(self.connections),
+        }
+
+
+def read_capture(path):
+    """逐条读出录制文件中的记录(类型, 时间, 连接号, 内容)；末尾不完整的记录（录制时进程崩溃）被忽略"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是录制文件: {path}")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            kind, timestamp, conn_id, length = RECORD.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield kind, timestamp, conn_id, data
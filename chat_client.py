@@ -0,0 +1,380 @@
+"""
+聊天客户端
+
+与聊天服务器之间的一条连接：协商编码、压缩和心跳，断线重连时补发缺失的消息，
+收到的消息存入MessageStore供界面按游标读取。接收可以由每个客户端自己的线程完成，
+也可以交给ClientReactor（见client_pool.py），由一个线程同时接收多个会话的连接。
+交给reactor的连接是非阻塞的：发送时写不完的部分留在发送缓冲区，由reactor在socket可写时写出，
+一个服务器不读取的连接不会卡住reactor线程和其他会话。
+"""
+import socket
+import threading
+import time
+import select
+from protocol import FrameDecoder, ProtocolError, encode_message, decode_message
+from codec import CODEC_JSON, CODEC_BINARY
+from compression import COMPRESSION_ZLIB, StreamCompressor, StreamDecompressor, is_compressed
+from chat_server import DEFAULT_ROOM, HEARTBEAT_TIMEOUT_FACTOR
+from message_store import MessageStore, DEFAULT_CAPACITY, DEFAULT_MAX_BYTES
+from filetransfer import upload_file, download_file
+from metrics import MetricsRegistry, CLIENT_STAGE_SECONDS, CLIENT_STAGE_HELP
+
+# reactor模式下发送缓冲区的上限，超过时新的发送直接失败
+MAX_SEND_BUFFER = 4 * 1024 * 1024
+
+
+class ChatClient:
+    def __init__(self, host='localhost', port=8080, username='用户', codec=CODEC_BINARY, compress=True,
+                 max_messages=DEFAULT_CAPACITY, max_message_bytes=DEFAULT_MAX_BYTES):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.client_socket = None
+        self.connected = False
+        self.decoder = None
+        self.reactor = None  # 由ClientReactor接收时为该reactor，否则为None（自己的接收线程）
+        self.send_lock = threading.Lock()  # Flask多线程同时发送时保证帧不交错
+        self.outgoing = bytearray()  # reactor模式下还没有写出的数据
+        self.room = DEFAULT_ROOM  # 当前发言的房间
+        self.epoch = None  # 服务器的epoch和已收到的最大序号，重连时用来补发缺失的消息
+        self.last_seq = 0
+        # 希望使用的编码；服务器在welcome中列出支持的编码，不支持时（旧服务器）仍用JSON
+        self.preferred_codec = codec
+        self.codec = CODEC_JSON
+        # 服务器支持时对较大的消息（粘贴的日志、历史补发）启用压缩
+        self.compress = compress
+        self.compressor = None
+        self.decompressor = None
+        # 心跳间隔由服务器在welcome中给出，为0表示服务器不支持；超时未收到任何数据即认为服务器已失联
+        self.heartbeat_interval = 0
+        self.last_seen = time.monotonic()
+        self.pinged = 0.0
+        # 接收和排队的耗时、收发量，由 /metrics 导出
+        self.metrics = MetricsRegistry()
+        self.receive_time = self.metrics.histogram(CLIENT_STAGE_SECONDS, CLIENT_STAGE_HELP, stage='receive')
+        self.queue_time = self.metrics.histogram(CLIENT_STAGE_SECONDS, CLIENT_STAGE_HELP, stage='queue')
+        self.received_messages = self.metrics.counter('chat_client_received_messages_total', '收到的消息数')
+        self.received_bytes = self.metrics.counter('chat_client_received_bytes_total', '收到的字节数')
+        self.sent_messages = self.metrics.counter('chat_client_sent_messages_total', '发出的消息数')
+        self.sent_bytes = self.metrics.counter('chat_client_sent_bytes_total', '发出的字节数')
+        # 收到的消息按id保存在有上限的缓冲区中，页面按游标读取，不会取走消息（见message_store.py）
+        self.messages = MessageStore(max_messages, max_message_bytes, wait_time=self.queue_time)
+        self.metrics.gauge('chat_client_queue_messages', '还没有被页面读取的消息数', self.messages.pending)
+        self.received_at = 0.0  # 最近一次从socket读出数据的时间
+        # 服务器的文件传输端口，由welcome给出，为None表示服务器未启用文件传输
+        self.file_port = None
+        
+    def resume_from(self, previous):
+        """沿用断开前的客户端状态，连接后只补发断开期间的消息"""
+        self.epoch = previous.epoch
+        self.last_seq = previous.last_seq
+        self.room = previous.room
+        # 沿用消息缓冲区，id继续递增，页面的游标仍然有效
+        self.messages = previous.messages
+        
+    def connect(self, reactor=None):
+        """连接服务器；reactor为ClientReactor时由它统一接收，否则启动自己的接收线程"""
+        try:
+            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.client_socket.connect((self.host, self.port))
+            self.connected = True
+            # 空闲连接不预先分配读缓冲区，收到数据时再按需扩容
+            self.decoder = FrameDecoder(initial_size=0)
+            
+            if reactor is not None:
+                self.reactor = reactor
+                self.client_socket.setblocking(False)
+                reactor.register(self)
+            else:
+                # 启动接收消息的线程
+                receive_thread = threading.Thread(target=self.receive_messages)
+                receive_thread.daemon = True
+                receive_thread.start()
+            
+            return True
+        except Exception as e:
+            print(f"连接服务器失败: {e}")
+            return False
+    
+    def send_message(self, content, room=None):
+        return self._send({
+            'type': 'message',
+            'username': self.username,
+            'content': content,
+            'room': room or self.room
+        })
+    
+    def send_messages(self, messages, room=None):
+        """
+        批量发送聊天消息（每条为 {"content", "room"}）：逐条编码（和压缩）后拼接，一次写出。
+        按顺序返回每条消息的结果 {"success": True} 或 {"success": False, "message": 原因}，
+        内容无效的消息单独失败；写出失败时其余消息都失败
+        """
+        results = []
+        frames = []
+        for item in messages:
+            content = item.get('content') if isinstance(item, dict) else None
+            if not isinstance(content, str) or not content.strip():
+                results.append({'success': False, 'message': '消息内容为空'})
+                continue
+            try:
+                frame = encode_message({
+                    'type': 'message',
+                    'username': self.username,
+                    'content': content,
+                    'room': item.get('room') or room or self.room
+                }, self.codec)
+            except ProtocolError:
+                results.append({'success': False, 'message': '消息过大'})
+                continue
+            frames.append(frame)
+            results.append(None)
+        if not frames:
+            return results
+        outcome = {'success': False, 'message': '客户端未连接'}
+        if self.connected:
+            try:
+                if self._write(frames):
+                    outcome = {'success': True}
+                else:
+                    outcome = {'success': False, 'message': '服务器接收过慢，发送缓冲区已满'}
+            except OSError as e:
+                print(f"发送消息失败: {e}")
+                self.connected = False
+                outcome = {'success': False, 'message': f'发送失败: {e}'}
+        return [dict(outcome) if result is None else result for result in results]
+    
+    def send_file(self, path, room=None):
+        """通过单独的文件连接上传文件（可续传），完成后服务器在房间中广播文件消息，返回file_id"""
+        if not self.file_port:
+            raise ValueError('服务器未启用文件传输')
+        return upload_file(self.host, self.file_port, path, self.username, room or self.room)
+    
+    def download_file(self, file_id, path):
+        """下载文件消息中的文件到path，中断后再次调用会从已下载的位置继续"""
+        if not self.file_port:
+            raise ValueError('服务器未启用文件传输')
+        return download_file(self.host, self.file_port, file_id, path)
+    
+    def join_room(self, room):
+        """加入房间，之后未指定房间的消息都发到该房间；同时取回该房间缓存的历史消息"""
+        if self._send({'type': 'join', 'room': room, 'since': 0, 'epoch': self.epoch}):
+            self.room = room
+            return True
+        return False
+    
+    def leave_room(self, room):
+        if self._send({'type': 'leave', 'room': room}):
+            if self.room == room:
+                self.room = DEFAULT_ROOM
+            return True
+        return False
+    
+    def _send(self, message_data):
+        if self.connected:
+            try:
+                frame = encode_message(message_data, self.codec)
+            except ProtocolError as e:
+                # 消息本身的问题（如超过帧上限），连接仍然正常
+                print(f"发送消息失败: {e}")
+                return False
+            try:
+                return self._write([frame])
+            except OSError as e:
+                print(f"发送消息失败: {e}")
+                self.connected = False
+                return False
+        return False
+    
+    def _write(self, frames):
+        """
+        按顺序压缩并写出已编码的帧，socket出错时抛出OSError
+        reactor模式下只做非阻塞写，写不完的部分放入发送缓冲区交给reactor；缓冲区已满时返回False
+        """
+        with self.send_lock:
+            if self.reactor is not None and \
+                    len(self.outgoing) + sum(len(frame) for frame in frames) > MAX_SEND_BUFFER:
+                # 在压缩之前判断，被拒绝的帧不能进入压缩流
+                return False
+            # 压缩流有状态，压缩和发送的顺序必须一致
+            if self.compressor is not None:
+                frames = [self.compressor.compress_frame(frame) for frame in frames]
+            data = frames[0] if len(frames) == 1 else b''.join(frames)
+            if self.reactor is None:
+                self.client_socket.sendall(data)
+            elif self.outgoing:
+                # 前面还有没写完的数据，排在后面等socket可写
+                self.outgoing += data
+            else:
+                try:
+                    sent = self.client_socket.send(data)
+                except (BlockingIOError, InterruptedError):
+                    sent = 0
+                if sent < len(data):
+                    self.outgoing += memoryview(data)[sent:]
+                    self.reactor.want_write(self)
+        self.sent_messages.inc(len(frames))
+        self.sent_bytes.inc(len(data))
+        return True
+    
+    def write_ready(self):
+        """socket可写时由reactor调用，写出发送缓冲区中的数据，全部写完返回True；socket出错时抛出OSError"""
+        with self.send_lock:
+            if self.outgoing:
+                try:
+                    sent = self.client_socket.send(self.outgoing)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                del self.outgoing[:sent]
+            return not self.outgoing
+    
+    def receive_messages(self):
+        while self.connected:
+            try:
+                # 不依赖系统的TCP超时：等待数据时定期检查心跳
+                readable = select.select([self.client_socket], [], [], 1.0)[0]
+            except (OSError, ValueError):
+                break
+            if not readable:
+                if not self.check_heartbeat():
+                    break
+                continue
+            if not self.read_ready():
+                break
+        self.connection_lost()
+    
+    def read_ready(self):
+        """socket可读时调用：读取并处理所有完整的帧，连接已关闭或出错时返回False"""
+        try:
+            received = self.decoder.recv_into(self.client_socket)
+            if received == 0:
+                return False
+            self.last_seen = time.monotonic()
+            self.received_at = time.perf_counter()
+            self.received_bytes.inc(received)
+                
+            for payload in self.decoder.frames():
+                self.received_messages.inc()
+                if is_compressed(payload):
+                    if self.decompressor is None:
+                        raise ProtocolError("收到压缩的消息，但没有协商压缩")
+                    payload = self.decompressor.decompress(payload)
+                try:
+                    self.handle_message(decode_message(payload))
+                except ValueError:
+                    print(f"接收到的消息格式错误: {bytes(payload)!r}")
+            return True
+        except (BlockingIOError, InterruptedError):
+            # 非阻塞socket偶尔会在可读通知后仍然没有数据
+            return True
+        except ProtocolError as e:
+            print(f"服务器协议错误: {e}")
+        except Exception as e:
+            if self.connected:
+                print(f"接收消息错误: {e}")
+        return False
+    
+    def connection_lost(self):
+        """连接已断开（服务器关闭、协议错误或心跳超时），关闭socket并在消息中提示"""
+        self.connected = False
+        if self.client_socket:
+            self.client_socket.close()
+        self.outgoing.clear()
+        # 添加断开连接消息
+        self.messages.append({
+            'type': 'error',
+            'content': '与服务器断开连接'
+        })
+    
+    def check_heartbeat(self):
+        """服务器安静超过心跳间隔时发ping，超时仍无数据返回False"""
+        if not self.heartbeat_interval:
+            return True
+        now = time.monotonic()
+        idle = now - self.last_seen
+        if idle >= self.heartbeat_interval * HEARTBEAT_TIMEOUT_FACTOR:
+            print(f"服务器 {idle:.0f} 秒无响应，断开连接")
+            return False
+        if idle >= self.heartbeat_interval and self.pinged < self.last_seen:
+            self.pinged = now
+            self._send({'type': 'ping'})
+        return True
+    
+    def handle_message(self, message_data):
+        message_type = message_data.get('type')
+        if message_type == 'ping':
+            self._send({'type': 'pong'})
+        elif message_type == 'pong':
+            pass
+        elif message_type == 'welcome':
+            self.file_port = message_data.get('file_port')
+            self.negotiate(message_data)
+            if self.last_seq:
+                # 重连：先重新加入之前所在的房间，再一次性请求所有房间中断开期间缺失的消息
+                if self.room != DEFAULT_ROOM:
+                    self._send({'type': 'join', 'room': self.room})
+                self._send({'type': 'resume', 'since': self.last_seq, 'epoch': self.epoch})
+            else:
+                self.epoch = message_data.get('epoch')
+                self.last_seq = message_data.get('seq', 0)
+        elif message_type == 'history':
+            self.epoch = message_data.get('epoch')
+            if message_data.get('reset'):
+                # epoch变了，旧的序号没有意义，以服务器当前的序号为准（补发的消息都不会超过它）
+                self.last_seq = message_data.get('seq', 0)
+            if message_data.get('truncated'):
+                self.queue_message({'type': 'system', 'content': '部分较早的消息已过期，无法补发',
+                                    'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")})
+            for message in message_data.get('messages', []):
+                self.queue_message(message)
+        else:
+            self.queue_message(message_data)
+    
+    def negotiate(self, welcome):
+        """服务器支持时切换到希望的编码、开启压缩和心跳，之后双方发出的帧都按协商结果处理"""
+        hello = {'type': 'hello'}
+        if self.preferred_codec != CODEC_JSON and self.preferred_codec in (welcome.get('codecs') or ()):
+            hello['codec'] = self.preferred_codec
+        if self.compress and COMPRESSION_ZLIB in (welcome.get('compression') or ()):
+            hello['compress'] = COMPRESSION_ZLIB
+            # 服务器处理hello后发来的帧就可能是压缩的，必须先准备好解压流
+            self.decompressor = StreamDecompressor()
+        if welcome.get('heartbeat'):
+            hello['heartbeat'] = True
+        if len(hello) > 1 and self._send(hello):
+            self.heartbeat_interval = welcome.get('heartbeat') or 0
+            self.codec = hello.get('codec', self.codec)
+            if 'compress' in hello:
+                self.compressor = StreamCompressor()
+    
+    def stats(self):
+        """连接的编码和压缩统计"""
+        return {
+            'connected': self.connected,
+            'codec': self.codec,
+            'compression': self.compressor.stats() if self.compressor is not None else None,
+            'decompression': self.decompressor.stats() if self.decompressor is not None else None,
+            'messages': self.messages.stats(),
+        }
+    
+    def queue_message(self, message_data):
+        """将消息存入缓冲区，唤醒等待的推送和长轮询"""
+        self.last_seq = max(self.last_seq, message_data.get('seq', 0))
+        self.receive_time.record(time.perf_counter() - self.received_at)
+        self.messages.append(message_data)
+    
+    def get_new_messages(self, last_id=0, timeout=0):
+        """
+        获取自last_id之后的新消息，不会取走消息，多个页面可以各自按自己的游标读取；
+        timeout大于0时没有新消息则等待，直到有新消息或超时（推送和长轮询使用）。
+        last_id已超出保留范围时，第一条是 type 为 gap 的标记
+        """
+        return self.messages.read(last_id, timeout)
+    
+    def disconnect(self):
+        self.connected = False
+        if self.reactor is not None:
+            # 由reactor线程注销并关闭，避免文件描述符被复用后误注册
+            self.reactor.close(self)
+        elif self.client_socket:
+            self.client_socket.close()
@@ -0,0 +1,846 @@
+import ipaddress
+import socket
+import selectors
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from protocol import FrameDecoder, ProtocolError, HEADER_SIZE, encode_message, decode_message
+from codec import CODECS, CODEC_JSON, CODEC_BINARY
+from compression import COMPRESSIONS, StreamCompressor, StreamDecompressor, is_compressed
+from outbound import OutboundQueue, DEFAULT_MAX_FRAMES, DEFAULT_MAX_BYTES, DEFAULT_MAX_LAG
+from registry import ClientRegistry, RoomIndex
+from history import HistoryBuffer, DEFAULT_HISTORY_SIZE
+from message_log import MessageLog, DEFAULT_MAX_SEGMENTS
+from search import SearchIndex, DEFAULT_MAX_DOCUMENTS
+from timer_wheel import TimerWheel
+from ratelimit import RateLimiter, ALLOW, DELAY, DISCONNECT
+from metrics import MetricsRegistry, SERVER_STAGE_SECONDS, SERVER_STAGE_HELP
+from capture import DEFAULT_MAX_CAPTURE_BYTES, CaptureWriter
+from profiler import DEFAULT_INTERVAL as PROFILE_INTERVAL, sample as sample_stacks
+
+# 监听队列长度，连接风暴时避免客户端被拒绝
+LISTEN_BACKLOG = socket.SOMAXCONN
+# 离开通知的合并窗口（秒），连接风暴时只广播一条汇总消息
+LEAVE_BATCH_DELAY = 0.2
+# 新连接自动加入的房间，未指定房间的消息都发到这里
+DEFAULT_ROOM = '大厅'
+MAX_ROOM_NAME = 32
+# 心跳：连接安静超过间隔时发ping，超过超时仍未收到任何数据则断开（半开连接）
+HEARTBEAT_INTERVAL = 30.0
+HEARTBEAT_TIMEOUT_FACTOR = 3
+HEARTBEAT_TICK = 0.5
+# 未协商心跳的旧客户端退回到TCP keepalive（秒）
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+# 只接受这些地址发来的forwarded（WebSocket网关与服务器在同一台机器上，见ws_gateway.py）
+TRUSTED_PROXIES = ('127.0.0.1', '::1')
+
+
+def normalize_room(room):
+    """校验并规范化房间名，无效时返回None"""
+    if not isinstance(room, str):
+        return None
+    room = room.strip()
+    if not room or len(room) > MAX_ROOM_NAME:
+        return None
+    return room
+
+
+def enable_keepalive(sock):
+    """开启TCP keepalive，平台不支持的选项跳过"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                            ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+    except OSError:
+        pass
+
+
+class BaseChatServer:
+    """
+    服务器引擎的公共部分：消息解析、房间路由、格式化和离开通知
+    具体引擎负责网络IO，并实现start_server/stop_server/send_frame/call_later
+    """
+    engine = None
+
+    def __init__(self, host='0.0.0.0', port=8080, slow_policy='drop_oldest',
+                 queue_frames=DEFAULT_MAX_FRAMES, queue_bytes=DEFAULT_MAX_BYTES, max_lag=DEFAULT_MAX_LAG,
+                 flush_interval=0.0, reuse_port=False, history_size=DEFAULT_HISTORY_SIZE,
+                 history_dir=None, history_segments=DEFAULT_MAX_SEGMENTS, search=True,
+                 search_documents=DEFAULT_MAX_DOCUMENTS,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_timeout=None, rate_limit=None,
+                 capture_path=None):
+        self.host = host
+        self.port = port
+        # 多进程模式下多个worker用SO_REUSEPORT绑定同一端口
+        self.reuse_port = reuse_port
+        # 绑定到具体地址时，本机网关连过来的源地址就是该地址
+        self.trusted_proxies = set(TRUSTED_PROXIES)
+        if host not in ('', '0.0.0.0', '::'):
+            self.trusted_proxies.add(host)
+        self.running = False
+        self.relays = []  # 广播转发目标，需实现publish(frame, room)
+        self.clients = ClientRegistry()
+        self.rooms = RoomIndex()
+        # 每个连接发送队列的上限和慢消费者策略
+        self.slow_policy = slow_policy
+        self.queue_frames = queue_frames
+        self.queue_bytes = queue_bytes
+        self.max_lag = max_lag
+        self.metrics = MetricsRegistry()
+        # 在打开日志、启动索引线程之前校验策略名和限额，参数错误时不留下半初始化的资源
+        self.new_outbound_queue()
+        # 每个连接和每个IP的发送限速，rate_limit为None时不限制（见ratelimit.py）
+        self.rate_limiter = RateLimiter(**(rate_limit or {}))
+        if search and search_documents < 1:
+            raise ValueError(f"索引消息数上限必须大于0: {search_documents}")
+        # 最近的广播及其序号，供加入房间和重连时补发；指定history_dir时同时写入磁盘日志
+        log = MessageLog(history_dir, max_segments=history_segments) if history_dir else None
+        self.history = HistoryBuffer(history_size, log)
+        # 聊天记录全文索引，在后台线程中增量更新，只保留最近search_documents条
+        self.search_index = None
+        if search:
+            self.search_index = SearchIndex(search_documents)
+            self.search_index.start()
+            if log is not None:
+                self.search_index.submit_log(log)
+        # 分配序号、记入历史和入队必须一起完成，每个客户端收到的序号才是递增的
+        self._broadcast_lock = threading.RLock()
+        # 协商使用二进制编码的连接数，为0时广播不需要再编码一份二进制帧
+        self.binary_clients = 0
+        self._pending_leaves = {}  # 房间 -> 离开的客户端地址
+        self._leave_lock = threading.Lock()
+        # 刷新间隔（秒）：窗口内的多条广播合并为每个连接一次写操作，用少量延迟换取吞吐量
+        self.flush_interval = flush_interval
+        # 协商了心跳的连接登记在时间轮中，按最后一次收到数据的时间判断是否已失联；间隔为0时关闭心跳
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout or heartbeat_interval * HEARTBEAT_TIMEOUT_FACTOR
+        self.heartbeats = TimerWheel(HEARTBEAT_TICK)
+        self._heartbeat_lock = threading.Lock()
+        # 各处理阶段的耗时直方图和吞吐量计数，由main.py的 /metrics 导出（见metrics.py）
+        self.decode_time = self.metrics.histogram(SERVER_STAGE_SECONDS, SERVER_STAGE_HELP, stage='decode')
+        self.broadcast_time = self.metrics.histogram(SERVER_STAGE_SECONDS, SERVER_STAGE_HELP, stage='broadcast')
+        self.received_messages = self.metrics.counter('chat_server_received_messages_total', '收到的消息数')
+        self.received_bytes = self.metrics.counter('chat_server_received_bytes_total', '收到的字节数（含帧头）')
+        self.broadcasts = self.metrics.counter('chat_server_broadcasts_total', '广播的消息数')
+        self.metrics.gauge('chat_server_connections', '当前连接数', lambda: len(self.clients))
+        self.metrics.gauge('chat_server_queue_frames', '所有连接发送队列中的帧数',
+                           lambda: sum(len(connection.outbound) for connection in self.clients.snapshot()))
+        self.metrics.gauge('chat_server_queue_bytes', '所有连接发送队列中的字节数',
+                           lambda: sum(connection.outbound.queued_bytes for connection in self.clients.snapshot()))
+        # 流量录制，供benchmarks/replay.py重放（见capture.py）
+        self.capture = None
+        if capture_path:
+            self.start_capture(capture_path)
+        # 文件传输端口（见filetransfer.py），在welcome中告知客户端，未启用时为None
+        self.file_port = None
+
+    def new_outbound_queue(self):
+        return OutboundQueue(self.queue_frames, self.queue_bytes, self.slow_policy, self.max_lag,
+                             metrics=self.metrics)
+
+    def check_rate(self, connection):
+        """
+        收到一个帧时先检查限速，返回处理前需要等待的秒数（0为立即处理）
+        返回None表示丢弃该帧，按策略需要断开时已经断开
+        """
+        action, wait = self.rate_limiter.admit(connection.id, connection.address[0])
+        if action == ALLOW:
+            return 0.0
+        if action == DELAY:
+            return wait
+        if action == DISCONNECT:
+            self.disconnect_client(connection, '发送过快')
+        return None
+
+    def configure_rate_limit(self, **limits):
+        """运行时修改限额，返回修改后的限额；参数无效时抛出ValueError"""
+        return self.rate_limiter.configure(**limits)
+
+    def get_rate_limit_stats(self):
+        return self.rate_limiter.stats()
+
+    def metrics_snapshot(self):
+        return self.metrics.snapshot()
+
+    def start_capture(self, path, max_bytes=DEFAULT_MAX_CAPTURE_BYTES):
+        """开始把之后建立的连接收到的流量录制到path（最多max_bytes字节），正在录制时先结束之前的录制"""
+        try:
+            capture = CaptureWriter(path, max_bytes)
+        except OSError as e:
+            raise ValueError(f"无法创建录制文件 {path}: {e}") from None
+        previous, self.capture = self.capture, capture
+        if previous is not None:
+            previous.stop()
+        print(f"开始录制流量: {path}")
+
+    def stop_capture(self):
+        """结束录制，返回录制的统计，没有在录制时返回None"""
+        capture, self.capture = self.capture, None
+        if capture is None:
+            return None
+        stats = capture.stop()
+        print(f"流量录制已结束: {stats['path']}，{stats['records']} 条记录")
+        return stats
+
+    def capture_stats(self):
+        capture = self.capture
+        return capture.stats() if capture is not None else None
+
+    def profile(self, duration, interval=PROFILE_INTERVAL, lines=False, threads=None):
+        """采样本进程所有线程的调用栈duration秒（阻塞调用的线程），返回profiler.Profile"""
+        return sample_stacks(duration, interval, lines, threads)
+
+    def capture_frame(self, connection, payload):
+        """录制收到的一个帧，在限速之前调用，被限速丢弃的帧也会录制"""
+        capture = self.capture
+        if capture is not None:
+            capture.frame(connection.id, payload)
+
+    def handle_payload(self, payload, connection):
+        """解析客户端发来的一个帧并按消息类型处理，解压失败时抛出ProtocolError"""
+        # 收到任何数据都说明连接还活着
+        connection.last_seen = time.monotonic()
+        self.received_messages.inc()
+        self.received_bytes.inc(len(payload) + HEADER_SIZE)
+        start = time.perf_counter()
+        if is_compressed(payload):
+            if connection.decompressor is None:
+                raise ProtocolError("收到压缩的消息，但没有协商压缩")
+            payload = connection.decompressor.decompress(payload)
+        try:
+            message_data = decode_message(payload)
+        except ValueError:
+            print(f"消息格式错误: {bytes(payload)!r}")
+            return
+        self.decode_time.record(time.perf_counter() - start)
+        if not isinstance(message_data, dict):
+            print(f"消息格式错误: {message_data!r}")
+            return
+
+        message_type = message_data.get('type', 'message')
+        if message_type == 'join':
+            self.join_room(connection, message_data.get('room'),
+                           message_data.get('since'), message_data.get('epoch'))
+        elif message_type == 'leave':
+            self.leave_room(connection, message_data.get('room'))
+        elif message_type == 'resume':
+            self.resume(connection, message_data.get('since'), message_data.get('epoch'))
+        elif message_type == 'message':
+            self.handle_chat_message(connection, message_data)
+        elif message_type == 'hello':
+            self.set_codec(connection, message_data.get('codec'))
+            if message_data.get('compress'):
+                self.set_compression(connection, message_data.get('compress'))
+            if message_data.get('heartbeat'):
+                self.watch_heartbeat(connection)
+        elif message_type == 'forwarded':
+            self.set_forwarded(connection, message_data.get('ip'), message_data.get('port'))
+        elif message_type == 'ping':
+            self.send_frame((connection,), encode_message({'type': 'pong'}, connection.codec))
+        elif message_type == 'pong':
+            pass
+        else:
+            print(f"未知的消息类型: {message_type!r}")
+
+    def set_forwarded(self, connection, ip, port):
+        """网关代浏览器建立的连接，之后按浏览器的地址限速和显示；只接受来自trusted_proxies的连接"""
+        if connection.address[0] not in self.trusted_proxies:
+            print(f"忽略来自 {connection.address[0]} 的forwarded")
+            return
+        try:
+            ip = str(ipaddress.ip_address(ip))
+        except ValueError:
+            print(f"forwarded地址无效: {ip!r}")
+            return
+        self.rate_limiter.remove(connection.id, connection.address[0])
+        connection.address = (ip, port if isinstance(port, int) else 0)
+        self.rate_limiter.add(connection.id, ip)
+
+    def handle_chat_message(self, connection, message_data):
+        """格式化聊天消息并广播给房间成员，未指定房间时发到默认房间"""
+        client_address = connection.address
+        username = message_data.get('username', '未知用户')
+        content = message_data.get('content', '')
+        room = normalize_room(message_data.get('room', DEFAULT_ROOM))
+        if room is None or room not in connection.rooms:
+            self.send_error(connection, f"未加入房间: {message_data.get('room')}")
+            return
+
+        # 创建格式化消息
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        formatted_message = f"{client_address[0]} | {timestamp} | {username}: {content}"
+
+        print(f"收到消息: [{room}] {formatted_message}")
+
+        # 广播给房间内的所有客户端
+        self.broadcast_message({
+            'type': 'message',
+            'content': formatted_message,
+            'timestamp': timestamp,
+            'ip': client_address[0],
+            'username': username,
+            'room': room
+        }, room=room)
+
+    def join_room(self, connection, room, since=None, epoch=None):
+        """加入房间；带since时补发该房间中序号大于since的历史消息"""
+        room = normalize_room(room)
+        if room is None:
+            self.send_error(connection, '房间名无效')
+            return
+        with self._broadcast_lock:
+            joined = self.rooms.join(room, connection)
+            if since is not None:
+                self.send_history(connection, since, epoch, (room,))
+        if joined:
+            self.broadcast_message(self.room_notice(connection.address, room, '加入房间'), room=room)
+
+    def resume(self, connection, since, epoch=None):
+        """重连后补发已加入的所有房间中缺失的消息"""
+        with self._broadcast_lock:
+            self.send_history(connection, since, epoch, connection.rooms)
+
+    def send_history(self, connection, since, epoch, rooms):
+        """把缺失的消息合并成一个history帧发出，epoch不同时补发全部缓存"""
+        if not isinstance(since, int) or since < 0:
+            since = 0
+        reset = epoch != self.history.epoch
+        if reset:
+            since = 0
+        frames, truncated = self.history.since(since, rooms)
+        self.send_frame((connection,), self.history.encode_history(frames, reset=reset, truncated=truncated))
+
+    def set_codec(self, connection, codec):
+        """客户端选择发给它的消息使用的编码，不支持的编码回退为JSON"""
+        if codec not in CODECS:
+            codec = CODEC_JSON
+        with self._broadcast_lock:
+            if codec == connection.codec:
+                return
+            if connection.id in self.clients:
+                self.binary_clients += 1 if codec == CODEC_BINARY else -1
+            connection.codec = codec
+            connection.outbound.encode = partial(encode_message, codec=codec)
+
+    def set_compression(self, connection, method):
+        """为连接开启双向压缩，只能开启一次"""
+        if method not in COMPRESSIONS or connection.decompressor is not None:
+            return
+        connection.decompressor = StreamDecompressor()
+        connection.outbound.enable_compression(StreamCompressor())
+
+    def watch_heartbeat(self, connection):
+        """客户端支持心跳：安静时定期ping，超时未收到数据则断开"""
+        if self.heartbeat_interval <= 0:
+            return
+        with self._heartbeat_lock:
+            if connection.id in self.clients:
+                self.heartbeats.schedule(connection.id, self.heartbeat_interval)
+
+    def check_heartbeats(self):
+        """由引擎每HEARTBEAT_TICK秒调用一次，只处理时间轮中到期的连接"""
+        now = time.monotonic()
+        with self._heartbeat_lock:
+            expired = self.heartbeats.advance(now)
+        for conn_id in expired:
+            connection = self.clients.get(conn_id)
+            if connection is None:
+                continue
+            idle = now - connection.last_seen
+            if idle >= self.heartbeat_timeout:
+                self.disconnect_client(connection, f"{idle:.0f}秒无响应")
+                continue
+            if idle >= self.heartbeat_interval:
+                if connection.pinged < connection.last_seen:
+                    connection.pinged = now
+                    self.send_frame((connection,), encode_message({'type': 'ping'}, connection.codec))
+                delay = self.heartbeat_timeout - idle
+            else:
+                # 期间收到过数据，从最后一次收到数据的时间重新计时
+                delay = self.heartbeat_interval - idle
+            with self._heartbeat_lock:
+                if connection.id in self.clients:
+                    self.heartbeats.schedule(conn_id, delay)
+
+    def leave_room(self, connection, room):
+        room = normalize_room(room)
+        if room is None or room not in connection.rooms:
+            self.send_error(connection, f"未加入房间: {room}")
+            return
+        # 先通知再退出，离开者也能收到确认
+        self.broadcast_message(self.room_notice(connection.address, room, '离开房间'), room=room)
+        self.rooms.leave(room, connection)
+
+    def room_notice(self, client_address, room, action):
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return {
+            'type': 'system',
+            'content': f"{client_address[0]} | {timestamp} | {action} {room}",
+            'timestamp': timestamp,
+            'room': room
+        }
+
+    def send_error(self, connection, content):
+        self.send_frame((connection,), encode_message({
+            'type': 'error',
+            'content': content,
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }, connection.codec))
+
+    def register_client(self, connection):
+        """登记新连接并加入默认房间，告知客户端本服务器的epoch、最新序号和支持的编码"""
+        self.clients.add(connection)
+        self.rate_limiter.add(connection.id, connection.address[0])
+        capture = self.capture
+        if capture is not None:
+            capture.open(connection.id, connection.address[0])
+        self.rooms.join(DEFAULT_ROOM, connection)
+        stats = self.history.stats()
+        self.send_frame((connection,), encode_message({
+            'type': 'welcome',
+            'epoch': stats['epoch'],
+            'seq': stats['seq'],
+            'room': DEFAULT_ROOM,
+            'codecs': list(CODECS),
+            'compression': list(COMPRESSIONS),
+            'heartbeat': self.heartbeat_interval,
+            'file_port': self.file_port
+        }))
+
+    def unregister_client(self, connection):
+        """注销连接，已经注销过返回False"""
+        with self._broadcast_lock:
+            if self.clients.remove(connection.id) is None:
+                return False
+            if connection.codec == CODEC_BINARY:
+                self.binary_clients -= 1
+        with self._heartbeat_lock:
+            self.heartbeats.cancel(connection.id)
+        self.rate_limiter.remove(connection.id, connection.address[0])
+        capture = self.capture
+        if capture is not None:
+            capture.close(connection.id)
+        # 离开通知延迟合并后广播，不在当前线程里递归广播
+        for room in self.rooms.leave_all(connection):
+            self.client_left(connection.address, room)
+        return True
+
+    def client_left(self, client_address, room):
+        """记录客户端离开，合并窗口内的多个离开每个房间只广播一条系统消息"""
+        with self._leave_lock:
+            first = not self._pending_leaves
+            self._pending_leaves.setdefault(room, []).append(client_address)
+        if first:
+            self.call_later(LEAVE_BATCH_DELAY, self._flush_leaves)
+
+    def _flush_leaves(self):
+        with self._leave_lock:
+            leaves, self._pending_leaves = self._pending_leaves, {}
+        if self.running:
+            for room, addresses in leaves.items():
+                self.broadcast_message(self.leave_message(addresses, room), room=room)
+
+    def leave_message(self, addresses, room=DEFAULT_ROOM):
+        """构造用户离开的系统消息"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if len(addresses) == 1:
+            content = f"{addresses[0][0]} | {timestamp} | 用户离开聊天室"
+        else:
+            ips = ', '.join(address[0] for address in addresses[:10])
+            more = ' 等' if len(addresses) > 10 else ''
+            content = f"{ips}{more} | {timestamp} | {len(addresses)} 位用户离开聊天室"
+        return {
+            'type': 'system',
+            'content': content,
+            'timestamp': timestamp,
+            'room': room
+        }
+
+    def broadcast_message(self, message_data, room=None, relay=True):
+        """
+        编码一次后发给所有客户端，指定room时只发给该房间的成员
+        relay为True时同时把编码好的帧转发给其他进程（见cluster.py）
+        """
+        start = time.perf_counter()
+        with self._broadcast_lock:
+            frame = self.history.record(message_data, room)
+            self.deliver_frame(frame, room)
+            self.index_message(message_data, room)
+        # 转发在广播锁外进行：总线的接收线程投递远端消息时需要这把锁
+        if relay:
+            for link in self.relays:
+                link.publish(frame, room)
+        self.broadcasts.inc()
+        self.broadcast_time.record(time.perf_counter() - start)
+
+    def broadcast_threadsafe(self, message_data, room=None):
+        """供其他线程（如文件传输）广播一条消息"""
+        self.broadcast_message(message_data, room=room)
+
+    def advertise_file_port(self, port):
+        """之后连接的客户端在welcome中得知文件传输端口"""
+        self.file_port = port
+
+    def deliver_frame(self, frame, room=None):
+        """把已编码的帧发给本进程内的客户端，不再转发"""
+        targets = self.clients.snapshot() if room is None else self.rooms.members(room)
+        if self.binary_clients:
+            # 历史、日志和转发都使用JSON帧，二进制帧只在有需要时转码一次
+            binary = [connection for connection in targets if connection.codec == CODEC_BINARY]
+            if binary:
+                message_data = decode_message(memoryview(frame)[HEADER_SIZE:])
+                self.send_frame(binary, encode_message(message_data, CODEC_BINARY))
+                targets = [connection for connection in targets if connection.codec != CODEC_BINARY]
+        self.send_frame(targets, frame)
+
+    def deliver_remote(self, frame, room=None):
+        """其他进程/服务器转发来的帧：换成本机的序号记入历史后投递"""
+        message_data = decode_message(memoryview(frame)[HEADER_SIZE:])
+        with self._broadcast_lock:
+            self.deliver_frame(self.history.record(message_data, room), room)
+            self.index_message(message_data, room)
+
+    def index_message(self, message_data, room):
+        """把刚记录的聊天消息交给搜索索引（只入队），须在广播锁内调用"""
+        if self.search_index is not None and message_data.get('type') == 'message':
+            self.search_index.submit(message_data, self.history.seq, room)
+
+    def deliver_threadsafe(self, frame, room=None):
+        """供其他线程（如进程间总线）投递远端转发来的帧"""
+        self.deliver_remote(frame, room)
+
+    def close_search(self):
+        if self.search_index is not None:
+            self.search_index.stop()
+
+    def get_room_sizes(self):
+        return self.rooms.room_sizes()
+
+    def call_later(self, delay, callback):
+        """在引擎的执行环境中延迟调用callback"""
+        raise NotImplementedError
+
+    def start_server(self):
+        raise NotImplementedError
+
+    def stop_server(self):
+        raise NotImplementedError
+
+    def send_frame(self, connections, frame):
+        """把同一个帧放入多个连接的发送队列"""
+        raise NotImplementedError
+
+    def get_client_stats(self):
+        """返回每个客户端的发送队列状态"""
+        raise NotImplementedError
+
+
+class ClientConnection:
+    """多线程引擎中的一个客户端连接"""
+
+    def __init__(self, client_socket, client_address, outbound):
+        self.id = None
+        self.socket = client_socket
+        self.address = client_address
+        self.outbound = outbound
+        self.rooms = set()
+        self.codec = CODEC_JSON
+        self.decompressor = None
+        self.last_seen = time.monotonic()  # 最后一次收到数据的时间
+        self.pinged = 0.0  # 最后一次发ping的时间
+        self.closing = False
+
+    def stats(self):
+        stats = self.outbound.stats()
+        stats['address'] = f"{self.address[0]}:{self.address[1]}"
+        stats['rooms'] = sorted(self.rooms)
+        stats['codec'] = self.codec
+        stats['decompression'] = self.decompressor.stats() if self.decompressor is not None else None
+        return stats
+
+
+class SocketWriter:
+    """
+    所有客户端共用的非阻塞写线程
+    广播线程只负责入队并通知，由本线程通过selector在socket可写时发出数据
+    """
+
+    def __init__(self, on_lagging, flush_interval=0.0, tick=0.5):
+        self.on_lagging = on_lagging
+        self.flush_interval = flush_interval
+        self.tick = tick
+        self.selector = selectors.DefaultSelector()
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self.selector.register(self._wake_recv, selectors.EVENT_READ)
+        self._lock = threading.Lock()
+        self._pending = set()   # 有新数据待发送的连接
+        self._closing = set()   # 待关闭的连接
+        self._waiting = set()   # 已注册等待可写事件的连接
+        self.running = False
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self._run, name='socket_writer')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def notify(self, connection):
+        """通知写线程该连接有新数据"""
+        with self._lock:
+            wake = not self._pending
+            self._pending.add(connection)
+        if wake:
+            self._wake()
+
+    def close(self, connection):
+        """在写线程中注销并关闭连接，避免文件描述符被复用后误注册"""
+        if not self.running:
+            connection.socket.close()
+            return
+        with self._lock:
+            self._closing.add(connection)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run(self):
+        flush_at = None  # 当前刷新窗口的结束时间
+        while self.running:
+            timeout = self.tick
+            if flush_at is not None:
+                timeout = max(0.0, min(timeout, flush_at - time.monotonic()))
+            for key, _ in self.selector.select(timeout=timeout):
+                if key.fileobj is self._wake_recv:
+                    try:
+                        while self._wake_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._flush(key.data)
+
+            # 刷新窗口未结束时继续积累，窗口内的帧最后一次sendmsg写出
+            if self._pending and self.flush_interval > 0:
+                now = time.monotonic()
+                if flush_at is None:
+                    flush_at = now + self.flush_interval
+                if now < flush_at and not self._closing:
+                    continue
+            flush_at = None
+
+            with self._lock:
+                pending, self._pending = self._pending, set()
+                closing, self._closing = self._closing, set()
+            for connection in pending - closing:
+                self._flush(connection)
+            for connection in closing:
+                self._unregister(connection)
+                connection.socket.close()
+
+            # 长时间无法写出的连接交给服务器按策略处理
+            for connection in list(self._waiting):
+                if connection.outbound.policy == 'disconnect' and connection.outbound.lagging():
+                    self._unregister(connection)
+                    self.on_lagging(connection)
+
+        self.selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+
+    def _flush(self, connection):
+        try:
+            drained = connection.outbound.write_to(connection.socket)
+        except OSError:
+            # 写失败说明连接已断开，读线程会负责清理
+            self._unregister(connection)
+            return
+        if drained:
+            self._unregister(connection)
+        elif connection not in self._waiting:
+            try:
+                self.selector.register(connection.socket, selectors.EVENT_WRITE, connection)
+                self._waiting.add(connection)
+            except (KeyError, ValueError, OSError):
+                pass
+
+    def _unregister(self, connection):
+        if connection in self._waiting:
+            self._waiting.discard(connection)
+            try:
+                self.selector.unregister(connection.socket)
+            except (KeyError, ValueError, OSError):
+                pass
+
+
+class ChatServer(BaseChatServer):
+    """每个客户端一个读线程、所有客户端共用一个写线程的服务器引擎"""
+    engine = 'threaded'
+
+    def __init__(self, host='0.0.0.0', port=8080, **options):
+        super().__init__(host, port, **options)
+        self.server_socket = None
+        self.writer = SocketWriter(on_lagging=self.disconnect_client, flush_interval=self.flush_interval)
+
+    def start_server(self):
+        try:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(LISTEN_BACKLOG)
+            self.running = True
+            print(f"服务器启动在 {self.host}:{self.port}")
+
+            self.writer.start()
+            if self.heartbeat_interval > 0:
+                heartbeat_thread = threading.Thread(target=self._heartbeat_loop)
+                heartbeat_thread.daemon = True
+                heartbeat_thread.start()
+
+            # 启动接受客户端连接的线程
+            accept_thread = threading.Thread(target=self.accept_clients)
+            accept_thread.daemon = True
+            accept_thread.start()
+            return True
+        except Exception as e:
+            print(f"服务器启动失败: {e}")
+            self.history.close()
+            self.close_search()
+            self.stop_capture()
+            return False
+
+    def accept_clients(self):
+        while self.running:
+            try:
+                client_socket, client_address = self.server_socket.accept()
+                print(f"新客户端连接: {client_address}")
+
+                # 写操作由写线程以非阻塞方式完成
+                client_socket.setblocking(False)
+                enable_keepalive(client_socket)
+                connection = ClientConnection(client_socket, client_address, self.new_outbound_queue())
+                self.register_client(connection)
+
+                # 为每个客户端创建单独的读线程
+                client_thread = threading.Thread(
+                    target=self.handle_client,
+                    args=(connection,)
+                )
+                client_thread.daemon = True
+                client_thread.start()
+
+            except Exception as e:
+                if self.running:
+                    print(f"接受客户端连接错误: {e}")
+
+    def handle_client(self, connection):
+        decoder = FrameDecoder()
+        # socket是非阻塞的，读线程用自己的selector等待数据
+        reader = selectors.DefaultSelector()
+        reader.register(connection.socket, selectors.EVENT_READ)
+        while self.running:
+            try:
+                if not reader.select(timeout=1.0):
+                    continue
+                if decoder.recv_into(connection.socket) == 0:
+                    break
+
+                # 一次读取可能包含多个完整的帧
+                for payload in decoder.frames():
+                    self.capture_frame(connection, payload)
+                    wait = self.check_rate(connection)
+                    if wait is None:
+                        if connection.closing:
+                            break
+                        continue
+                    if wait:
+                        # 推迟期间不读取这个连接，TCP流控会让客户端慢下来
+                        time.sleep(wait)
+                    self.handle_payload(payload, connection)
+
+            except (BlockingIOError, InterruptedError):
+                continue
+            except ProtocolError as e:
+                print(f"客户端 {connection.address} 协议错误: {e}")
+                break
+            except Exception as e:
+                print(f"处理客户端消息错误: {e}")
+                break
+
+        reader.close()
+        # 客户端断开连接
+        self.remove_client(connection)
+
+    def send_frame(self, connections, frame):
+        for connection in connections:
+            if connection.outbound.put(frame):
+                self.writer.notify(connection)
+            elif not connection.closing:
+                self.disconnect_client(connection)
+
+    def _heartbeat_loop(self):
+        while self.running:
+            time.sleep(HEARTBEAT_TICK)
+            self.check_heartbeats()
+
+    def disconnect_client(self, connection, reason='接收过慢'):
+        """断开跟不上的慢客户端或已失联的客户端，读线程随后会完成清理"""
+        connection.closing = True
+        print(f"客户端 {connection.address} {reason}，断开连接")
+        try:
+            connection.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def remove_client(self, connection):
+        if self.unregister_client(connection):
+            print(f"客户端断开连接: {connection.address}")
+            self.writer.close(connection)
+
+    def call_later(self, delay, callback):
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def get_client_stats(self):
+        return [dict(connection.stats(), rate_limit=self.rate_limiter.connection_counters(connection.id))
+                for connection in self.clients.snapshot()]
+
+    def stop_server(self):
+        self.running = False
+        if self.server_socket:
+            # 先shutdown唤醒阻塞在accept中的线程，否则端口在Linux上不会释放
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server_socket.close()
+        self.writer.stop()
+        for connection in self.clients.snapshot():
+            try:
+                connection.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.socket.close()
+        self.clients.clear()
+        self.rooms.clear()
+        self.history.close()
+        self.close_search()
+        self.stop_capture()
+        print("服务器已停止")
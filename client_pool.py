@@ -0,0 +1,279 @@
+"""
+客户端会话池
+
+原来一个Flask进程只有一个全局的ChatClient，共用的展示机、瘦客户端上每个人都要单独运行一个进程。
+会话池让一个Flask进程同时为多个浏览器会话各维护一条到聊天服务器的连接：
+
+- 会话由cookie中的随机令牌区分，每个会话一个ChatClient，桌面窗口也只是其中一个会话
+- 所有会话的连接由一个ClientReactor线程用selector统一接收并检查心跳，不再每个客户端一个接收线程；
+  连接都是非阻塞的，发不完的数据（包括reactor线程中回复的pong和hello）在socket可写时再写出，
+  一个不读取的服务器连接不会卡住其他会话
+- 会话数有上限，每个会话的消息缓冲区也有单独的条数和内存上限
+- 超过idle_timeout没有任何页面请求的会话自动断开并移除（打开的推送连接会定期刷新活跃时间）
+"""
+import secrets
+import selectors
+import socket
+import threading
+import time
+
+DEFAULT_MAX_SESSIONS = 200
+# 会话多久没有页面请求就断开（秒）
+SESSION_IDLE_TIMEOUT = 600.0
+# 每个会话保留的消息条数和内存上限，会话多时总内存可控
+SESSION_MESSAGES = 1000
+SESSION_MESSAGE_BYTES = 4 * 1024 * 1024
+# reactor检查心跳和空闲会话的间隔（秒）
+REACTOR_TICK = 1.0
+
+
+class SessionLimitReached(Exception):
+    """会话数已达上限"""
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+class ClientReactor:
+    """
+    所有会话的连接共用的接收线程
+    selector等待任一连接可读后调用ChatClient.read_ready，有待写数据的连接可写时调用ChatClient.write_ready，
+    每个tick检查一次所有连接的心跳
+    """
+
+    def __init__(self, tick=REACTOR_TICK, on_tick=None):
+        self.tick = tick
+        self.on_tick = on_tick
+        self.selector = selectors.DefaultSelector()
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self.selector.register(self._wake_recv, selectors.EVENT_READ)
+        self._lock = threading.Lock()
+        self._adding = []    # 待注册的客户端
+        self._closing = []   # 待注销并关闭的客户端
+        self._writing = []   # 发送缓冲区有数据、需要等待可写的客户端
+        self.clients = set()  # 只在reactor线程中修改
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name='client_reactor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def register(self, client):
+        with self._lock:
+            self._adding.append(client)
+        self._wake()
+
+    def want_write(self, client):
+        """client的发送缓冲区有数据，socket可写时调用它的write_ready"""
+        with self._lock:
+            self._writing.append(client)
+        self._wake()
+
+    def close(self, client):
+        """在reactor线程中注销并关闭连接"""
+        with self._lock:
+            self._closing.append(client)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _apply(self):
+        with self._lock:
+            adding, self._adding = self._adding, []
+            closing, self._closing = self._closing, []
+            writing, self._writing = self._writing, []
+        for client in adding:
+            if client.connected:
+                self.selector.register(client.client_socket, selectors.EVENT_READ, client)
+                self.clients.add(client)
+            else:
+                client.client_socket.close()
+        for client in writing:
+            if client in self.clients and client not in closing:
+                self.selector.modify(client.client_socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+        for client in closing:
+            self._forget(client)
+            client.client_socket.close()
+
+    def _forget(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            self.selector.unregister(client.client_socket)
+
+    def _write(self, client):
+        try:
+            drained = client.write_ready()
+        except OSError:
+            self._lost(client)
+            return
+        if drained:
+            self.selector.modify(client.client_socket, selectors.EVENT_READ, client)
+
+    def _lost(self, client):
+        self._forget(client)
+        client.connection_lost()
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while self.running:
+            self._apply()
+            timeout = max(0.0, next_tick - time.monotonic())
+            for key, mask in self.selector.select(timeout=timeout):
+                if key.fileobj is self._wake_recv:
+                    try:
+                        while self._wake_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                client = key.data
+                if client not in self.clients:
+                    # 同一轮中已因出错被注销
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self._write(client)
+                # 已被disconnect的连接等_apply关闭
+                if mask & selectors.EVENT_READ and client in self.clients and client.connected \
+                        and not client.read_ready():
+                    self._lost(client)
+            now = time.monotonic()
+            if now >= next_tick:
+                next_tick = now + self.tick
+                for client in list(self.clients):
+                    if client.connected and not client.check_heartbeat():
+                        self._lost(client)
+                if self.on_tick is not None:
+                    self.on_tick()
+        self._apply()
+        for client in list(self.clients):
+            self._forget(client)
+            client.client_socket.close()
+        self.selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+
+
+class Session:
+    def __init__(self, client):
+        self.client = client
+        self.created = time.monotonic()
+        self.last_active = self.created
+
+
+class SessionPool:
+    """按会话令牌保存ChatClient，所有连接由同一个ClientReactor接收"""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 max_messages=SESSION_MESSAGES, max_message_bytes=SESSION_MESSAGE_BYTES):
+        if max_sessions < 1:
+            raise ValueError(f"最大会话数必须大于0: {max_sessions}")
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # 创建ChatClient时传入的每会话消息缓冲区上限
+        self.client_limits = {'max_messages': max_messages, 'max_message_bytes': max_message_bytes}
+        self.sessions = {}  # 令牌 -> Session
+        self.lock = threading.Lock()
+        self.reactor = ClientReactor(on_tick=self.evict_idle)
+        self.evicted = 0
+        self.rejected = 0
+
+    def get(self, token):
+        """返回令牌对应的客户端并刷新活跃时间，没有时返回None"""
+        if not token:
+            return None
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            session.last_active = time.monotonic()
+            return session.client
+
+    def connect(self, token, client):
+        """
+        连接client并作为令牌对应的会话保存（替换该会话之前的客户端），连接失败返回False；
+        新会话超过上限时抛出SessionLimitReached
+        """
+        with self.lock:
+            if token not in self.sessions and len(self.sessions) >= self.max_sessions:
+                self.rejected += 1
+                raise SessionLimitReached(f"会话数已达上限 {self.max_sessions}")
+        self.reactor.start()
+        if not client.connect(self.reactor):
+            return False
+        with self.lock:
+            previous = self.sessions.get(token)
+            if previous is None and len(self.sessions) >= self.max_sessions:
+                # 连接期间其他请求占满了会话
+                self.rejected += 1
+                client.disconnect()
+                raise SessionLimitReached(f"会话数已达上限 {self.max_sessions}")
+            self.sessions[token] = Session(client)
+        if previous is not None and previous.client is not client and previous.client.connected:
+            previous.client.disconnect()
+        return True
+
+    def remove(self, token):
+        """断开并移除会话，返回其客户端，没有时返回None"""
+        with self.lock:
+            session = self.sessions.pop(token, None)
+        if session is None:
+            return None
+        session.client.disconnect()
+        return session.client
+
+    def clients(self):
+        with self.lock:
+            return [session.client for session in self.sessions.values()]
+
+    def evict_idle(self):
+        """断开并移除超过idle_timeout没有页面请求的会话，由reactor线程定期调用"""
+        if self.idle_timeout <= 0:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [token for token, session in self.sessions.items() if session.last_active < deadline]
+            sessions = [self.sessions.pop(token) for token in idle]
+        for session in sessions:
+            self.evicted += 1
+            print(f"会话空闲超过 {self.idle_timeout:.0f} 秒，断开 {session.client.username}")
+            session.client.disconnect()
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.client.disconnect()
+        self.reactor.stop()
+
+    def stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        now = time.monotonic()
+        return {
+            'sessions': len(sessions),
+            'connected': sum(1 for session in sessions if session.client.connected),
+            'max_sessions': self.max_sessions,
+            'idle_timeout': self.idle_timeout,
+            'oldest_idle': round(max((now - session.last_active for session in sessions), default=0.0), 1),
+            'evicted': self.evicted,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,646 @@
+"""
+多进程服务器
+
+单个进程受GIL限制只能用满一个CPU核。多进程模式启动N个worker进程，
+每个worker运行一个普通的服务器引擎，并通过SO_REUSEPORT绑定同一个端口，由内核分配新连接。
+主进程运行一个本地总线(unix socket)：worker每广播一条消息，就把编码好的帧发给总线，
+总线按收到的顺序转发给其他所有worker，所以每个客户端仍能看到所有消息，
+同一个发送者的消息顺序也保持不变（同一worker的帧在同一条连接上按序传输和转发）。
+总线两端都不在转发路径上阻塞：worker的广播放入队列由单独的线程写出，
+主进程为每个worker维护一个发送队列（outbound.py），在连接可写时以非阻塞方式写出，
+某个worker接收缓慢时不会卡住总线和其他worker；积压超过上限的worker被断开。
+
+总线上的每个包由两个长度前缀帧组成：
+  第一帧: 1字节类型 + 参数（B=广播，参数为房间名，空表示所有人；S=统计；R=启动结果；C=主进程下发的配置；
+          P=worker的采样分析结果）
+主进程自己也可以经总线发出广播（如文件传输的文件消息），所有worker都会投递
+  第二帧: 广播的消息帧或JSON
+"""
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+from chat_server import BaseChatServer, ChatServer
+from async_server import AsyncChatServer
+from capture import DEFAULT_MAX_CAPTURE_BYTES
+from outbound import OutboundQueue
+from protocol import FrameDecoder, ProtocolError, encode_frame, encode_message
+from metrics import merge as merge_metrics
+from profiler import DEFAULT_INTERVAL as PROFILE_INTERVAL, ProfilerBusy, merge as merge_profiles
+
+WORKER_ENGINES = {
+    'threaded': ChatServer,
+    'asyncio': AsyncChatServer,
+}
+# worker上报统计的间隔（秒）
+STATS_INTERVAL = 1.0
+WORKER_START_TIMEOUT = 15.0
+# 采样结束后等待worker发回结果的时间（秒）
+PROFILE_RESULT_TIMEOUT = 10.0
+# worker发往总线的积压上限，超过时丢弃广播
+BUS_MAX_BACKLOG = 64 * 1024 * 1024
+# 主进程到每个worker的发送队列上限，积压超过上限或持续落后超过BUS_MAX_LAG秒时断开该worker
+BUS_QUEUE_PACKETS = 100000
+BUS_QUEUE_BYTES = 64 * 1024 * 1024
+BUS_MAX_LAG = 30.0
+
+BUS_BROADCAST = b'B'
+BUS_STATS = b'S'
+BUS_READY = b'R'
+BUS_CONFIG = b'C'
+BUS_PROFILE = b'P'
+
+
+def multiprocess_supported():
+    """需要SO_REUSEPORT负载均衡和unix socket，Windows不支持"""
+    return (sys.platform.startswith('linux') or 'bsd' in sys.platform) and \
+        hasattr(socket, 'SO_REUSEPORT') and hasattr(socket, 'AF_UNIX')
+
+
+def encode_packet(kind, argument, body):
+    return encode_frame(kind + argument) + encode_frame(body)
+
+
+def read_packets(decoder, sock):
+    """从总线连接读取数据，返回(类型, 参数, 内容)列表；连接关闭返回None"""
+    if decoder.recv_into(sock) == 0:
+        return None
+    packets = []
+    for payload in decoder.frames():
+        if decoder.header is None:
+            decoder.header = bytes(payload)
+        else:
+            header, decoder.header = decoder.header, None
+            packets.append((header[:1], header[1:], payload))
+    return packets
+
+
+class BusDecoder(FrameDecoder):
+    """总线包解码器，记住还没有配对的第一帧"""
+
+    def __init__(self):
+        super().__init__()
+        self.header = None
+
+
+class BusLink:
+    """
+    worker到总线的连接，作为服务器的relay转发本进程的广播，并投递其他worker的广播
+    发送只放入队列，由写线程发出，调用方（广播路径、统计线程）不会阻塞在总线上
+    """
+
+    def __init__(self, server, path, index=0):
+        self.server = server
+        self.index = index
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.cond = threading.Condition()
+        self.packets = []
+        self.pending_bytes = 0
+        self.dropped = 0
+        self.closing = False
+        self.closed = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='bus_writer', daemon=True)
+        self._writer.start()
+
+    def publish(self, frame, room):
+        self.send(BUS_BROADCAST, (room or '').encode('utf-8'), frame)
+
+    def send(self, kind, argument, body):
+        packet = encode_packet(kind, argument, body)
+        with self.cond:
+            if self.closing or self.closed.is_set():
+                return
+            if kind == BUS_BROADCAST and self.pending_bytes + len(packet) > BUS_MAX_BACKLOG:
+                self.dropped += 1
+                if self.dropped == 1:
+                    print(f"worker {self.index}: 总线积压过多，开始丢弃广播")
+                return
+            self.packets.append(packet)
+            self.pending_bytes += len(packet)
+            self.cond.notify()
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while not self.packets and not self.closing:
+                    self.cond.wait()
+                packets, self.packets = self.packets, []
+                self.pending_bytes = 0
+                if not packets:
+                    return
+            try:
+                self.sock.sendall(b''.join(packets))
+            except OSError:
+                self.closed.set()
+                return
+
+    def receive_forever(self):
+        """接收其他worker转发来的广播，总线关闭时返回"""
+        decoder = BusDecoder()
+        try:
+            while True:
+                packets = read_packets(decoder, self.sock)
+                if packets is None:
+                    break
+                for kind, argument, body in packets:
+                    if kind == BUS_BROADCAST:
+                        # 第二帧就是完整的消息帧；解码器复用缓冲区，投递前需要复制出来
+                        self.server.deliver_threadsafe(bytes(body), argument.decode('utf-8') or None)
+                    elif kind == BUS_CONFIG and argument == b'rate_limit':
+                        self.server.configure_rate_limit(**json.loads(bytes(body)))
+                    elif kind == BUS_CONFIG and argument == b'capture':
+                        self.configure_capture(**json.loads(bytes(body)))
+                    elif kind == BUS_CONFIG and argument == b'file_port':
+                        self.server.advertise_file_port(json.loads(bytes(body)).get('port'))
+                    elif kind == BUS_CONFIG and argument == b'profile':
+                        # 采样会阻塞，不能占用接收广播的线程
+                        threading.Thread(target=self.run_profile, args=(json.loads(bytes(body)),),
+                                         daemon=True).start()
+        except (OSError, ProtocolError):
+            pass
+        self.closed.set()
+
+    def configure_capture(self, path, max_bytes=DEFAULT_MAX_CAPTURE_BYTES):
+        """每个worker录制到各自的文件"""
+        if not path:
+            self.server.stop_capture()
+            return
+        try:
+            self.server.start_capture(worker_capture_path(path, self.index), max_bytes)
+        except ValueError as e:
+            print(e)
+
+    def run_profile(self, request):
+        """按主进程的请求采样本worker，把结果发回主进程"""
+        result = {'id': request['id'], 'worker': self.index}
+        try:
+            profile = self.server.profile(request['duration'], request['interval'], request['lines'],
+                                          request['threads'])
+            result['profile'] = profile.to_dict()
+        except (ValueError, ProfilerBusy) as e:
+            result['error'] = str(e)
+        self.send(BUS_PROFILE, b'', json.dumps(result).encode('utf-8'))
+
+    def report_stats(self):
+        while not self.closed.wait(STATS_INTERVAL):
+            try:
+                stats = {
+                    'clients': self.server.get_client_stats(),
+                    'rooms': self.server.get_room_sizes(),
+                    'rate_limit': self.server.get_rate_limit_stats(),
+                    'metrics': self.server.metrics_snapshot(),
+                    'capture': self.server.capture_stats()
+                }
+            except Exception as e:
+                print(f"收集统计失败: {e}")
+                continue
+            self.send(BUS_STATS, b'', json.dumps(stats).encode('utf-8'))
+
+    def close(self):
+        """写出队列中剩余的包后关闭连接"""
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self._writer.join(timeout=2)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def worker_capture_path(path, index):
+    return f"{path}.worker-{index}"
+
+
+def run_worker(index, engine, host, port, options, bus_path):
+    """worker进程入口：启动服务器引擎并连接总线，总线关闭后退出"""
+    if options.get('history_dir'):
+        # 每个worker有自己的序号，各自写一个日志目录
+        options = dict(options, history_dir=os.path.join(options['history_dir'], f"worker-{index}"))
+    if options.get('capture_path'):
+        options = dict(options, capture_path=worker_capture_path(options['capture_path'], index))
+    # 搜索索引由主进程根据总线上的广播统一维护
+    options = dict(options, search=False)
+    server = WORKER_ENGINES[engine](host=host, port=port, reuse_port=True, **options)
+    link = BusLink(server, bus_path, index)
+    started = server.start_server()
+    link.send(BUS_READY, b'', json.dumps({'ok': started, 'pid': os.getpid()}).encode('utf-8'))
+    if not started:
+        link.close()
+        return
+    server.relays.append(link)
+    threading.Thread(target=link.report_stats, daemon=True).start()
+    link.receive_forever()
+    server.stop_server()
+    link.close()
+
+
+class BusHub:
+    """
+    主进程中的总线，把每个worker发来的广播按顺序转发给其他worker
+    转发只放入目标worker的发送队列，由总线线程在连接可写时写出
+    """
+
+    def __init__(self, path, on_message, on_broadcast=None):
+        self.path = path
+        self.on_message = on_message  # 处理广播以外的包(worker, 类型, 内容)
+        self.on_broadcast = on_broadcast  # 观察经过总线的每条广播(帧, 房间)
+        self.listener = None
+        self.selector = selectors.DefaultSelector()
+        # links和queues只在总线线程中增删，增删和其他线程的遍历都持有_lock
+        self.links = {}   # socket -> BusDecoder
+        self.queues = {}  # socket -> 发往该worker的OutboundQueue
+        self._lock = threading.Lock()
+        self._dirty = set()    # 有待写出数据的连接
+        self._overflow = set()  # 积压超过上限、需要断开的连接
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self._wake_recv, selectors.EVENT_READ)
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='bus_hub', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                events = self.selector.select(timeout=0.5)
+            except (OSError, ValueError):
+                break
+            for key, mask in events:
+                if key.fileobj is self.listener:
+                    self._accept()
+                elif key.fileobj is self._wake_recv:
+                    try:
+                        while self._wake_recv.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(key.fileobj)
+                    if mask & selectors.EVENT_READ and key.fileobj in self.links:
+                        self._read(key.fileobj)
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                overflow, self._overflow = self._overflow, set()
+            for sock in overflow:
+                if sock in self.links:
+                    print("worker接收总线消息过慢，断开该worker")
+                    self._drop(sock)
+            for sock in dirty:
+                self._flush(sock)
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        with self._lock:
+            self.links[sock] = BusDecoder()
+            self.queues[sock] = OutboundQueue(BUS_QUEUE_PACKETS, BUS_QUEUE_BYTES, 'disconnect', BUS_MAX_LAG)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _read(self, sock):
+        try:
+            packets = read_packets(self.links[sock], sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except (OSError, ProtocolError):
+            packets = None
+        if packets is None:
+            self._drop(sock)
+            return
+        for kind, argument, body in packets:
+            if kind == BUS_BROADCAST:
+                if self.on_broadcast:
+                    self.on_broadcast(body, argument)
+                packet = encode_packet(kind, argument, body)
+                with self._lock:
+                    for other in self.queues:
+                        if other is not sock:
+                            self._queue(other, packet)
+            else:
+                self.on_message(sock, kind, bytes(body))
+
+    def _queue(self, sock, packet):
+        """放入发往sock的队列，须持有self._lock"""
+        queue = self.queues.get(sock)
+        if queue is None:
+            return
+        if queue.put(packet):
+            self._dirty.add(sock)
+        else:
+            self._overflow.add(sock)
+
+    def send_all(self, kind, argument, body):
+        """向所有worker发送一个包，可在任意线程调用"""
+        packet = encode_packet(kind, argument, body)
+        with self._lock:
+            for sock in self.queues:
+                self._queue(sock, packet)
+        try:
+            self._wake_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _flush(self, sock):
+        """在总线线程中写出发往sock的数据，写不完时等待可写事件"""
+        queue = self.queues.get(sock)
+        if queue is None:
+            return
+        try:
+            drained = queue.write_to(sock)
+        except OSError:
+            self._drop(sock)
+            return
+        events = selectors.EVENT_READ if drained else selectors.EVENT_READ | selectors.EVENT_WRITE
+        if self.selector.get_key(sock).events != events:
+            self.selector.modify(sock, events)
+
+    def _drop(self, sock):
+        with self._lock:
+            link = self.links.pop(sock, None)
+            self.queues.pop(sock, None)
+        if link is not None:
+            self.selector.unregister(sock)
+            sock.close()
+
+    def stop(self):
+        """关闭所有总线连接，worker读到连接关闭后自行退出"""
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+        for sock in list(self.links):
+            self._drop(sock)
+        self.selector.close()
+        self._wake_recv.close()
+        self._wake_send.close()
+        if self.listener:
+            self.listener.close()
+
+
+class MultiProcessChatServer(BaseChatServer):
+    """
+    多进程服务器，每个worker是一个独立的进程
+    本对象只在主进程中管理worker和总线，客户端连接都由worker处理
+    """
+    engine = 'multiprocess'
+
+    def __init__(self, host='0.0.0.0', port=8080, workers=None, worker_engine='asyncio', **options):
+        # 先校验参数，再由基类启动索引线程
+        if worker_engine not in WORKER_ENGINES:
+            raise ValueError(f"未知的worker引擎: {worker_engine}")
+        count = workers or os.cpu_count() or 1
+        if count < 1:
+            raise ValueError(f"worker数必须大于0: {workers}")
+        # 磁盘日志和流量录制由各worker打开，主进程不写历史
+        super().__init__(host, port, **dict(options, history_dir=None, capture_path=None))
+        self.workers = count
+        self.worker_engine = worker_engine
+        self.options = options
+        self.processes = []
+        self.hub = None
+        self._tempdir = None
+        self._lock = threading.Lock()
+        self._ready = {}         # 总线连接 -> 启动结果
+        self._worker_stats = {}  # 总线连接 -> 最近一次统计
+        self._profile_id = 0
+        self._profiles = {}      # 采样请求号 -> worker发回的结果
+        self._profile_done = threading.Condition(self._lock)
+
+    def start_server(self):
+        if not multiprocess_supported():
+            print("当前平台不支持多进程模式（需要SO_REUSEPORT和unix socket）")
+            return False
+        self._tempdir = tempfile.mkdtemp(prefix='chat-bus-')
+        bus_path = os.path.join(self._tempdir, 'bus.sock')
+        self.hub = BusHub(bus_path, self._on_worker_message, self._on_broadcast)
+        self.hub.start()
+
+        # spawn方式启动，避免fork带上Flask和界面的线程
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            process = context.Process(
+                target=run_worker,
+                args=(index, self.worker_engine, self.host, self.port, self.options, bus_path)
+            )
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+        deadline = time.time() + WORKER_START_TIMEOUT
+        while time.time() < deadline:
+            with self._lock:
+                results = list(self._ready.values())
+            if len(results) == self.workers or not all(results):
+                break
+            if not all(process.is_alive() for process in self.processes):
+                break
+            time.sleep(0.05)
+
+        if len(results) != self.workers or not all(results):
+            print("worker启动失败")
+            self.stop_server()
+            return False
+        self.running = True
+        print(f"服务器启动在 {self.host}:{self.port} (多进程, {self.workers} 个 {self.worker_engine} worker)")
+        return True
+
+    def _on_broadcast(self, frame, argument):
+        if self.search_index is not None:
+            self.search_index.submit_frame(bytes(frame), argument.decode('utf-8') or None)
+
+    def _on_worker_message(self, link, kind, body):
+        message = json.loads(body)
+        with self._lock:
+            if kind == BUS_READY:
+                self._ready[link] = message['ok']
+            elif kind == BUS_STATS:
+                self._worker_stats[link] = message
+            elif kind == BUS_PROFILE:
+                if message['id'] in self._profiles:
+                    self._profiles[message['id']].append(message)
+                    self._profile_done.notify_all()
+
+    def stop_server(self):
+        self.running = False
+        if self.hub:
+            self.hub.stop()
+            self.hub = None
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)
+        self.processes = []
+        if self._tempdir:
+            for name in os.listdir(self._tempdir):
+                os.remove(os.path.join(self._tempdir, name))
+            os.rmdir(self._tempdir)
+            self._tempdir = None
+        with self._lock:
+            self._ready.clear()
+            self._worker_stats.clear()
+        self.close_search()
+        print("服务器已停止")
+
+    def get_client_stats(self):
+        """汇总各worker最近一次上报的统计（最多延迟STATS_INTERVAL秒）"""
+        with self._lock:
+            worker_stats = list(self._worker_stats.values())
+        clients = []
+        for index, stats in enumerate(worker_stats):
+            for client in stats['clients']:
+                client['worker'] = index
+                clients.append(client)
+        return clients
+
+    def get_room_sizes(self):
+        sizes = {}
+        with self._lock:
+            for stats in self._worker_stats.values():
+                for room, count in stats['rooms'].items():
+                    sizes[room] = sizes.get(room, 0) + count
+        return sizes
+
+    def metrics_snapshot(self):
+        """合并各worker最近一次上报的指标（最多延迟STATS_INTERVAL秒）"""
+        with self._lock:
+            snapshots = [stats.get('metrics') or [] for stats in self._worker_stats.values()]
+        return merge_metrics(snapshots)
+
+    def start_capture(self, path, max_bytes=DEFAULT_MAX_CAPTURE_BYTES):
+        """通知所有worker开始录制，每个worker写入 path.worker-N（各自最多max_bytes字节），重放时一起读取"""
+        if max_bytes <= 0:
+            raise ValueError(f"录制文件大小上限必须大于0: {max_bytes}")
+        if self.hub:
+            self.hub.send_all(BUS_CONFIG, b'capture',
+                              json.dumps({'path': path, 'max_bytes': max_bytes}).encode('utf-8'))
+        print(f"开始录制流量: {path}.worker-*")
+
+    def stop_capture(self):
+        """通知所有worker结束录制，返回最近一次上报的录制统计"""
+        stats = self.capture_stats()
+        if self.hub:
+            self.hub.send_all(BUS_CONFIG, b'capture', json.dumps({'path': None}).encode('utf-8'))
+        return stats
+
+    def capture_stats(self):
+        with self._lock:
+            captures = [stats.get('capture') for stats in self._worker_stats.values()]
+        captures = [capture for capture in captures if capture]
+        if not captures:
+            return None
+        return {
+            'paths': sorted(capture['path'] for capture in captures),
+            'active': any(capture['active'] for capture in captures),
+            'seconds': max(capture['seconds'] for capture in captures),
+            'records': sum(capture['records'] for capture in captures),
+            'bytes': sum(capture['bytes'] for capture in captures),
+            'connections': sum(capture['connections'] for capture in captures),
+            'full': any(capture.get('full') for capture in captures),
+        }
+
+    def broadcast_threadsafe(self, message_data, room=None):
+        """主进程没有客户端连接，经总线交给所有worker投递"""
+        if self.hub:
+            self.hub.send_all(BUS_BROADCAST, (room or '').encode('utf-8'), encode_message(message_data))
+        self.broadcasts.inc()
+
+    def advertise_file_port(self, port):
+        super().advertise_file_port(port)
+        if self.hub:
+            self.hub.send_all(BUS_CONFIG, b'file_port', json.dumps({'port': port}).encode('utf-8'))
+
+    def profile(self, duration, interval=PROFILE_INTERVAL, lines=False, threads=None):
+        """
+        同时采样主进程和所有worker，合并为一个结果，每个栈以进程名（main、worker-N）开头；
+        没有按时发回结果的worker记录在errors中
+        """
+        with self._lock:
+            self._profile_id += 1
+            request_id = self._profile_id
+            self._profiles[request_id] = []
+            workers = len(self._ready)
+        request = {'id': request_id, 'duration': duration, 'interval': interval, 'lines': lines,
+                   'threads': sorted(threads) if threads else None}
+        try:
+            if self.hub:
+                self.hub.send_all(BUS_CONFIG, b'profile', json.dumps(request).encode('utf-8'))
+            local = super().profile(duration, interval, lines, threads)
+            deadline = time.monotonic() + PROFILE_RESULT_TIMEOUT
+            with self._lock:
+                while len(self._profiles[request_id]) < workers:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._profile_done.wait(remaining)
+                results = sorted(self._profiles[request_id], key=lambda result: result['worker'])
+        finally:
+            with self._lock:
+                self._profiles.pop(request_id, None)
+
+        profiles = [local.to_dict()]
+        prefixes = ['main']
+        errors = []
+        for result in results:
+            if 'profile' in result:
+                profiles.append(result['profile'])
+                prefixes.append(f"worker-{result['worker']}")
+            else:
+                errors.append(f"worker-{result['worker']}: {result['error']}")
+        if len(results) < workers:
+            errors.append(f"{workers - len(results)} 个worker没有按时返回结果")
+        merged = merge_profiles(profiles, prefixes)
+        merged.errors = errors
+        return merged
+
+    def configure_rate_limit(self, **limits):
+        """校验后下发给所有worker，各worker按新限额执行"""
+        limits = self.rate_limiter.configure(**limits)
+        if self.hub:
+            self.hub.send_all(BUS_CONFIG, b'rate_limit', json.dumps(limits).encode('utf-8'))
+        return limits
+
+    def get_rate_limit_stats(self):
+        """汇总各worker的限速计数；每个worker独立计算同一IP的令牌桶"""
+        stats = dict(self.rate_limiter.limits(), enabled=self.rate_limiter.enabled,
+                     allowed=0, dropped=0, delayed=0, disconnected=0, connections=0)
+        ips = {}
+        with self._lock:
+            worker_stats = [worker.get('rate_limit') for worker in self._worker_stats.values()]
+        for worker in worker_stats:
+            if worker:
+                for field in ('allowed', 'dropped', 'delayed', 'disconnected', 'connections'):
+                    stats[field] += worker[field]
+                for entry in worker['ips']:
+                    merged = ips.setdefault(entry['ip'], dict(entry, allowed=0, dropped=0, delayed=0, connections=0))
+                    for field in ('allowed', 'dropped', 'delayed', 'connections'):
+                        merged[field] += entry[field]
+        stats['ips'] = sorted(ips.values(), key=lambda entry: entry['dropped'] + entry['delayed'], reverse=True)[:10]
+        return stats
+
+    def call_later(self, delay, callback):
+        # 守护线程，未到期的定时器不会在停止后拖住进程
+        timer = threading.Timer(delay, callback)
+        timer.daemon = True
+        timer.start()
+
+    def send_frame(self, connections, frame):
+        raise NotImplementedError("多进程模式下由worker发送")
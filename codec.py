@@ -0,0 +1,182 @@
+"""
+紧凑的二进制消息编码
+
+JSON消息每次都重复 'type'、'content'、'timestamp'、'ip'、'username' 等键名，
+二进制编码把消息类型和常用字段名换成一个字节的编号（两端共用下面的表）：
+
+    1字节版本标记(BINARY_MAGIC) + 1字节消息类型编号 + 若干字段
+    字段 = 1字节字段编号 + 1字节值类型 + 值
+    编号为0的字段后面跟着1字节长度和字段名，用于表中没有的字段
+
+聊天消息的content是 "IP | 时间 | 用户名: 正文"，与其他字段重复，编码时只保存正文，解码时再拼回去。
+
+JSON消息体总是以 '{' 开头，与版本标记不会混淆，所以接收方不需要知道对方用的是哪种编码，
+协商只决定发送方用哪种编码（见README的"二进制编码"一节）。
+"""
+import json
+import struct
+
+CODEC_JSON = 'json'
+CODEC_BINARY = 'binary'
+CODECS = (CODEC_BINARY, CODEC_JSON)  # 按优先级排列
+BINARY_MAGIC = 0x01
+
+# 编号从1开始，0表示表中没有；只能在末尾追加，修改已有编号须同时更换BINARY_MAGIC
+TYPES = ('message', 'system', 'error', 'welcome', 'history', 'join', 'leave', 'resume', 'hello',
+         'ping', 'pong')
+FIELDS = ('content', 'timestamp', 'ip', 'username', 'room', 'seq', 'epoch', 'since',
+          'codec', 'codecs', 'reset', 'truncated', 'messages', 'id', 'compress', 'compression', 'heartbeat')
+TYPE_IDS = {name: index for index, name in enumerate(TYPES, 1)}
+FIELD_IDS = {name: index for index, name in enumerate(FIELDS, 1)}
+# 只保存正文的content
+CONTENT_BODY = 0xff
+
+# 值类型
+TAG_NONE, TAG_FALSE, TAG_TRUE, TAG_UINT, TAG_INT, TAG_FLOAT, TAG_STR, TAG_LONG_STR, TAG_JSON = range(9)
+
+HEAD = struct.Struct('!BB')
+FIELD = struct.Struct('!BB')
+SHORT_STR = struct.Struct('!BBB')  # 字段编号, 类型, 长度
+UINT = struct.Struct('!I')
+INT = struct.Struct('!q')
+FLOAT = struct.Struct('!d')
+LENGTH = struct.Struct('!I')
+
+
+def content_prefix(message_data):
+    """服务器格式化聊天消息时加在正文前面的部分"""
+    return f"{message_data.get('ip')} | {message_data.get('timestamp')} | {message_data.get('username')}: "
+
+
+def encode_binary(message_data):
+    """将消息字典编码为二进制消息体"""
+    message_type = message_data.get('type')
+    type_id = TYPE_IDS.get(message_type, 0) if isinstance(message_type, str) else 0
+    parts = [HEAD.pack(BINARY_MAGIC, type_id)]
+    content = message_data.get('content')
+    body = None
+    if isinstance(content, str) and 'ip' in message_data and 'username' in message_data:
+        prefix = content_prefix(message_data)
+        if content.startswith(prefix):
+            body = content[len(prefix):]
+
+    for key, value in message_data.items():
+        if key == 'type' and type_id:
+            continue
+        field_id = FIELD_IDS.get(key, 0)
+        if key == 'content' and body is not None:
+            field_id, value = CONTENT_BODY, body
+        if not field_id:
+            name = key.encode('utf-8')
+            if len(name) > 0xff:
+                raise ValueError(f"字段名过长: {key!r}")
+            parts.append(struct.pack('!BB', 0, len(name)))
+            parts.append(name)
+        _encode_value(parts, field_id, value)
+    return b''.join(parts)
+
+
+def _encode_value(parts, field_id, value):
+    if value is None:
+        parts.append(FIELD.pack(field_id, TAG_NONE))
+    elif value is True or value is False:
+        parts.append(FIELD.pack(field_id, TAG_TRUE if value else TAG_FALSE))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        if len(data) <= 0xff:
+            parts.append(SHORT_STR.pack(field_id, TAG_STR, len(data)))
+        else:
+            parts.append(FIELD.pack(field_id, TAG_LONG_STR))
+            parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+    elif isinstance(value, int):
+        if 0 <= value <= 0xffffffff:
+            parts.append(FIELD.pack(field_id, TAG_UINT))
+            parts.append(UINT.pack(value))
+        else:
+            parts.append(FIELD.pack(field_id, TAG_INT))
+            parts.append(INT.pack(value))
+    elif isinstance(value, float):
+        parts.append(FIELD.pack(field_id, TAG_FLOAT))
+        parts.append(FLOAT.pack(value))
+    else:
+        # 列表、嵌套对象等不常见的值仍用JSON
+        data = json.dumps(value).encode('utf-8')
+        parts.append(FIELD.pack(field_id, TAG_JSON))
+        parts.append(LENGTH.pack(len(data)))
+        parts.append(data)
+
+
+def decode_binary(payload):
+    """将二进制消息体（bytes或memoryview）解析为消息字典，格式错误时抛出ValueError"""
+    try:
+        return _decode_binary(payload)
+    except (struct.error, IndexError) as e:
+        raise ValueError(f"二进制消息格式错误: {e}") from None
+
+
+def _decode_binary(payload):
+    magic, type_id = HEAD.unpack_from(payload, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"不支持的二进制编码版本: {magic}")
+    message_data = {}
+    if type_id:
+        message_data['type'] = TYPES[type_id - 1]
+    body = None
+    offset = HEAD.size
+    end = len(payload)
+    while offset < end:
+        field_id, tag = FIELD.unpack_from(payload, offset)
+        offset += FIELD.size
+        if field_id == 0:
+            # 表中没有的字段：tag位置上是字段名长度
+            name_end = offset + tag
+            key = str(payload[offset:name_end], 'utf-8')
+            (field_id, tag), offset = FIELD.unpack_from(payload, name_end), name_end + FIELD.size
+            if field_id != 0:
+                raise ValueError("字段名后的编号必须为0")
+        elif field_id == CONTENT_BODY:
+            key = None
+        else:
+            key = FIELDS[field_id - 1]
+
+        if tag == TAG_STR:
+            length = payload[offset]
+            offset += 1
+            value = str(payload[offset:offset + length], 'utf-8')
+            offset += length
+        elif tag == TAG_UINT:
+            (value,) = UINT.unpack_from(payload, offset)
+            offset += UINT.size
+        elif tag == TAG_NONE:
+            value = None
+        elif tag == TAG_TRUE or tag == TAG_FALSE:
+            value = tag == TAG_TRUE
+        elif tag == TAG_INT:
+            (value,) = INT.unpack_from(payload, offset)
+            offset += INT.size
+        elif tag == TAG_FLOAT:
+            (value,) = FLOAT.unpack_from(payload, offset)
+            offset += FLOAT.size
+        elif tag == TAG_LONG_STR or tag == TAG_JSON:
+            (length,) = LENGTH.unpack_from(payload, offset)
+            offset += LENGTH.size
+            value = str(payload[offset:offset + length], 'utf-8')
+            offset += length
+            if tag == TAG_JSON:
+                value = json.loads(value)
+        else:
+            raise ValueError(f"未知的值类型: {tag}")
+        if offset > end:
+            raise ValueError("消息体被截断")
+
+        if key is None:
+            body = value
+            # 先占住content的位置，保持字段顺序
+            message_data['content'] = None
+        else:
+            message_data[key] = value
+
+    if body is not None:
+        message_data['content'] = content_prefix(message_data) + body
+    return message_data
@@ -0,0 +1,119 @@
+"""
+每个连接的消息压缩
+
+连接时协商（hello消息中的compress字段）后，双方各为这个连接维护一个zlib流：
+同一连接上先后发出的消息共用压缩窗口（最近32KB），重复出现的字段名、用户名、IP等
+在后面的消息中只需要一个回溯引用。窗口初始内容是下面的预置字典，第一条消息也能受益。
+
+- 消息体小于threshold的帧（普通聊天消息）保持原样，不花CPU压缩
+- 压缩后的消息体 = 1字节标记(COMPRESSED_MAGIC) + deflate数据，每帧以同步刷新结束，
+  末尾固定的 00 00 ff ff 四个字节省略，解压时补回
+- 流有状态，压缩必须在帧真正写出时按顺序进行（见outbound.py），已压缩的帧不能再被丢弃
+"""
+import time
+import zlib
+from protocol import HEADER_SIZE, MAX_FRAME_SIZE, ProtocolError, encode_frame
+
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSIONS = (COMPRESSION_ZLIB,)
+COMPRESSED_MAGIC = 0x02
+DEFAULT_COMPRESS_THRESHOLD = 512
+DEFAULT_COMPRESS_LEVEL = 6
+SYNC_TAIL = b'\x00\x00\xff\xff'
+WINDOW_BITS = -15  # 原始deflate流，不带zlib头和校验和
+# 预置字典：消息中最常见的片段，越常见的放得越靠后；修改后新旧版本无法互通
+PRESET_DICTIONARY = (
+    b'{"type": "history", "epoch": "", "reset": false, "truncated": false, "messages": ['
+    b'{"type": "system", "content": "", "timestamp": "", "room": "", "seq": '
+    b'{"type": "message", "content": "", "timestamp": "", "ip": "192.168.", "username": "", "room": "\\u5927\\u5385", "seq": '
+)
+
+# 压缩耗时按线程CPU时间统计，不支持时退化为墙钟时间
+cpu_time = getattr(time, 'thread_time', time.perf_counter)
+
+
+class StreamCompressor:
+    """一个连接发送方向的压缩流"""
+
+    def __init__(self, threshold=DEFAULT_COMPRESS_THRESHOLD, level=DEFAULT_COMPRESS_LEVEL):
+        self.threshold = threshold
+        self.level = level
+        # zlib流要占用约256KB，到第一个需要压缩的帧时才创建：小于threshold的帧不经过压缩流，
+        # 输出与一开始就创建完全相同，而只发普通聊天消息的连接（大多数客户端）始终不需要它
+        self._compressor = None
+        self.frames = 0
+        self.compressed_frames = 0
+        self.bytes_in = 0   # 压缩前的帧字节数（只统计压缩过的帧）
+        self.bytes_out = 0  # 压缩后的帧字节数
+        self.cpu_seconds = 0.0
+
+    def compress_frame(self, frame):
+        """返回要写出的帧：足够大时压缩，否则原样返回"""
+        self.frames += 1
+        if len(frame) - HEADER_SIZE < self.threshold:
+            return frame
+        start = cpu_time()
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, WINDOW_BITS, zdict=PRESET_DICTIONARY)
+        payload = memoryview(frame)[HEADER_SIZE:]
+        data = self._compressor.compress(payload) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        compressed = encode_frame(b''.join((bytes((COMPRESSED_MAGIC,)), data[:-len(SYNC_TAIL)])))
+        self.cpu_seconds += cpu_time() - start
+        self.compressed_frames += 1
+        self.bytes_in += len(frame)
+        self.bytes_out += len(compressed)
+        return compressed
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'compressed_frames': self.compressed_frames,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            'cpu_ms': round(self.cpu_seconds * 1000, 3),
+            'cpu_us_per_frame': round(self.cpu_seconds * 1e6 / self.compressed_frames, 1)
+            if self.compressed_frames else None,
+        }
+
+
+class StreamDecompressor:
+    """一个连接接收方向的解压流"""
+
+    def __init__(self, max_size=MAX_FRAME_SIZE):
+        self.max_size = max_size
+        # 同样到收到第一个压缩帧时才创建
+        self._decompressor = None
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def decompress(self, payload):
+        """把压缩的消息体还原为原来的消息体，数据损坏或解压后超过上限时抛出ProtocolError"""
+        start = cpu_time()
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj(WINDOW_BITS, zdict=PRESET_DICTIONARY)
+        try:
+            data = self._decompressor.decompress(bytes(payload[1:]) + SYNC_TAIL, self.max_size)
+        except zlib.error as e:
+            raise ProtocolError(f"解压失败: {e}") from None
+        if self._decompressor.unconsumed_tail:
+            raise ProtocolError(f"解压后的消息超过上限 {self.max_size}")
+        self.cpu_seconds += cpu_time() - start
+        self.frames += 1
+        self.bytes_in += len(payload)
+        self.bytes_out += len(data)
+        return data
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'cpu_ms': round(self.cpu_seconds * 1000, 3),
+        }
+
+
+def is_compressed(payload):
+    return bool(payload) and payload[0] == COMPRESSED_MAGIC
@@ -0,0 +1,332 @@
+"""
+服务器互联（联邦）
+
+每个办公网段运行一台服务器，服务器之间建立对等连接并互相转发广播，
+不同网段的用户不必都连到同一台中心服务器。
+
+- 每台服务器启动时生成随机的origin id，自己发出的每条广播带上递增的序号
+- 收到的记录按(origin, seq)去重：每个origin只接受比已见序号更大的记录，
+  所以环形或网状拓扑中同一条消息从多条路径到达时只投递一次；origin是自己的记录直接丢弃，防止环路
+- 新记录投递给本地客户端，并原样转发给除来源以外的其他对等服务器
+- 转发的记录在batch_interval窗口内合并成一个帧发送
+- 投递是尽力而为的：去重只记每个origin的最大序号，连接断开时还在途中的记录，
+  在更大的序号经其他路径到达后就不会再被接受，这部分消息会丢失（不会重复或乱序）
+- 消息体不是JSON对象的记录直接丢弃，不影响同一批中的其他记录
+
+对等连接上先交换一个JSON帧 {"type": "hello", "server_id": ...}，之后每个帧是一批记录：
+  16字节origin + 8字节seq + 2字节房间名长度 + 房间名(UTF-8，空表示所有人) + 完整的消息帧
+"""
+import socket
+import struct
+import threading
+import time
+import uuid
+from protocol import FrameDecoder, ProtocolError, HEADER, HEADER_SIZE, encode_frame, encode_message, decode_message
+
+RECORD = struct.Struct('!16sQH')
+# 转发记录的合并窗口（秒）
+DEFAULT_BATCH_INTERVAL = 0.005
+# 单个批次帧的大小上限
+BATCH_BYTES = 256 * 1024
+# 对端积压超过这个字节数时断开重连，期间的消息会丢失
+MAX_LINK_BACKLOG = 8 * 1024 * 1024
+RECONNECT_DELAY = 2.0
+
+
+def parse_peer(peer):
+    """解析 "host:port" 形式的对等服务器地址"""
+    host, _, port = peer.strip().rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"对等服务器地址无效: {peer}")
+    return host, int(port)
+
+
+class PeerLink:
+    """与一台对等服务器之间的连接，双向收发批次"""
+
+    def __init__(self, federation, sock, address):
+        self.federation = federation
+        self.sock = sock
+        self.address = address
+        self.peer_id = None
+        self.cond = threading.Condition()
+        self.records = []
+        self.pending_bytes = 0
+        self.closed = False
+        self.sent_batches = 0
+        self.sent_records = 0
+
+    def run(self):
+        """完成握手后收发数据，连接断开时返回"""
+        try:
+            self.sock.sendall(encode_message({'type': 'hello', 'server_id': self.federation.server_id.hex()}))
+            decoder = FrameDecoder()
+            hello = self._read_hello(decoder)
+            if hello is None:
+                return
+            self.peer_id = bytes.fromhex(hello['server_id'])
+            if self.peer_id == self.federation.server_id:
+                print(f"对等服务器 {self.address} 就是本机，忽略")
+                return
+            self.federation.add_link(self)
+            writer = threading.Thread(target=self._write_loop, daemon=True)
+            writer.start()
+            self._read_loop(decoder)
+        except (OSError, ProtocolError, ValueError, KeyError) as e:
+            print(f"对等服务器 {self.address} 连接错误: {e}")
+        finally:
+            self.close()
+            self.federation.remove_link(self)
+
+    def _read_hello(self, decoder):
+        while True:
+            for payload in decoder.frames():
+                message = decode_message(payload)
+                if message.get('type') != 'hello':
+                    raise ValueError(f"握手消息无效: {message!r}")
+                return message
+            if decoder.recv_into(self.sock) == 0:
+                return None
+
+    def _read_loop(self, decoder):
+        # 握手帧之后可能已经收到了批次
+        while True:
+            for payload in decoder.frames():
+                self.federation.receive_batch(payload, self)
+            if decoder.recv_into(self.sock) == 0:
+                return
+
+    def send(self, record):
+        """放入一条待转发的记录，积压过多时断开"""
+        with self.cond:
+            if self.closed:
+                return
+            if self.pending_bytes + len(record) > MAX_LINK_BACKLOG:
+                print(f"对等服务器 {self.address} 积压过多，断开连接")
+                self._shutdown()
+                return
+            self.records.append(record)
+            self.pending_bytes += len(record)
+            self.cond.notify()
+
+    def _write_loop(self):
+        interval = self.federation.batch_interval
+        while True:
+            with self.cond:
+                while not self.records and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+            if interval > 0:
+                # 等待一个合并窗口，让更多记录进入同一批
+                time.sleep(interval)
+            with self.cond:
+                records, self.records = self.records, []
+                self.pending_bytes = 0
+            try:
+                self.sock.sendall(self._encode_batches(records))
+            except OSError:
+                self.close()
+                return
+
+    def _encode_batches(self, records):
+        frames = []
+        batch = []
+        size = 0
+        for record in records:
+            if batch and size + len(record) > BATCH_BYTES:
+                frames.append(encode_frame(b''.join(batch)))
+                batch, size = [], 0
+            batch.append(record)
+            size += len(record)
+        frames.append(encode_frame(b''.join(batch)))
+        self.sent_batches += len(frames)
+        self.sent_records += len(records)
+        return b''.join(frames)
+
+    def _shutdown(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self._shutdown()
+        self.sock.close()
+
+    def stats(self):
+        return {
+            'address': f"{self.address[0]}:{self.address[1]}",
+            'peer_id': self.peer_id.hex() if self.peer_id else None,
+            'pending_bytes': self.pending_bytes,
+            'sent_batches': self.sent_batches,
+            'sent_records': self.sent_records,
+        }
+
+
+class Federation:
+    """
+    服务器的联邦relay：作为server.relays中的一员转发本地广播，
+    并把其他服务器转发来的广播投递给本地客户端
+    """
+
+    def __init__(self, server, host='0.0.0.0', port=None, peers=(), batch_interval=DEFAULT_BATCH_INTERVAL):
+        self.server = server
+        self.host = host
+        self.port = port  # 为None时不监听，只主动连接peers
+        self.peers = [parse_peer(peer) if isinstance(peer, str) else tuple(peer) for peer in peers]
+        self.batch_interval = batch_interval
+        self.server_id = uuid.uuid4().bytes
+        self.running = False
+        self.listener = None
+        self.links = []  # 写时复制，遍历时不需要加锁
+        self._lock = threading.Lock()
+        # 发布本地广播用单独的锁：接收线程持有_lock时会进入服务器的广播锁，
+        # 发布不必等待远端记录的投递
+        self._publish_lock = threading.Lock()
+        self._seq = 0
+        self._seen = {}  # origin -> 已投递的最大序号
+        self.received_records = 0
+        self.duplicate_records = 0
+        self.invalid_records = 0
+
+    def start(self):
+        self.running = True
+        if self.port is not None:
+            try:
+                self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.listener.bind((self.host, self.port))
+                self.listener.listen()
+            except OSError as e:
+                print(f"联邦端口监听失败: {e}")
+                self.listener.close()
+                self.listener = None
+                self.running = False
+                return False
+            threading.Thread(target=self._accept_loop, daemon=True).start()
+        for address in self.peers:
+            threading.Thread(target=self._connect_loop, args=(address,), daemon=True).start()
+        self.server.relays.append(self)
+        print(f"联邦已启动，本机id {self.server_id.hex()[:8]}，监听端口 {self.port}，对等服务器 {len(self.peers)} 个")
+        return True
+
+    def stop(self):
+        self.running = False
+        if self in self.server.relays:
+            self.server.relays.remove(self)
+        if self.listener:
+            try:
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.listener.close()
+        for link in self.links:
+            link.close()
+        print("联邦已停止")
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=PeerLink(self, sock, address).run, daemon=True).start()
+
+    def _connect_loop(self, address):
+        """主动连接一台对等服务器，断开后自动重连"""
+        while self.running:
+            try:
+                sock = socket.create_connection(address, timeout=5)
+                sock.settimeout(None)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                time.sleep(RECONNECT_DELAY)
+                continue
+            PeerLink(self, sock, address).run()
+            if self.running:
+                time.sleep(RECONNECT_DELAY)
+
+    def add_link(self, link):
+        with self._lock:
+            self.links = self.links + [link]
+        print(f"已连接对等服务器 {link.address} ({link.peer_id.hex()[:8]})")
+
+    def remove_link(self, link):
+        with self._lock:
+            if link not in self.links:
+                return
+            self.links = [other for other in self.links if other is not link]
+        print(f"对等服务器 {link.address} 已断开")
+
+    def publish(self, frame, room):
+        """本地广播：分配序号后转发给所有对等服务器"""
+        room_bytes = (room or '').encode('utf-8')
+        # 分配序号和入队在同一把锁内完成，保证每条连接上的序号是递增的
+        with self._publish_lock:
+            self._seq += 1
+            record = RECORD.pack(self.server_id, self._seq, len(room_bytes)) + room_bytes + frame
+            for link in self.links:
+                link.send(record)
+
+    def receive_batch(self, payload, source):
+        """处理对等服务器发来的一批记录"""
+        offset = 0
+        end = len(payload)
+        while offset < end:
+            # 对端发来的数据不可信，解析前先检查长度，截断的记录按协议错误断开重连
+            if offset + RECORD.size > end:
+                raise ProtocolError("批次中的记录不完整")
+            origin, seq, room_length = RECORD.unpack_from(payload, offset)
+            room_start = offset + RECORD.size
+            frame_start = room_start + room_length
+            if frame_start + HEADER_SIZE > end:
+                raise ProtocolError("批次中的记录不完整")
+            (frame_length,) = HEADER.unpack_from(payload, frame_start)
+            record_end = frame_start + HEADER_SIZE + frame_length
+            if record_end > end:
+                raise ProtocolError("批次中的记录不完整")
+            record = bytes(payload[offset:record_end])
+            offset = record_end
+            try:
+                room = record[RECORD.size:RECORD.size + room_length].decode('utf-8') or None
+                valid = isinstance(decode_message(memoryview(record)[RECORD.size + room_length + HEADER_SIZE:]), dict)
+            except ValueError:
+                valid = False
+            if not valid:
+                with self._lock:
+                    self.invalid_records += 1
+                print(f"对等服务器 {getattr(source, 'address', None)} 发来无效的记录，已丢弃")
+                continue
+            # 多条连接的读线程并发收到同一origin的记录时，检查、投递和转发必须一起完成，
+            # 否则后到的小序号会被当作重复丢弃
+            with self._lock:
+                self.received_records += 1
+                if origin == self.server_id or seq <= self._seen.get(origin, 0):
+                    # 自己发出的（环路）或已经投递过的（多路径）记录
+                    self.duplicate_records += 1
+                    continue
+                self._seen[origin] = seq
+                self.server.deliver_threadsafe(record[RECORD.size + room_length:], room)
+                for link in self.links:
+                    if link is not source:
+                        link.send(record)
+
+    def stats(self):
+        with self._lock:
+            links = self.links
+            return {
+                'server_id': self.server_id.hex(),
+                'published': self._seq,
+                'received_records': self.received_records,
+                'duplicate_records': self.duplicate_records,
+                'invalid_records': self.invalid_records,
+                'origins': len(self._seen),
+                'peers': [link.stats() for link in links],
+            }
@@ -0,0 +1,451 @@
+"""
+文件传输
+
+日志、截图等文件不经过聊天连接：服务器在单独的端口上接受文件连接，每个传输一个线程，
+上传的数据分块写入磁盘，下载用 socket.sendfile 由内核直接从文件发到socket，不经过用户态。
+一个几百MB的文件在传输时不会占用聊天连接的发送队列，也不会推迟 broadcast_message 中的聊天消息；
+文件连接还设置了低优先级的IP_TOS，网络拥塞时让路给聊天流量。
+
+文件按SHA-256内容寻址保存（file_id即为摘要），同一个文件只保存一份。
+上传完成并校验通过后，服务器在上传者指定的房间广播一条 type 为 file 的消息，其他客户端据此下载。
+
+文件连接上先交换长度前缀的JSON帧（见protocol.py），之后是原始字节：
+  上传: -> {"type": "upload", "name", "size", "sha256", "username", "room"}
+        <- {"ok": true, "offset": 已收到的字节数}，客户端从offset开始发送剩余的字节
+        <- {"ok": true, "file_id"} 或 {"ok": false, "error"}（校验失败时丢弃已收到的数据）
+  下载: -> {"type": "download", "file_id", "offset"}
+        <- {"ok": true, "size"}，之后是从offset到文件末尾的字节
+断点续传：上传中断时已收到的部分保留在 <file_id>.part 中，再次上传同一文件时从该处继续；
+下载中断时客户端从本地 .part 文件的长度继续。
+
+保存目录有总大小上限：开始上传前为整个文件预留空间，超出时按最近使用时间（上传或下载）
+淘汰最旧的文件和中断后无人续传的 .part，正在上传的文件不会被淘汰；仍然放不下时拒绝上传。
+"""
+import hashlib
+import json
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from datetime import datetime
+from protocol import HEADER, HEADER_SIZE, encode_frame
+from chat_server import DEFAULT_ROOM, normalize_room
+
+DEFAULT_MAX_FILE_SIZE = 1024 * 1024 * 1024
+# 保存目录中所有文件（含 .part）的总大小上限
+DEFAULT_MAX_TOTAL_SIZE = 4 * 1024 * 1024 * 1024
+DEFAULT_MAX_TRANSFERS = 16
+CHUNK_SIZE = 256 * 1024
+# 请求帧的上限，文件内容不走帧
+MAX_REQUEST_SIZE = 64 * 1024
+# 文件连接超过这个时间（秒）没有数据时断开，已收到的部分保留用于续传
+IDLE_TIMEOUT = 60.0
+# 低优先级（DSCP CS1），网络拥塞时聊天连接优先
+FILE_TOS = 0x20
+MAX_NAME_LENGTH = 255
+UPLOAD_RETRIES = 3
+_FILE_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        data += chunk
+    return bytes(data)
+
+
+def read_request(sock):
+    """读取一个JSON帧；文件内容紧跟在帧后面，不能多读"""
+    (length,) = HEADER.unpack(_recv_exact(sock, HEADER_SIZE))
+    if length > MAX_REQUEST_SIZE:
+        raise ValueError(f"请求过大: {length}")
+    message = json.loads(_recv_exact(sock, length))
+    if not isinstance(message, dict):
+        raise ValueError("请求格式错误")
+    return message
+
+
+def send_response(sock, message):
+    sock.sendall(encode_frame(json.dumps(message).encode('utf-8')))
+
+
+def file_digest(path):
+    return sha256_of(path).hexdigest()
+
+
+def sha256_of(path, limit=None):
+    """文件（或前limit字节）的SHA-256对象，可以继续update后面的数据"""
+    digest = hashlib.sha256()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+
+def clean_name(name):
+    """只保留文件名本身，去掉路径和控制字符"""
+    name = os.path.basename(str(name).replace('\\', '/'))
+    name = ''.join(char for char in name if char.isprintable())[:MAX_NAME_LENGTH].strip()
+    return name if name not in ('', '.', '..') else 'file'
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def set_low_priority(sock):
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, FILE_TOS)
+    except (AttributeError, OSError):
+        pass
+
+
+class FileServer:
+    """接受文件连接，保存上传的文件并提供下载；上传完成后通过聊天服务器广播文件消息"""
+
+    def __init__(self, server, host='0.0.0.0', port=0, directory=None,
+                 max_file_size=DEFAULT_MAX_FILE_SIZE, max_transfers=DEFAULT_MAX_TRANSFERS,
+                 max_total_size=DEFAULT_MAX_TOTAL_SIZE):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'chat-files')
+        self.max_file_size = max_file_size
+        if max_transfers < 1:
+            raise ValueError(f"同时传输数必须大于0: {max_transfers}")
+        if max_total_size < max_file_size:
+            raise ValueError(f"总大小上限不能小于单个文件上限: {max_total_size} < {max_file_size}")
+        self.max_total_size = max_total_size
+        self.slots = threading.BoundedSemaphore(max_transfers)
+        self.running = False
+        self.listener = None
+        self._lock = threading.Lock()
+        self._uploading = {}  # 正在上传的file_id -> 预留的字节数，同一文件同时只接受一个上传
+        self.stored_bytes = 0  # 最近一次统计的已保存字节数（不含预留）
+        self.evicted = 0
+        self.active = 0
+        self.uploads = 0
+        self.downloads = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rejected = 0
+
+    def start(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((self.host, self.port))
+            self.listener.listen()
+        except OSError as e:
+            print(f"文件端口监听失败: {e}")
+            if self.listener:
+                self.listener.close()
+                self.listener = None
+            return False
+        self.port = self.listener.getsockname()[1]
+        self.running = True
+        threading.Thread(target=self._accept_loop, name='file_accept', daemon=True).start()
+        self.server.advertise_file_port(self.port)
+        print(f"文件传输已启动，端口 {self.port}，目录 {self.directory}")
+        return True
+
+    def stop(self):
+        self.running = False
+        self.server.advertise_file_port(None)
+        if self.listener:
+            try:
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.listener.close()
+            self.listener = None
+        print("文件传输已停止")
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+            if not self.slots.acquire(blocking=False):
+                # 同时传输数有上限，超出时直接拒绝，客户端稍后重试
+                self.rejected += 1
+                self._reject(sock, '同时传输的文件过多，请稍后重试')
+                continue
+            threading.Thread(target=self._handle, args=(sock, address), name='file_transfer', daemon=True).start()
+
+    def _reject(self, sock, error):
+        try:
+            sock.settimeout(5)
+            send_response(sock, {'ok': False, 'error': error})
+        except OSError:
+            pass
+        sock.close()
+
+    def path(self, file_id):
+        return os.path.join(self.directory, file_id)
+
+    def _handle(self, sock, address):
+        with self._lock:
+            self.active += 1
+        try:
+            sock.settimeout(IDLE_TIMEOUT)
+            set_low_priority(sock)
+            request = read_request(sock)
+            if request.get('type') == 'upload':
+                self._upload(sock, address, request)
+            elif request.get('type') == 'download':
+                self._download(sock, request)
+            else:
+                send_response(sock, {'ok': False, 'error': f"未知的请求: {request.get('type')!r}"})
+        except (OSError, ValueError) as e:
+            print(f"文件传输中断 {address}: {e}")
+        finally:
+            sock.close()
+            with self._lock:
+                self.active -= 1
+            self.slots.release()
+
+    def _upload(self, sock, address, request):
+        file_id = str(request.get('sha256', '')).lower()
+        size = request.get('size')
+        if not _FILE_ID.match(file_id) or not isinstance(size, int) or size < 0:
+            send_response(sock, {'ok': False, 'error': '上传请求无效'})
+            return
+        if size > self.max_file_size:
+            send_response(sock, {'ok': False, 'error': f"文件超过上限 {format_size(self.max_file_size)}"})
+            return
+        path = self.path(file_id)
+        error = None
+        with self._lock:
+            exists = os.path.exists(path) and os.path.getsize(path) == size
+            if file_id in self._uploading:
+                error = '该文件正在上传'
+            elif exists:
+                # 已有同样内容的文件，不需要再传，只刷新使用时间
+                os.utime(path)
+            else:
+                self._uploading[file_id] = size
+                if not self._make_room():
+                    del self._uploading[file_id]
+                    self.rejected += 1
+                    error = '服务器存储空间不足，请稍后重试'
+        if error:
+            send_response(sock, {'ok': False, 'error': error})
+            return
+        if exists:
+            send_response(sock, {'ok': True, 'offset': size})
+        else:
+            try:
+                if not self._receive(sock, file_id, size):
+                    return
+            finally:
+                with self._lock:
+                    self._uploading.pop(file_id, None)
+        send_response(sock, {'ok': True, 'file_id': file_id})
+        self.uploads += 1
+        self.announce(address, request, file_id, size)
+
+    def _make_room(self):
+        """
+        按最近使用时间淘汰旧文件，直到已保存的文件加上正在上传的预留不超过总大小上限
+        须持有self._lock，仍然超出时返回False
+        """
+        reserved = sum(self._uploading.values())
+        stored = 0
+        candidates = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name = entry.name
+                file_id = name[:-len('.part')] if name.endswith('.part') else name
+                if not _FILE_ID.match(file_id) or file_id in self._uploading:
+                    # 正在上传的文件（及其 .part）已按完整大小预留
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                stored += stat.st_size
+                candidates.append((stat.st_mtime, stat.st_size, entry.path))
+        candidates.sort()
+        for _, size, path in candidates:
+            if stored + reserved <= self.max_total_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            stored -= size
+            self.evicted += 1
+            print(f"文件目录超过上限 {format_size(self.max_total_size)}，删除 {os.path.basename(path)}")
+        self.stored_bytes = stored
+        return stored + reserved <= self.max_total_size
+
+    def _receive(self, sock, file_id, size):
+        """把文件内容接收到 .part，完整并校验通过后改名，返回是否成功"""
+        part = self.path(file_id) + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset > size:
+            offset = 0
+        send_response(sock, {'ok': True, 'offset': offset})
+        # 边收边算摘要，续传时先算已有部分，完成后不必再把整个文件读一遍
+        digest = sha256_of(part, offset) if offset else hashlib.sha256()
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(part, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            while offset < size:
+                received = sock.recv_into(view, min(CHUNK_SIZE, size - offset))
+                if received == 0:
+                    # 连接中断，已收到的部分留给续传
+                    return False
+                f.write(view[:received])
+                digest.update(view[:received])
+                offset += received
+                self.bytes_in += received
+        if digest.hexdigest() != file_id:
+            os.remove(part)
+            send_response(sock, {'ok': False, 'error': '文件校验失败，请重新上传'})
+            return False
+        os.replace(part, self.path(file_id))
+        return True
+
+    def _download(self, sock, request):
+        file_id = str(request.get('file_id', '')).lower()
+        offset = request.get('offset', 0)
+        path = self.path(file_id)
+        if not _FILE_ID.match(file_id) or not os.path.exists(path):
+            send_response(sock, {'ok': False, 'error': '文件不存在'})
+            return
+        size = os.path.getsize(path)
+        if not isinstance(offset, int) or not 0 <= offset <= size:
+            send_response(sock, {'ok': False, 'error': f"续传位置无效: {offset}"})
+            return
+        send_response(sock, {'ok': True, 'size': size})
+        with open(path, 'rb') as f:
+            # 刷新使用时间，空间不足时常被下载的文件最后淘汰；已打开的文件被淘汰后仍可读完
+            os.utime(path)
+            # 内核直接把文件内容写入socket；不支持sendfile的平台自动退回到read+send
+            sent = sock.sendfile(f, offset, size - offset)
+        self.bytes_out += sent
+        self.downloads += 1
+
+    def announce(self, address, request, file_id, size):
+        """在上传者指定的房间广播文件消息"""
+        username = request.get('username') or '未知用户'
+        name = clean_name(request.get('name'))
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        room = normalize_room(request.get('room') or DEFAULT_ROOM) or DEFAULT_ROOM
+        print(f"收到文件: {name} ({format_size(size)}) 来自 {address[0]}")
+        self.server.broadcast_threadsafe({
+            'type': 'file',
+            'content': f"{address[0]} | {timestamp} | {username}: [文件] {name} ({format_size(size)})",
+            'timestamp': timestamp,
+            'ip': address[0],
+            'username': username,
+            'file_id': file_id,
+            'name': name,
+            'size': size,
+            'room': room
+        }, room)
+
+    def stats(self):
+        with self._lock:
+            active = self.active
+            uploading = len(self._uploading)
+        return {
+            'port': self.port,
+            'directory': self.directory,
+            'active': active,
+            'uploading': uploading,
+            'uploads': self.uploads,
+            'downloads': self.downloads,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'rejected': self.rejected,
+            'stored_bytes': self.stored_bytes,
+            'max_total_size': self.max_total_size,
+            'evicted': self.evicted,
+        }
+
+
+def _connect(host, port):
+    sock = socket.create_connection((host, port), timeout=IDLE_TIMEOUT)
+    set_low_priority(sock)
+    return sock
+
+
+def upload_file(host, port, path, username, room=None, retries=UPLOAD_RETRIES):
+    """上传文件，连接中断时从服务器已收到的位置续传，返回file_id；服务器拒绝时抛出ValueError"""
+    size = os.path.getsize(path)
+    file_id = file_digest(path)
+    request = {'type': 'upload', 'name': os.path.basename(path), 'size': size, 'sha256': file_id,
+               'username': username, 'room': room}
+    for attempt in range(retries + 1):
+        try:
+            with _connect(host, port) as sock, open(path, 'rb') as f:
+                send_response(sock, request)
+                reply = read_request(sock)
+                if not reply.get('ok'):
+                    raise ValueError(reply.get('error'))
+                if reply['offset'] < size:
+                    sock.sendfile(f, reply['offset'], size - reply['offset'])
+                reply = read_request(sock)
+                if not reply.get('ok'):
+                    raise ValueError(reply.get('error'))
+                return reply['file_id']
+        except OSError as e:
+            if attempt == retries:
+                raise
+            print(f"上传中断，{attempt + 1} 秒后续传: {e}")
+            time.sleep(attempt + 1)
+
+
+def download_file(host, port, file_id, path, retries=UPLOAD_RETRIES):
+    """下载文件到path，先写入 path.part，中断后从已下载的位置续传，校验通过后改名"""
+    part = path + '.part'
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        try:
+            with _connect(host, port) as sock, open(part, 'ab') as f:
+                send_response(sock, {'type': 'download', 'file_id': file_id, 'offset': offset})
+                reply = read_request(sock)
+                if not reply.get('ok'):
+                    raise ValueError(reply.get('error'))
+                size = reply['size']
+                buffer = bytearray(CHUNK_SIZE)
+                view = memoryview(buffer)
+                while offset < size:
+                    received = sock.recv_into(view, min(CHUNK_SIZE, size - offset))
+                    if received == 0:
+                        raise ConnectionError("连接已关闭")
+                    f.write(view[:received])
+                    offset += received
+            break
+        except OSError as e:
+            if attempt == retries:
+                raise
+            print(f"下载中断，{attempt + 1} 秒后续传: {e}")
+            time.sleep(attempt + 1)
+    if file_digest(part) != file_id:
+        os.remove(part)
+        raise ValueError('文件校验失败，请重新下载')
+    os.replace(part, path)
+    return path
@@ -0,0 +1,123 @@
+"""
+服务器端消息历史
+
+服务器为每条广播分配单调递增的序号(seq)，并在内存中保留最近的若干条（环形缓冲区，超出容量淘汰最旧的）。
+客户端加入房间或重连时带上已收到的最大序号，服务器只补发缺失的部分，并且合并成一个history帧一次发出。
+
+每次服务器启动都会生成新的epoch；客户端带来的epoch与当前不同时（服务器重启过，或多进程模式下连到了另一个worker），
+它的序号没有意义，服务器改为补发缓冲区中的全部相关消息并标记reset。
+
+配置了磁盘日志（见message_log.py）时，每条消息同时追加到日志，epoch和序号在重启后延续，
+内存中没有的更早消息从日志中读取。
+"""
+import json
+import threading
+import uuid
+from collections import deque
+from protocol import HEADER_SIZE, MAX_FRAME_SIZE, encode_frame, encode_message
+
+DEFAULT_HISTORY_SIZE = 1000
+# 一个history帧中消息体的总字节数上限，留出余量保证不超过MAX_FRAME_SIZE
+HISTORY_FRAME_BUDGET = MAX_FRAME_SIZE // 2
+
+
+class HistoryBuffer:
+    def __init__(self, capacity=DEFAULT_HISTORY_SIZE, log=None):
+        if capacity < 0:
+            raise ValueError(f"历史消息容量不能为负数: {capacity}")
+        self.capacity = capacity
+        # 一次补发的消息数上限，有磁盘日志时可以超过内存容量
+        self.max_replay = max(capacity, DEFAULT_HISTORY_SIZE)
+        self.log = log
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.entries = deque(maxlen=capacity)  # (seq, 房间, 帧)
+        self.lock = threading.Lock()
+        if log is not None:
+            # 从日志恢复epoch、序号和最近的消息
+            self.epoch = log.epoch
+            self.seq = log.last_seq
+            if capacity:
+                self.entries.extend(log.read_range(self.seq - capacity + 1, self.seq))
+
+    def record(self, message_data, room=None):
+        """为消息分配序号并编码，记入历史，返回编码后的帧"""
+        with self.lock:
+            self.seq += 1
+            frame = encode_message(dict(message_data, seq=self.seq))
+            if self.capacity:
+                self.entries.append((self.seq, room, frame))
+            if self.log is not None:
+                self.log.append(self.seq, room, frame)
+            return frame
+
+    def since(self, seq, rooms):
+        """
+        返回序号大于seq、属于rooms（或发给所有人）的消息帧，按序号排列
+        第二个返回值表示中间是否有消息已被淘汰
+        """
+        with self.lock:
+            matched = []
+            complete = False
+            # 从最新的一端往回找，缺口通常很小
+            for entry_seq, room, frame in reversed(self.entries):
+                if entry_seq <= seq:
+                    complete = True
+                    break
+                if len(matched) >= self.max_replay:
+                    break
+                if room is None or room in rooms:
+                    matched.append(frame)
+            else:
+                # 内存中的消息都比seq新，更早的部分从磁盘日志中读取
+                oldest = self.entries[0][0] if self.entries else self.seq + 1
+                if self.log is not None:
+                    frames, complete = self.log.scan_backward(oldest - 1, seq, rooms,
+                                                              self.max_replay - len(matched))
+                    matched.extend(frames)
+                else:
+                    complete = seq + 1 >= oldest
+            # 从头请求（seq为0）时不算缺口
+            truncated = seq > 0 and not complete
+            matched.reverse()
+            return matched, truncated
+
+    def encode_history(self, frames, **fields):
+        """
+        把多条历史消息拼成一个history帧
+        每个帧的消息体本身就是JSON对象，直接拼接成数组，不需要重新解析和编码
+        总大小超过HISTORY_FRAME_BUDGET时只保留最新的部分，并标记truncated
+        """
+        size = 0
+        start = len(frames)
+        while start > 0 and size + len(frames[start - 1]) - HEADER_SIZE + 1 <= HISTORY_FRAME_BUDGET:
+            start -= 1
+            size += len(frames[start]) - HEADER_SIZE + 1
+        if start:
+            frames = frames[start:]
+            fields['truncated'] = True
+        head = json.dumps(dict(fields, type='history', epoch=self.epoch, seq=self.seq))
+        payload = b''.join((
+            head[:-1].encode('utf-8'),
+            b', "messages": [',
+            b','.join(memoryview(frame)[HEADER_SIZE:] for frame in frames),
+            b']}'
+        ))
+        return encode_frame(payload)
+
+    def close(self):
+        """关闭磁盘日志，之后的消息只保留在内存中"""
+        with self.lock:
+            log, self.log = self.log, None
+        if log is not None:
+            log.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'epoch': self.epoch,
+                'seq': self.seq,
+                'size': len(self.entries),
+                'capacity': self.capacity,
+                'log': self.log.stats() if self.log is not None else None,
+            }
@@ -1,228 +1,61 @@
-import socket
 import threading
 import time
-from datetime import datetime
 import json
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import webview
 import sys
 import os
-import queue
+from codec import CODECS, CODEC_BINARY
+from chat_server import ChatServer
+from chat_client import ChatClient
+from client_pool import SessionPool, SessionLimitReached, new_token
+from async_server import AsyncChatServer
+from cluster import MultiProcessChatServer
+from federation import Federation
+from ratelimit import DEFAULT_RATE_LIMIT
+from capture import DEFAULT_MAX_CAPTURE_BYTES, capture_file_path
+from message_log import history_dir_path
+from profiler import DEFAULT_INTERVAL as PROFILE_INTERVAL, ProfilerBusy, sample as sample_stacks
+from filetransfer import FileServer, DEFAULT_MAX_FILE_SIZE, DEFAULT_MAX_TOTAL_SIZE, clean_name
+from ws_gateway import WebSocketGateway
+import tempfile
+import shutil
+from metrics import merge as merge_metrics, render as render_metrics
+import multiprocessing
 
-class ChatServer:
-    def __init__(self, host='0.0.0.0', port=8080):
-        self.host = host
-        self.port = port
-        self.clients = []
-        self.server_socket = None
-        self.running = False
-        
-    def start_server(self):
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            self.running = True
-            print(f"服务器启动在 {self.host}:{self.port}")
-            
-            # 启动接受客户端连接的线程
-            accept_thread = threading.Thread(target=self.accept_clients)
-            accept_thread.daemon = True
-            accept_thread.start()
-            return True
-        except Exception as e:
-            print(f"服务器启动失败: {e}")
-            return False
-    
-    def accept_clients(self):
-        while self.running:
-            try:
-                client_socket, client_address = self.server_socket.accept()
-                print(f"新客户端连接: {client_address}")
-                
-                # 为每个客户端创建单独的线程
-                client_thread = threading.Thread(
-                    target=self.handle_client, 
-                    args=(client_socket, client_address)
-                )
-                client_thread.daemon = True
-                client_thread.start()
-                
-                self.clients.append((client_socket, client_address))
-                
-            except Exception as e:
-                if self.running:
-                    print(f"接受客户端连接错误: {e}")
-    
-    def handle_client(self, client_socket, client_address):
-        while self.running:
-            try:
-                message = client_socket.recv(1024).decode('utf-8')
-                if not message:
-                    break
-                    
-                # 解析消息
-                try:
-                    message_data = json.loads(message)
-                    username = message_data.get('username', '未知用户')
-                    content = message_data.get('content', '')
-                    
-                    # 创建格式化消息
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    formatted_message = f"{client_address[0]} | {timestamp} | {username}: {content}"
-                    
-                    print(f"收到消息: {formatted_message}")
-                    
-                    # 广播给所有客户端
-                    self.broadcast_message({
-                        'type': 'message',
-                        'content': formatted_message,
-                        'timestamp': timestamp,
-                        'ip': client_address[0],
-                        'username': username
-                    })
-                    
-                except json.JSONDecodeError:
-                    print(f"消息格式错误: {message}")
-                    
-            except Exception as e:
-                print(f"处理客户端消息错误: {e}")
-                break
-        
-        # 客户端断开连接
-        self.remove_client(client_socket, client_address)
-        client_socket.close()
-    
-    def broadcast_message(self, message_data):
-        message_json = json.dumps(message_data)
-        disconnected_clients = []
-        
-        for client_socket, client_address in self.clients:
-            try:
-                client_socket.send(message_json.encode('utf-8'))
-            except Exception as e:
-                print(f"发送消息到 {client_address} 失败: {e}")
-                disconnected_clients.append((client_socket, client_address))
-        
-        # 移除断开的客户端
-        for client in disconnected_clients:
-            self.remove_client(*client)
-    
-    def remove_client(self, client_socket, client_address):
-        if (client_socket, client_address) in self.clients:
-            self.clients.remove((client_socket, client_address))
-            print(f"客户端断开连接: {client_address}")
-            
-            # 广播用户离开消息
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            leave_message = f"{client_address[0]} | {timestamp} | 用户离开聊天室"
-            self.broadcast_message({
-                'type': 'system',
-                'content': leave_message,
-                'timestamp': timestamp
-            })
-    
-    def stop_server(self):
-        self.running = False
-        if self.server_socket:
-            self.server_socket.close()
-        for client_socket, _ in self.clients:
-            client_socket.close()
-        self.clients.clear()
-        print("服务器已停止")
-
-class ChatClient:
-    def __init__(self, host='localhost', port=8080, username='用户'):
-        self.host = host
-        self.port = port
-        self.username = username
-        self.client_socket = None
-        self.connected = False
-        self.message_queue = queue.Queue()  # 添加消息队列
-        self.last_message_id = 0
-        
-    def connect(self):
-        try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
-            self.connected = True
-            
-            # 启动接收消息的线程
-            receive_thread = threading.Thread(target=self.receive_messages)
-            receive_thread.daemon = True
-            receive_thread.start()
-            
-            return True
-        except Exception as e:
-            print(f"连接服务器失败: {e}")
-            return False
-    
-    def send_message(self, content):
-        if self.connected:
-            try:
-                message_data = {
-                    'username': self.username,
-                    'content': content
-                }
-                self.client_socket.send(json.dumps(message_data).encode('utf-8'))
-                return True
-            except Exception as e:
-                print(f"发送消息失败: {e}")
-                self.connected = False
-                return False
-        return False
-    
-    def receive_messages(self):
-        while self.connected:
-            try:
-                message = self.client_socket.recv(1024).decode('utf-8')
-                if not message:
-                    break
-                    
-                try:
-                    message_data = json.loads(message)
-                    # 将消息添加到队列
-                    self.last_message_id += 1
-                    message_data['id'] = self.last_message_id
-                    self.message_queue.put(message_data)
-                except json.JSONDecodeError:
-                    print(f"接收到的消息格式错误: {message}")
-                        
-            except Exception as e:
-                if self.connected:
-                    print(f"接收消息错误: {e}")
-                break
-        
-        self.connected = False
-        # 添加断开连接消息
-        self.message_queue.put({
-            'type': 'error',
-            'content': '与服务器断开连接',
-            'id': self.last_message_id + 1
-        })
-    
-    def get_new_messages(self, last_id=0):
-        """获取自last_id之后的新消息"""
-        messages = []
-        while not self.message_queue.empty():
-            try:
-                message = self.message_queue.get_nowait()
-                if message['id'] > last_id:
-                    messages.append(message)
-            except queue.Empty:
-                break
-        return messages
-    
-    def disconnect(self):
-        self.connected = False
-        if self.client_socket:
-            self.client_socket.close()
+# 推送（/events）空闲时发送注释行的间隔（秒），用来及时发现页面已关闭；断线后浏览器等待多久重连（毫秒）
+EVENTS_KEEPALIVE = 15.0
+EVENTS_RETRY_MS = 1000
+# 长轮询最多等待的时间（秒）
+MAX_POLL_WAIT = 30.0
+# 批量发送（/send_messages）一次最多的消息数
+MAX_BATCH_MESSAGES = 100
+# 保存会话令牌的cookie，每个浏览器（包括桌面窗口）各自一个会话
+SESSION_COOKIE = 'chat_session'
 
 # Flask应用
 app = Flask(__name__)
 chat_server = None
-chat_client = None
+# 每个页面会话一个ChatClient，所有连接由一个接收线程处理（见client_pool.py）
+client_pool = SessionPool()
+federation = None
+file_server = None
+ws_gateway = None
+# 下载的文件保存的目录
+DOWNLOAD_DIR = os.path.join(os.path.expanduser('~'), 'Downloads')
+# 文件服务器保存上传文件的目录
+FILE_DIR = os.path.join(tempfile.gettempdir(), 'chat-files')
+
+# 可选的服务器引擎
+SERVER_ENGINES = {
+    'threaded': ChatServer,
+    'asyncio': AsyncChatServer,
+    'multiprocess': MultiProcessChatServer,
+}
+
+def current_client():
+    """当前页面会话的客户端，没有时返回None"""
+    return client_pool.get(request.cookies.get(SESSION_COOKIE))
 
 @app.route('/')
 def index():
@@ -230,71 +63,355 @@ def index():
 
 @app.route('/start_server', methods=['POST'])
 def start_server():
-    global chat_server
+    global chat_server, federation, file_server, ws_gateway
     data = request.json
     port = int(data.get('port', 8080))
+    engine = data.get('engine', 'threaded')
     
     if chat_server and chat_server.running:
         return jsonify({'success': False, 'message': '服务器已在运行'})
     
-    chat_server = ChatServer(port=port)
-    if chat_server.start_server():
-        return jsonify({'success': True, 'message': f'服务器启动成功，端口: {port}'})
-    else:
+    if engine not in SERVER_ENGINES:
+        return jsonify({'success': False, 'message': f'未知的服务器引擎: {engine}'})
+    
+    # 慢消费者策略和发送队列上限，未指定时使用默认值
+    options = {}
+    if 'slow_policy' in data:
+        options['slow_policy'] = data['slow_policy']
+    if 'queue_frames' in data:
+        options['queue_frames'] = int(data['queue_frames'])
+    if 'queue_bytes' in data:
+        options['queue_bytes'] = int(data['queue_bytes'])
+    if 'max_lag' in data:
+        options['max_lag'] = float(data['max_lag'])
+    if 'flush_interval' in data:
+        options['flush_interval'] = float(data['flush_interval'])
+    if 'history_size' in data:
+        options['history_size'] = int(data['history_size'])
+    if 'search_documents' in data:
+        # 搜索索引保留的最近消息数
+        options['search_documents'] = int(data['search_documents'])
+    if 'heartbeat_interval' in data:
+        # 心跳间隔（秒），0为关闭；3个间隔内没有收到任何数据的连接会被断开
+        options['heartbeat_interval'] = float(data['heartbeat_interval'])
+    # 发送限速：默认使用DEFAULT_RATE_LIMIT，rate_limit为对象时覆盖其中的项，为false时不限速
+    rate_limit = data.get('rate_limit', {})
+    if rate_limit is not False:
+        options['rate_limit'] = dict(DEFAULT_RATE_LIMIT, **(rate_limit or {}))
+    if data.get('capture_path'):
+        # 从启动起录制收到的流量，供benchmarks/replay.py重放；只接受文件名，保存在录制目录中
+        try:
+            options['capture_path'] = capture_file_path(data['capture_path'])
+        except (ValueError, OSError) as e:
+            return jsonify({'success': False, 'message': str(e)})
+    if data.get('history_dir'):
+        # 历史消息持久化目录，重启后仍可补发；只接受目录名，放在日志根目录中
+        try:
+            options['history_dir'] = history_dir_path(data['history_dir'])
+        except (ValueError, OSError) as e:
+            return jsonify({'success': False, 'message': str(e)})
+        if 'history_segments' in data:
+            options['history_segments'] = int(data['history_segments'])
+    if engine == 'multiprocess':
+        # worker进程数，默认等于CPU核数
+        if 'workers' in data:
+            options['workers'] = int(data['workers'])
+        if 'worker_engine' in data:
+            options['worker_engine'] = data['worker_engine']
+    
+    # 服务器互联：federation_port为本机监听的对等端口，peers为要连接的对等服务器 ["host:port", ...]
+    federation_port = data.get('federation_port')
+    peers = data.get('peers') or []
+    if isinstance(peers, str):
+        peers = [peer for peer in peers.split(',') if peer.strip()]
+    use_federation = federation_port is not None or peers
+    if use_federation and engine == 'multiprocess':
+        return jsonify({'success': False, 'message': '多进程模式暂不支持服务器互联'})
+    # 文件传输：默认监听聊天端口+1，file_port为false时不启用；上传的文件保存在固定的FILE_DIR中，
+    # 不接受请求指定目录（超出总大小时会删除该目录中的文件）；
+    # max_total_size为该目录的总大小上限，超出时淘汰最久未使用的文件
+    file_port = data.get('file_port', port + 1)
+    # WebSocket网关：默认监听聊天端口+2，浏览器打开 http://本机地址:端口/ 即可直接聊天，ws_port为false时不启用
+    ws_port = data.get('ws_port', port + 2)
+    
+    chat_server = federation = None
+    try:
+        chat_server = SERVER_ENGINES[engine](port=port, **options)
+        if use_federation:
+            federation = Federation(chat_server, port=None if federation_port is None else int(federation_port),
+                                    peers=peers)
+    except ValueError as e:
+        if chat_server is not None:
+            # 关闭已打开的历史日志、索引线程和录制文件
+            chat_server.stop_server()
+            chat_server = None
+        return jsonify({'success': False, 'message': str(e)})
+    if not chat_server.start_server():
         return jsonify({'success': False, 'message': '服务器启动失败'})
+    if federation and not federation.start():
+        chat_server.stop_server()
+        chat_server = federation = None
+        return jsonify({'success': False, 'message': '服务器互联启动失败'})
+    message = f'服务器启动成功，端口: {port}，引擎: {engine}'
+    if file_port is not False:
+        try:
+            file_server = FileServer(chat_server, port=int(file_port), directory=FILE_DIR,
+                                     max_file_size=int(data.get('max_file_size', DEFAULT_MAX_FILE_SIZE)),
+                                     max_total_size=int(data.get('max_total_size', DEFAULT_MAX_TOTAL_SIZE)))
+        except ValueError as e:
+            file_server = None
+            message += f'，文件传输参数错误: {e}'
+        if file_server and file_server.start():
+            message += f'，文件端口: {file_server.port}'
+        elif file_server:
+            # 文件端口被占用时聊天仍然可用
+            file_server = None
+            message += '，文件传输启动失败'
+    if ws_port is not False:
+        ws_gateway = WebSocketGateway('127.0.0.1', port, port=int(ws_port))
+        if ws_gateway.start():
+            message += f'，网页聊天端口: {ws_gateway.port}'
+        else:
+            ws_gateway = None
+            message += '，WebSocket网关启动失败'
+    return jsonify({'success': True, 'message': message})
 
 @app.route('/stop_server', methods=['POST'])
 def stop_server():
-    global chat_server
+    global chat_server, federation, file_server, ws_gateway
+    if ws_gateway:
+        ws_gateway.stop()
+        ws_gateway = None
+    if federation:
+        federation.stop()
+        federation = None
+    if file_server:
+        file_server.stop()
+        file_server = None
     if chat_server:
         chat_server.stop_server()
         chat_server = None
         return jsonify({'success': True, 'message': '服务器已停止'})
     return jsonify({'success': False, 'message': '服务器未运行'})
 
+@app.route('/server_status', methods=['GET'])
+def server_status():
+    """服务器状态，包括每个客户端的发送队列深度"""
+    if chat_server and chat_server.running:
+        return jsonify({
+            'success': True,
+            'engine': chat_server.engine,
+            'slow_policy': chat_server.slow_policy,
+            'rooms': chat_server.get_room_sizes(),
+            'clients': chat_server.get_client_stats(),
+            'federation': federation.stats() if federation else None,
+            'files': file_server.stats() if file_server else None,
+            'websocket': ws_gateway.stats() if ws_gateway else None
+        })
+    return jsonify({'success': False, 'message': '服务器未运行'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus文本格式的性能指标：本机运行的服务器和客户端的各阶段耗时直方图、吞吐量计数和队列深度"""
+    snapshots = []
+    if chat_server and chat_server.running:
+        snapshots.append(chat_server.metrics_snapshot())
+    snapshots.extend(client.metrics.snapshot() for client in client_pool.clients())
+    return Response(render_metrics(merge_metrics(snapshots)), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/profile', methods=['GET'])
+def profile():
+    """
+    按需采样分析：采样seconds秒（默认10）内所有线程的调用栈后返回，不采样时没有开销。
+    format=collapsed（默认）返回折叠栈文本，可直接生成火焰图；format=json返回各线程的采样数、CPU时间和热点函数。
+    interval为采样间隔（秒），lines=1时按行区分，threads只采样指定的线程（逗号分隔，如handle_client,accept_clients）
+    """
+    args = request.args
+    threads = {name.strip() for name in args.get('threads', '').split(',') if name.strip()} or None
+    try:
+        seconds = float(args.get('seconds', 10))
+        interval = float(args.get('interval', PROFILE_INTERVAL))
+        lines = args.get('lines') in ('1', 'true')
+        if chat_server and chat_server.running:
+            result = chat_server.profile(seconds, interval, lines, threads)
+        else:
+            # 没有运行服务器时采样本进程（客户端和界面）
+            result = sample_stacks(seconds, interval, lines, threads)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'参数错误: {e}'})
+    except ProfilerBusy as e:
+        return jsonify({'success': False, 'message': str(e)})
+    if args.get('format') == 'json':
+        return jsonify({'success': True, 'profile': result.summary()})
+    return Response(result.collapsed(), mimetype='text/plain; charset=utf-8')
+
+@app.route('/capture', methods=['GET', 'POST'])
+def capture():
+    """
+    流量录制：POST {"action": "start", "path": 文件名, "max_bytes": 大小上限} 开始录制之后建立的连接，
+    {"action": "stop"} 结束；GET查看状态
+    path只能是文件名，录制文件保存在录制目录（capture.DEFAULT_CAPTURE_DIR）中，达到max_bytes（默认1GB）时自动结束
+    """
+    if not (chat_server and chat_server.running):
+        return jsonify({'success': False, 'message': '服务器未运行'})
+    if request.method == 'POST':
+        data = request.json or {}
+        if data.get('action') == 'stop':
+            return jsonify({'success': True, 'capture': chat_server.stop_capture()})
+        try:
+            path = capture_file_path(data.get('path') or time.strftime('capture-%Y%m%d-%H%M%S.chatcap'))
+            chat_server.start_capture(path, int(data.get('max_bytes', DEFAULT_MAX_CAPTURE_BYTES)))
+        except (ValueError, OSError) as e:
+            return jsonify({'success': False, 'message': str(e)})
+        return jsonify({'success': True, 'path': path})
+    return jsonify({'success': True, 'capture': chat_server.capture_stats()})
+
+@app.route('/rate_limit', methods=['GET', 'POST'])
+def rate_limit():
+    """查看限速计数，或在运行时修改限额：POST {rate, burst, ip_rate, ip_burst, policy}，只修改给出的项"""
+    if not (chat_server and chat_server.running):
+        return jsonify({'success': False, 'message': '服务器未运行'})
+    if request.method == 'POST':
+        try:
+            limits = chat_server.configure_rate_limit(**(request.json or {}))
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'message': f'参数错误: {e}'})
+        return jsonify({'success': True, 'limits': limits})
+    return jsonify({'success': True, 'stats': chat_server.get_rate_limit_stats()})
+
+@app.route('/search', methods=['GET'])
+def search():
+    """搜索聊天记录：q为关键词，可按username、ip、room、since、until过滤，page/page_size分页"""
+    if not (chat_server and chat_server.running and chat_server.search_index):
+        return jsonify({'success': False, 'message': '服务器未运行或未启用搜索'})
+    args = request.args
+    try:
+        result = chat_server.search_index.search(
+            args.get('q', ''),
+            username=args.get('username') or None,
+            ip=args.get('ip') or None,
+            room=args.get('room') or None,
+            since=args.get('since') or None,
+            until=args.get('until') or None,
+            page=args.get('page', 1),
+            page_size=args.get('page_size', 20)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'参数错误: {e}'})
+    result['success'] = True
+    return jsonify(result)
+
 @app.route('/connect_client', methods=['POST'])
 def connect_client():
-    global chat_client
+    token = request.cookies.get(SESSION_COOKIE) or new_token()
+    chat_client = client_pool.get(token)
     data = request.json
     host = data.get('host', 'localhost')
     port = int(data.get('port', 8080))
     username = data.get('username', '用户')
+    # 与服务器之间的编码，服务器不支持二进制时自动回退为JSON
+    codec = data.get('codec', CODEC_BINARY)
+    compress = bool(data.get('compress', True))
     
     if chat_client and chat_client.connected:
         return jsonify({'success': False, 'message': '客户端已连接'})
+    if codec not in CODECS:
+        return jsonify({'success': False, 'message': f'未知的编码: {codec}'})
     
-    chat_client = ChatClient(host=host, port=port, username=username)
-    if chat_client.connect():
-        return jsonify({'success': True, 'message': f'连接服务器成功: {host}:{port}'})
+    previous = chat_client
+    chat_client = ChatClient(host=host, port=port, username=username, codec=codec, compress=compress,
+                             **client_pool.client_limits)
+    if previous and (previous.host, previous.port) == (host, port):
+        # 重新连接同一服务器时只补发断开期间的消息
+        chat_client.resume_from(previous)
+    try:
+        connected = client_pool.connect(token, chat_client)
+    except SessionLimitReached as e:
+        return jsonify({'success': False, 'message': str(e)})
+    if connected:
+        response = jsonify({'success': True, 'message': f'连接服务器成功: {host}:{port}'})
+        response.set_cookie(SESSION_COOKIE, token, httponly=True, samesite='Lax')
+        return response
     else:
         return jsonify({'success': False, 'message': '连接服务器失败'})
 
 @app.route('/send_message', methods=['POST'])
 def send_message():
-    global chat_client
+    chat_client = current_client()
     data = request.json
     content = data.get('content', '')
+    room = data.get('room')
     
     if chat_client and chat_client.connected:
-        if chat_client.send_message(content):
+        if chat_client.send_message(content, room):
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'message': '发送消息失败'})
     return jsonify({'success': False, 'message': '客户端未连接'})
 
+@app.route('/send_messages', methods=['POST'])
+def send_messages():
+    """
+    批量发送：messages为 [{"content", "room"}, ...]（也可以是字符串数组），编码后一次写出，
+    results中按顺序给出每条消息是否成功，全部成功时success为true
+    """
+    chat_client = current_client()
+    data = request.json or {}
+    messages = data.get('messages')
+    
+    if not isinstance(messages, list) or not messages:
+        return jsonify({'success': False, 'message': '请提供messages数组'})
+    if len(messages) > MAX_BATCH_MESSAGES:
+        return jsonify({'success': False, 'message': f'一次最多发送 {MAX_BATCH_MESSAGES} 条消息'})
+    if chat_client and chat_client.connected:
+        results = chat_client.send_messages([item if isinstance(item, dict) else {'content': item}
+                                             for item in messages], data.get('room'))
+        sent = sum(1 for result in results if result['success'])
+        return jsonify({'success': sent == len(results), 'sent': sent, 'results': results})
+    return jsonify({'success': False, 'message': '客户端未连接'})
+
+@app.route('/join_room', methods=['POST'])
+def join_room():
+    chat_client = current_client()
+    data = request.json
+    room = data.get('room', '').strip()
+    
+    if not room:
+        return jsonify({'success': False, 'message': '请输入房间名'})
+    if chat_client and chat_client.connected:
+        if chat_client.join_room(room):
+            return jsonify({'success': True, 'message': f'已加入房间: {room}', 'room': room})
+        else:
+            return jsonify({'success': False, 'message': '加入房间失败'})
+    return jsonify({'success': False, 'message': '客户端未连接'})
+
+@app.route('/leave_room', methods=['POST'])
+def leave_room():
+    chat_client = current_client()
+    data = request.json
+    room = data.get('room', '').strip()
+    
+    if chat_client and chat_client.connected:
+        if chat_client.leave_room(room):
+            return jsonify({'success': True, 'message': f'已离开房间: {room}', 'room': chat_client.room})
+        else:
+            return jsonify({'success': False, 'message': '离开房间失败'})
+    return jsonify({'success': False, 'message': '客户端未连接'})
+
 @app.route('/get_messages', methods=['POST'])
 def get_messages():
-    """获取新消息的API接口"""
-    global chat_client
+    """获取新消息的API接口；wait大于0时为长轮询，没有新消息时最多等待wait秒，期间到达的消息一起返回"""
+    chat_client = current_client()
     data = request.json
     last_id = data.get('last_id', 0)
+    wait = min(max(float(data.get('wait', 0)), 0.0), MAX_POLL_WAIT)
     
     if chat_client and chat_client.connected:
-        messages = chat_client.get_new_messages(last_id)
+        messages = chat_client.get_new_messages(last_id, wait)
         return jsonify({
             'success': True,
             'messages': messages,
-            'last_id': chat_client.last_message_id if messages else last_id
+            'last_id': messages[-1]['id'] if messages else last_id
         })
     else:
         return jsonify({
@@ -303,12 +420,114 @@ def get_messages():
             'last_id': last_id
         })
 
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    推送新消息（Server-Sent Events）：客户端的接收线程收到消息后立即唤醒，同一时刻到达的消息合并为一个事件，
+    空闲时只有定期的注释行，没有请求。断线重连时浏览器带上Last-Event-ID，从该处继续补发。
+    客户端断开后发送end事件并结束；没有连接的客户端时返回204，浏览器不再重连
+    """
+    token = request.cookies.get(SESSION_COOKIE)
+    client = client_pool.get(token)
+    if not (client and client.connected):
+        return Response(status=204)
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id') or 0
+    try:
+        last_id = int(last_id)
+    except ValueError:
+        last_id = 0
+    
+    def stream(last_id):
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+        while True:
+            # 客户端断开后不再等待，送完剩下的消息（包括断开提示）就结束；打开的推送也会刷新会话的活跃时间
+            active = client_pool.get(token) is client and client.connected
+            messages = client.get_new_messages(last_id, EVENTS_KEEPALIVE if active else 0)
+            if messages:
+                last_id = messages[-1]['id']
+                yield f"id: {last_id}\nevent: messages\ndata: {json.dumps(messages)}\n\n"
+            elif not active:
+                yield "event: end\ndata: {}\n\n"
+                return
+            else:
+                yield ": keepalive\n\n"
+    
+    # 禁止代理缓冲，每个事件立即送到页面
+    return Response(stream(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/client_status', methods=['GET'])
+def client_status():
+    """客户端与服务器之间协商的编码和压缩统计，以及本进程的会话池统计"""
+    chat_client = current_client()
+    if chat_client:
+        return jsonify(dict(chat_client.stats(), success=True, sessions=client_pool.stats()))
+    return jsonify({'success': False, 'message': '客户端未连接'})
+
+@app.route('/send_file', methods=['POST'])
+def send_file():
+    """上传界面选择的文件（multipart的file字段），在后台经文件连接发给服务器，完成后房间里会出现文件消息"""
+    chat_client = current_client()
+    upload = request.files.get('file')
+    room = request.form.get('room')
+    if not (chat_client and chat_client.connected):
+        return jsonify({'success': False, 'message': '客户端未连接'})
+    if not chat_client.file_port:
+        return jsonify({'success': False, 'message': '服务器未启用文件传输'})
+    if upload is None:
+        return jsonify({'success': False, 'message': '请选择文件'})
+    # 先落到临时目录，保留原文件名作为上传的名称
+    spool = tempfile.mkdtemp(prefix='chat-upload-')
+    path = os.path.join(spool, clean_name(upload.filename))
+    upload.save(path)
+    client = chat_client
+    
+    def run():
+        try:
+            client.send_file(path, room)
+        except (OSError, ValueError) as e:
+            client.queue_message({'type': 'error', 'content': f'文件上传失败: {e}',
+                                  'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")})
+        finally:
+            shutil.rmtree(spool, ignore_errors=True)
+    
+    threading.Thread(target=run, daemon=True).start()
+    return jsonify({'success': True, 'message': f'正在上传: {os.path.basename(path)}'})
+
+@app.route('/download_file', methods=['POST'])
+def download_file_route():
+    """在后台下载文件消息中的文件到下载目录，完成或失败时在消息列表中提示"""
+    chat_client = current_client()
+    data = request.json or {}
+    file_id = data.get('file_id', '')
+    if not (chat_client and chat_client.connected):
+        return jsonify({'success': False, 'message': '客户端未连接'})
+    # 网页接口没有认证，只能保存到固定的下载目录，文件名也只取名称本身
+    directory = DOWNLOAD_DIR
+    name = clean_name(data.get('name') or file_id)
+    path = os.path.join(directory, name)
+    base, ext = os.path.splitext(path)
+    count = 1
+    while os.path.exists(path):
+        path = f"{base} ({count}){ext}"
+        count += 1
+    client = chat_client
+    
+    def run():
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            client.download_file(file_id, path)
+            client.queue_message({'type': 'system', 'content': f'文件已保存到 {path}', 'timestamp': timestamp})
+        except (OSError, ValueError) as e:
+            client.queue_message({'type': 'error', 'content': f'文件下载失败: {e}', 'timestamp': timestamp})
+    
+    threading.Thread(target=run, daemon=True).start()
+    return jsonify({'success': True, 'message': f'正在下载: {name}'})
+
 @app.route('/disconnect_client', methods=['POST'])
 def disconnect_client():
-    global chat_client
-    if chat_client:
-        chat_client.disconnect()
-        chat_client = None
+    if client_pool.remove(request.cookies.get(SESSION_COOKIE)):
         return jsonify({'success': True, 'message': '客户端已断开连接'})
     return jsonify({'success': False, 'message': '客户端未连接'})
 
@@ -602,6 +821,14 @@ def create_template():
                         <label for="serverPort">服务器端口:</label>
                         <input type="number" id="serverPort" value="8080" min="1024" max="65535">
                     </div>
+                    <div class="input-group">
+                        <label for="serverEngine">服务器引擎:</label>
+                        <select id="serverEngine">
+                            <option value="threaded">多线程（默认）</option>
+                            <option value="asyncio">asyncio（适合大量连接）</option>
+                            <option value="multiprocess">多进程（使用多个CPU核）</option>
+                        </select>
+                    </div>
                     <button class="btn btn-primary" onclick="startServer()">启动服务器</button>
                     <button class="btn btn-danger" onclick="stopServer()" disabled>停止服务器</button>
                 </div>
@@ -624,6 +851,15 @@ def create_template():
                     <button class="btn btn-danger" onclick="disconnectClient()" disabled>断开连接</button>
                 </div>
                 
+                <div class="section">
+                    <div class="section-title">房间</div>
+                    <div class="input-group">
+                        <label for="roomName">当前房间:</label>
+                        <input type="text" id="roomName" value="大厅" maxlength="32" placeholder="例如: 研发部">
+                    </div>
+                    <button class="btn btn-primary" id="switchRoomButton" onclick="switchRoom()" disabled>切换房间</button>
+                </div>
+                
                 <div id="status" class="status status-info">
                     请启动服务器或连接现有服务器
                 </div>
@@ -640,6 +876,8 @@ def create_template():
                     <div class="message-input">
                         <input type="text" id="messageInput" placeholder="输入消息..." disabled onkeypress="handleKeyPress(event)">
                         <button onclick="sendMessage()" disabled>发送</button>
+                        <input type="file" id="fileInput" style="display: none" onchange="sendFile()">
+                        <button id="fileButton" onclick="document.getElementById('fileInput').click()" disabled>文件</button>
                     </div>
                 </div>
             </div>
@@ -651,9 +889,12 @@ def create_template():
         let clientConnected = false;
         let lastMessageId = 0;
         let messagePollInterval = null;
+        let messageStream = null;
+        let currentRoom = '大厅';
         
         function updateUI() {
             document.getElementById('serverPort').disabled = serverRunning;
+            document.getElementById('serverEngine').disabled = serverRunning;
             document.querySelector('.btn-primary').disabled = serverRunning;
             document.querySelector('.btn-danger').disabled = !serverRunning;
             
@@ -665,6 +906,8 @@ def create_template():
             
             document.getElementById('messageInput').disabled = !clientConnected;
             document.querySelector('.message-input button').disabled = !clientConnected;
+            document.getElementById('switchRoomButton').disabled = !clientConnected;
+            document.getElementById('fileButton').disabled = !clientConnected;
         }
         
         function showStatus(message, type = 'info') {
@@ -685,16 +928,25 @@ def create_template():
             const messageDiv = document.createElement('div');
             
             let messageClass = 'message';
-            if (data.type === 'system') messageClass += ' system';
+            // gap：页面太久没有读取，部分消息已超出客户端的保留范围
+            if (data.type === 'system' || data.type === 'gap') messageClass += ' system';
             if (data.type === 'error') messageClass += ' error';
             
             messageDiv.className = messageClass;
             messageDiv.innerHTML = `
                 <div class="message-header">
-                    ${data.ip || '系统'} | ${data.timestamp || new Date().toLocaleString()}
+                    ${data.room ? '[' + data.room + '] ' : ''}${data.ip || '系统'} | ${data.timestamp || new Date().toLocaleString()}
                 </div>
                 <div class="message-content">${data.content}</div>
             `;
+            if (data.type === 'file') {
+                // 文件消息：点击后在后台下载到下载目录
+                const button = document.createElement('button');
+                button.className = 'btn btn-primary';
+                button.textContent = '下载';
+                button.addEventListener('click', () => downloadFile(data.file_id, data.name));
+                messageDiv.appendChild(button);
+            }
             
             messages.appendChild(messageDiv);
             messages.scrollTop = messages.scrollHeight;
@@ -718,16 +970,52 @@ def create_template():
                 const result = await response.json();
                 
                 if (result.success && result.messages.length > 0) {
-                    result.messages.forEach(message => {
-                        addMessage(message);
-                        lastMessageId = Math.max(lastMessageId, message.id);
-                    });
+                    receiveMessages(result.messages);
                 }
             } catch (error) {
                 console.error('获取消息失败:', error);
             }
         }
         
+        function receiveMessages(messages) {
+            messages.forEach(message => {
+                // 推送断线重连时可能重复收到，按id去重
+                if (message.id > lastMessageId) {
+                    addMessage(message);
+                    lastMessageId = message.id;
+                }
+            });
+        }
+        
+        function startMessageStream() {
+            // 优先使用推送：消息到达后立即送到页面，空闲时没有请求；不支持时退回到轮询
+            stopMessageStream();
+            if (!window.EventSource) {
+                startMessagePolling();
+                return;
+            }
+            messageStream = new EventSource('/events?last_id=' + lastMessageId);
+            messageStream.addEventListener('messages', event => receiveMessages(JSON.parse(event.data)));
+            messageStream.addEventListener('end', () => stopMessageStream());
+            messageStream.onerror = () => {
+                // 网络中断时浏览器会自动重连；连接被关闭后才改用轮询
+                if (messageStream && messageStream.readyState === EventSource.CLOSED) {
+                    messageStream = null;
+                    if (clientConnected) {
+                        startMessagePolling();
+                    }
+                }
+            };
+        }
+        
+        function stopMessageStream() {
+            if (messageStream) {
+                messageStream.close();
+                messageStream = null;
+            }
+            clearInterval(messagePollInterval);
+        }
+        
         function startMessagePolling() {
             if (messagePollInterval) {
                 clearInterval(messagePollInterval);
@@ -743,6 +1031,7 @@ def create_template():
         
         async function startServer() {
             const port = document.getElementById('serverPort').value;
+            const engine = document.getElementById('serverEngine').value;
             
             try {
                 const response = await fetch('/start_server', {
@@ -750,7 +1039,7 @@ def create_template():
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ port: parseInt(port) })
+                    body: JSON.stringify({ port: parseInt(port), engine: engine })
                 });
                 
                 const result = await response.json();
@@ -793,7 +1082,7 @@ def create_template():
                         content: '服务器已停止',
                         timestamp: new Date().toLocaleString()
                     });
-                    clearInterval(messagePollInterval);
+                    stopMessageStream();
                 } else {
                     showStatus(result.message, 'error');
                 }
@@ -831,6 +1120,9 @@ def create_template():
                 
                 if (result.success) {
                     clientConnected = true;
+                    // 服务器会自动把新连接加入默认房间
+                    currentRoom = '大厅';
+                    document.getElementById('roomName').value = currentRoom;
                     showStatus(result.message, 'success');
                     addMessage({
                         type: 'system',
@@ -838,8 +1130,8 @@ def create_template():
                         timestamp: new Date().toLocaleString()
                     });
                     
-                    // 开始轮询消息
-                    startMessagePolling();
+                    // 开始接收消息
+                    startMessageStream();
                 } else {
                     showStatus(result.message, 'error');
                 }
@@ -869,7 +1161,7 @@ def create_template():
                         content: '已断开服务器连接',
                         timestamp: new Date().toLocaleString()
                     });
-                    clearInterval(messagePollInterval);
+                    stopMessageStream();
                 } else {
                     showStatus(result.message, 'error');
                 }
@@ -880,31 +1172,128 @@ def create_template():
             }
         }
         
-        async function sendMessage() {
+        async function switchRoom() {
+            const room = document.getElementById('roomName').value.trim();
+            
+            if (!room || room === currentRoom) return;
+            
+            try {
+                const response = await fetch('/join_room', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ room: room })
+                });
+                
+                const result = await response.json();
+                
+                if (result.success) {
+                    // 离开原来的房间，只接收新房间的消息
+                    await fetch('/leave_room', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                        },
+                        body: JSON.stringify({ room: currentRoom })
+                    });
+                    currentRoom = room;
+                    showStatus(result.message, 'success');
+                } else {
+                    showStatus(result.message, 'error');
+                }
+            } catch (error) {
+                showStatus('切换房间失败: ' + error.message, 'error');
+            }
+        }
+        
+        async function sendFile() {
+            const input = document.getElementById('fileInput');
+            if (!input.files.length) return;
+            
+            const form = new FormData();
+            form.append('file', input.files[0]);
+            form.append('room', currentRoom);
+            input.value = '';
+            try {
+                const response = await fetch('/send_file', { method: 'POST', body: form });
+                const result = await response.json();
+                showStatus(result.message, result.success ? 'info' : 'error');
+            } catch (error) {
+                showStatus('文件上传失败: ' + error.message, 'error');
+            }
+        }
+        
+        async function downloadFile(fileId, name) {
+            try {
+                const response = await fetch('/download_file', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ file_id: fileId, name: name })
+                });
+                const result = await response.json();
+                showStatus(result.message, result.success ? 'info' : 'error');
+            } catch (error) {
+                showStatus('文件下载失败: ' + error.message, 'error');
+            }
+        }
+        
+        // 待发送的消息：上一个请求还没返回时新输入的消息先排队，返回后合并成一个 /send_messages 请求发出
+        const SEND_BATCH_MAX = 100;
+        let outbox = [];
+        let sending = false;
+        
+        function sendMessage() {
             const input = document.getElementById('messageInput');
             const content = input.value.trim();
             
             if (!content) return;
             
+            outbox.push({ content: content, room: currentRoom });
+            input.value = '';
+            flushOutbox();
+        }
+        
+        async function flushOutbox() {
+            if (sending || outbox.length === 0) return;
+            sending = true;
+            const batch = outbox.splice(0, SEND_BATCH_MAX);
+            let failed = [];
             try {
-                const response = await fetch('/send_message', {
+                const response = await fetch('/send_messages', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ content: content })
+                    body: JSON.stringify({ messages: batch })
                 });
                 
                 const result = await response.json();
                 
-                if (result.success) {
-                    input.value = '';
-                } else {
+                if (result.results) {
+                    failed = batch.filter((message, index) => !result.results[index].success);
+                    if (failed.length) {
+                        const reason = result.results.find(item => !item.success).message;
+                        showStatus(`${failed.length} 条消息发送失败: ${reason}`, 'error');
+                    }
+                } else if (!result.success) {
+                    failed = batch;
                     showStatus(result.message, 'error');
                 }
             } catch (error) {
+                failed = batch;
                 showStatus('发送消息失败: ' + error.message, 'error');
+            } finally {
+                sending = false;
+            }
+            // 输入框为空时把第一条失败的消息放回去，方便重发
+            const input = document.getElementById('messageInput');
+            if (failed.length && !input.value) {
+                input.value = failed[0].content;
             }
+            flushOutbox();
         }
         
         updateUI();
@@ -948,4 +1337,6 @@ def main():
     webview.start()
 
 if __name__ == "__main__":
+    # 打包成可执行文件时，多进程模式的worker需要
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
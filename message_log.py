@@ -0,0 +1,332 @@
+"""
+磁盘消息日志
+
+可选的持久化后端，让历史消息在服务器重启后仍然可以补发。
+
+- 日志按段存放：每段一个数据文件 <起始序号>.log 和一个索引文件 <起始序号>.idx
+- 数据文件是追加写入的记录：8字节seq + 4字节CRC32 + 2字节房间名长度 + 房间名 + 完整的消息帧
+- 索引是定长数组，第i项(8字节)是该段第i条记录的结束偏移，按序号直接定位，通过mmap读取
+- 当前段的两个文件预先扩展到固定大小并以mmap写入；写满后截断到实际大小并换新段
+- 追加只写入内存映射，由后台线程每fsync_interval秒统一刷盘一次（组提交），
+  崩溃时最多丢失最后一个间隔内的消息；fsync_interval为0时每条都立即刷盘
+- 段数超过max_segments时删除最旧的段
+- 读取时直接从映射中切出帧的字节，不解析JSON
+- 目录中只识别数字命名的段文件，其他文件不受影响；通过网页接口启动时只能给出目录名，
+  日志一律放在日志根目录（默认为当前目录下的history）中
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import uuid
+import zlib
+from protocol import HEADER, HEADER_SIZE
+
+RECORD_HEADER = struct.Struct('!QIH')  # seq, 帧的CRC32, 房间名长度
+INDEX_ENTRY = struct.Struct('!Q')      # 记录的结束偏移
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_SEGMENT_ENTRIES = 1024 * 1024
+DEFAULT_MAX_SEGMENTS = 16
+DEFAULT_FSYNC_INTERVAL = 0.05
+DEFAULT_HISTORY_ROOT = 'history'
+
+
+def history_dir_path(name, root=DEFAULT_HISTORY_ROOT):
+    """把客户端给出的目录名解析为日志根目录中的路径，名称包含上级目录或不合法时抛出ValueError"""
+    if not isinstance(name, str) or not name or name in ('.', '..') or \
+            '/' in name or '\\' in name or '\0' in name or os.path.basename(name) != name:
+        raise ValueError(f"历史日志目录名无效（只能是名称，不能包含路径）: {name!r}")
+    root = os.path.abspath(root)
+    os.makedirs(root, exist_ok=True)
+    return os.path.join(root, name)
+
+
+class Segment:
+    """日志中的一段，base_seq是第一条记录的序号"""
+
+    def __init__(self, directory, base_seq):
+        self.base_seq = base_seq
+        self.data_path = os.path.join(directory, f"{base_seq:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_seq:020d}.idx")
+        self.count = 0
+        self.end = 0
+        self.writable = False
+        self.data = None
+        self.index = None
+        self.lock = threading.Lock()  # 刷盘与关闭映射互斥
+
+    @property
+    def last_seq(self):
+        return self.base_seq + self.count - 1
+
+    def open_active(self, data_size, entries):
+        """以读写方式打开（或创建）当前段，文件扩展到固定大小"""
+        self.data = self._map(self.data_path, data_size, True)
+        self.index = self._map(self.index_path, entries * INDEX_ENTRY.size, True)
+        self.writable = True
+
+    def open_sealed(self):
+        """以只读方式打开已写满的段，文件大小就是实际数据大小"""
+        self.data = self._map(self.data_path, None, False)
+        self.index = self._map(self.index_path, None, False)
+        self.count = len(self.index) // INDEX_ENTRY.size
+        self.end = self.end_offset(self.count - 1) if self.count else 0
+
+    def _map(self, path, size, writable):
+        with open(path, 'r+b' if writable else 'rb') if os.path.exists(path) else open(path, 'w+b') as f:
+            if size is not None and os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+    def recover(self):
+        """从索引恢复当前段的记录数，丢弃崩溃时只写了一半的记录"""
+        self.count = 0
+        self.end = 0
+        entries = len(self.index) // INDEX_ENTRY.size
+        while self.count < entries:
+            end = self.end_offset(self.count)
+            if not self.end < end <= len(self.data) or self._check(self.end, end) != self.base_seq + self.count:
+                break
+            self.count += 1
+            self.end = end
+
+    def _check(self, start, end):
+        """校验一条记录，有效时返回它的序号"""
+        if end - start < RECORD_HEADER.size + HEADER_SIZE:
+            return None
+        seq, crc, room_length = RECORD_HEADER.unpack_from(self.data, start)
+        frame_start = start + RECORD_HEADER.size + room_length
+        if frame_start + HEADER_SIZE > end:
+            return None
+        (frame_length,) = HEADER.unpack_from(self.data, frame_start)
+        if frame_start + HEADER_SIZE + frame_length != end or zlib.crc32(self.data[frame_start:end]) != crc:
+            return None
+        return seq
+
+    def end_offset(self, position):
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)[0]
+
+    def fits(self, size):
+        return self.count < len(self.index) // INDEX_ENTRY.size and self.end + size <= len(self.data)
+
+    def append(self, seq, room_bytes, frame):
+        start = self.end
+        header = RECORD_HEADER.pack(seq, zlib.crc32(frame), len(room_bytes))
+        end = start + len(header) + len(room_bytes) + len(frame)
+        self.data[start:start + len(header)] = header
+        self.data[start + len(header):end - len(frame)] = room_bytes
+        self.data[end - len(frame):end] = frame
+        INDEX_ENTRY.pack_into(self.index, self.count * INDEX_ENTRY.size, end)
+        self.count += 1
+        self.end = end
+
+    def read(self, seq):
+        """返回(房间, 帧)，房间为None表示发给所有人"""
+        position = seq - self.base_seq
+        start = self.end_offset(position - 1) if position else 0
+        _, _, room_length = RECORD_HEADER.unpack_from(self.data, start)
+        room_start = start + RECORD_HEADER.size
+        room = self.data[room_start:room_start + room_length].decode('utf-8') if room_length else None
+        return room, self.data[room_start + room_length:self.end_offset(position)]
+
+    def flush(self):
+        """先刷数据再刷索引，索引不会指向尚未落盘的数据"""
+        with self.lock:
+            if self.writable and self.data is not None:
+                self.data.flush()
+                self.index.flush()
+
+    def seal(self):
+        """写满后截断到实际大小，改为只读映射"""
+        self.flush()
+        self.close()
+        with open(self.data_path, 'r+b') as f:
+            f.truncate(self.end)
+        with open(self.index_path, 'r+b') as f:
+            f.truncate(self.count * INDEX_ENTRY.size)
+        self.writable = False
+        self.open_sealed()
+
+    def close(self):
+        with self.lock:
+            for mapping in (self.data, self.index):
+                if mapping is not None:
+                    mapping.close()
+            self.data = self.index = None
+
+    def remove(self):
+        self.close()
+        for path in (self.data_path, self.index_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class MessageLog:
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES, segment_entries=DEFAULT_SEGMENT_ENTRIES,
+                 max_segments=DEFAULT_MAX_SEGMENTS, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        if max_segments < 1:
+            raise ValueError(f"日志段数至少为1: {max_segments}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_entries = segment_entries
+        self.max_segments = max_segments
+        self.fsync_interval = fsync_interval
+        self.segments = []
+        self.epoch = None
+        self.lock = threading.Lock()
+        self._dirty = False
+        self._closed = threading.Event()
+        self.appended = 0
+        self.fsyncs = 0
+        self.open()
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # epoch保存在日志目录中，重启后客户端手里的序号仍然有效
+        epoch_path = os.path.join(self.directory, 'epoch')
+        if os.path.exists(epoch_path):
+            with open(epoch_path) as f:
+                self.epoch = f.read().strip()
+        if not self.epoch:
+            self.epoch = uuid.uuid4().hex[:12]
+            with open(epoch_path, 'w') as f:
+                f.write(self.epoch)
+
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                       if name.endswith('.log') and name[:-4].isascii() and name[:-4].isdigit())
+        for base in bases[:-1]:
+            segment = Segment(self.directory, base)
+            segment.open_sealed()
+            self.segments.append(segment)
+        active = Segment(self.directory, bases[-1] if bases else 1)
+        active.open_active(self.segment_bytes, self.segment_entries)
+        active.recover()
+        self.segments.append(active)
+
+        if self.fsync_interval > 0:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    @property
+    def first_seq(self):
+        """最早一条可读记录的序号，日志为空时等于last_seq + 1"""
+        return self.segments[0].base_seq if self.segments[0].count else self.last_seq + 1
+
+    @property
+    def last_seq(self):
+        active = self.segments[-1]
+        return active.last_seq
+
+    def append(self, seq, room, frame):
+        """追加一条记录，序号必须紧接在last_seq之后"""
+        room_bytes = room.encode('utf-8') if room else b''
+        size = RECORD_HEADER.size + len(room_bytes) + len(frame)
+        with self.lock:
+            if seq != self.last_seq + 1:
+                raise ValueError(f"日志序号不连续: {seq}，上一条为 {self.last_seq}")
+            active = self.segments[-1]
+            if not active.fits(size):
+                active = self._rotate(seq, size)
+            active.append(seq, room_bytes, frame)
+            self.appended += 1
+            self._dirty = True
+        if self.fsync_interval <= 0:
+            self.flush()
+
+    def _rotate(self, seq, size):
+        """封存当前段并新建一段，超出的旧段按保留策略删除"""
+        active = self.segments[-1]
+        if active.count:
+            active.seal()
+        else:
+            # 空段（例如单条记录超过段大小）直接替换
+            self.segments.pop().remove()
+        segment = Segment(self.directory, seq)
+        segment.open_active(max(self.segment_bytes, size), self.segment_entries)
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            self.segments.pop(0).remove()
+        return segment
+
+    def read(self, seq):
+        """按序号读取一条记录，返回(房间, 帧)；不存在时返回None"""
+        with self.lock:
+            segment = self._find(seq)
+            return segment.read(seq) if segment else None
+
+    def read_range(self, start, end):
+        """读取[start, end]范围内的记录，返回(seq, 房间, 帧)列表"""
+        with self.lock:
+            return list(self._iter_range(max(start, self.first_seq), min(end, self.last_seq)))
+
+    def scan_backward(self, start, stop, rooms, limit):
+        """
+        从start往前读取到stop（不含），只保留发给rooms或所有人的记录，最多limit条
+        返回(从新到旧的帧列表, 是否已经读到stop)
+        """
+        frames = []
+        with self.lock:
+            seq = min(start, self.last_seq)
+            first = self.first_seq
+            while seq > stop and seq >= first:
+                if len(frames) >= limit:
+                    return frames, False
+                room, frame = self._find(seq).read(seq)
+                if room is None or room in rooms:
+                    frames.append(frame)
+                seq -= 1
+            # 需要的记录已被保留策略删除时也算没有读完
+            return frames, seq <= stop
+
+    def _iter_range(self, start, end):
+        seq = start
+        while seq <= end:
+            segment = self._find(seq)
+            last = min(end, segment.last_seq)
+            while seq <= last:
+                room, frame = segment.read(seq)
+                yield seq, room, frame
+                seq += 1
+
+    def _find(self, seq):
+        index = bisect.bisect_right([segment.base_seq for segment in self.segments], seq) - 1
+        if index < 0:
+            return None
+        segment = self.segments[index]
+        return segment if seq <= segment.last_seq else None
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+
+    def flush(self):
+        """组提交：把上次刷盘以来的所有追加一次性写到磁盘"""
+        with self.lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            active = self.segments[-1]
+        # 刷盘期间不持有日志锁，不阻塞追加
+        active.flush()
+        self.fsyncs += 1
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'directory': self.directory,
+                'segments': len(self.segments),
+                'first_seq': self.first_seq,
+                'last_seq': self.last_seq,
+                'bytes': sum(segment.end for segment in self.segments),
+                'appended': self.appended,
+                'fsyncs': self.fsyncs,
+            }
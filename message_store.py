@@ -0,0 +1,126 @@
+"""
+客户端消息存储
+
+ChatClient收到的消息按到达顺序分配递增的id，保存在有上限的环形缓冲区中，界面按游标读取：
+每个读者记住自己读到的最后一个id，下次从它之后继续。读取不会取走消息，多个页面、推送断线重连、
+重试的轮询都能拿到完整的消息；没有读者时缓冲区也不会无限增长，超出条数或内存上限时淘汰最旧的消息。
+
+读者的游标落在已淘汰的范围内时（页面长时间没有读取），返回的第一条是 type 为 gap 的标记，
+其id为被淘汰的最后一个id，missed为错过的消息数，之后是缓冲区中所有的消息。
+"""
+import sys
+import threading
+import time
+from bisect import bisect_right
+
+DEFAULT_CAPACITY = 1000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# 每条消息除content外的大致内存占用（字典、用户名、IP、时间戳等）
+ENTRY_OVERHEAD = 600
+
+
+def message_size(message):
+    """估算一条消息占用的内存，粘贴的大段日志按实际大小计算"""
+    return sys.getsizeof(message.get('content') or '') + ENTRY_OVERHEAD
+
+
+class MessageStore:
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_bytes=DEFAULT_MAX_BYTES, wait_time=None):
+        if capacity < 1:
+            raise ValueError(f"消息容量必须大于0: {capacity}")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        # 可选的直方图，记录消息从存入到第一次被读取的时间
+        self.wait_time = wait_time
+        self.cond = threading.Condition()
+        # 三个列表一一对应，_start之前的部分已淘汰，积累到一半时再一次性删除，避免每次淘汰都移动整个列表
+        self._ids = []
+        self._messages = []
+        self._stored_at = []
+        self._start = 0
+        self.last_id = 0
+        self.read_id = 0    # 已被任意读者读到的最大id
+        self.bytes = 0
+        self.evicted = 0
+        self.gaps = 0
+
+    def __len__(self):
+        with self.cond:
+            return len(self._ids) - self._start
+
+    def pending(self):
+        """还没有被任何读者读到的消息数"""
+        with self.cond:
+            return self.last_id - self.read_id
+
+    def append(self, message):
+        """存入一条消息，分配并返回它的id，唤醒等待的读者"""
+        with self.cond:
+            self.last_id += 1
+            message['id'] = self.last_id
+            self._ids.append(self.last_id)
+            self._messages.append(message)
+            self._stored_at.append(time.perf_counter())
+            self.bytes += message_size(message)
+            self._evict()
+            self.cond.notify_all()
+            return self.last_id
+
+    def _evict(self):
+        # 最新的一条始终保留
+        while len(self._ids) - self._start > 1 and (len(self._ids) - self._start > self.capacity
+                                                     or self.bytes > self.max_bytes):
+            self.bytes -= message_size(self._messages[self._start])
+            self._messages[self._start] = None
+            self._start += 1
+            self.evicted += 1
+        if self._start > len(self._ids) // 2:
+            del self._ids[:self._start], self._messages[:self._start], self._stored_at[:self._start]
+            self._start = 0
+
+    def read(self, cursor=0, timeout=0):
+        """
+        返回id大于cursor的消息；timeout大于0时没有新消息则等待，直到有新消息或超时。
+        cursor早于缓冲区中最旧的消息时，开头附加一条gap标记（cursor为0表示从头读，不算缺口）
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                index = bisect_right(self._ids, cursor, self._start)
+                if index < len(self._ids):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.cond.wait(remaining)
+            messages = self._messages[index:]
+            if self.wait_time is not None and self._ids[-1] > self.read_id:
+                now = time.perf_counter()
+                for stored_at in self._stored_at[bisect_right(self._ids, self.read_id, index):]:
+                    self.wait_time.record(now - stored_at)
+            self.read_id = max(self.read_id, self._ids[-1])
+            first = self._ids[self._start]
+            if 0 < cursor < first - 1:
+                self.gaps += 1
+                messages.insert(0, {
+                    'type': 'gap',
+                    'id': first - 1,
+                    'missed': first - 1 - cursor,
+                    'content': f'有 {first - 1 - cursor} 条较早的消息已超出保留范围，未能显示',
+                    'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
+                })
+            return messages
+
+    def stats(self):
+        with self.cond:
+            return {
+                'size': len(self._ids) - self._start,
+                'capacity': self.capacity,
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'last_id': self.last_id,
+                'first_id': self._ids[self._start] if self._start < len(self._ids) else self.last_id + 1,
+                'pending': self.last_id - self.read_id,
+                'evicted': self.evicted,
+                'gaps': self.gaps,
+            }
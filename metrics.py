@@ -0,0 +1,233 @@
+"""
+低开销的性能指标
+
+Histogram 按HDR Histogram的思路用对数-线性分桶记录耗时：以微秒为单位，每个2的幂区间再均分为
+SUB_BUCKETS个子桶，相对误差不超过1/SUB_BUCKETS（约3%），记录一次只需一次bit_length和一次加法，
+内存固定（约1000个计数），不随样本数增长。
+
+Counter 为单调递增的计数，Gauge 在导出时调用回调取当前值（连接数、队列深度等）。
+
+MetricsRegistry.snapshot() 生成可JSON序列化的快照，多进程模式下各worker的快照经总线上报后
+用 merge() 合并，再由 render() 转换为Prometheus文本格式（见main.py的 /metrics）。
+"""
+import threading
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# 最大可记录约19小时（2**36微秒），更大的值计入最后一个桶
+MAX_MICROS = (1 << 36) - 1
+BUCKET_COUNT = (36 - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+# 导出为Prometheus直方图时使用的上界（秒）
+EXPORT_BOUNDS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 服务器和客户端各处理阶段的耗时，用stage标签区分
+SERVER_STAGE_SECONDS = 'chat_server_stage_seconds'
+SERVER_STAGE_HELP = '服务器各处理阶段的耗时：decode解码，broadcast放入所有接收者的发送队列，queue在发送队列中等待，write写socket'
+CLIENT_STAGE_SECONDS = 'chat_client_stage_seconds'
+CLIENT_STAGE_HELP = '客户端各处理阶段的耗时：receive从socket读出到放入消息队列，queue在消息队列中等待界面取走'
+
+
+def bucket_index(micros):
+    if micros < 2 * SUB_BUCKETS:
+        return micros
+    if micros > MAX_MICROS:
+        micros = MAX_MICROS
+    shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+    return (shift << SUB_BUCKET_BITS) + (micros >> shift)
+
+
+def bucket_bounds(index):
+    """桶覆盖的微秒范围 [下界, 上界)"""
+    if index < 2 * SUB_BUCKETS:
+        return index, index + 1
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    sub = index - (shift << SUB_BUCKET_BITS)
+    return sub << shift, (sub + 1) << shift
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, read):
+        self.read = read
+
+    def snapshot(self):
+        try:
+            return {'value': self.read()}
+        except Exception:
+            # 回调依赖的对象可能正在关闭，本次不导出
+            return None
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds):
+        # 即bucket_index，内联以减少一次函数调用
+        micros = int(seconds * 1e6)
+        if micros < 2 * SUB_BUCKETS:
+            index = micros if micros > 0 else 0
+        else:
+            if micros > MAX_MICROS:
+                micros = MAX_MICROS
+            shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+            index = (shift << SUB_BUCKET_BITS) + (micros >> shift)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def percentile(self, pct):
+        """第pct百分位的耗时（秒），没有样本时返回None"""
+        with self.lock:
+            return percentile_of(self.counts_by_index(), self.count, pct)
+
+    def counts_by_index(self):
+        return [(index, count) for index, count in enumerate(self.counts) if count]
+
+    def snapshot(self):
+        with self.lock:
+            return {'buckets': self.counts_by_index(), 'count': self.count, 'sum': self.sum}
+
+
+def percentile_of(buckets, total, pct):
+    if not total:
+        return None
+    rank = max(1, total * pct / 100)
+    seen = 0
+    for index, count in buckets:
+        seen += count
+        if seen >= rank:
+            low, high = bucket_bounds(index)
+            return (low + high) / 2 / 1e6
+    low, high = bucket_bounds(buckets[-1][0])
+    return (low + high) / 2 / 1e6
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # (名称, 标签) -> 指标
+        self.help = {}     # 名称 -> 说明
+
+    def _get(self, factory, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = factory()
+                self.help[name] = help_text
+            return metric
+
+    def counter(self, name, help_text, **labels):
+        """同一名称和标签返回同一个指标"""
+        return self._get(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text, **labels):
+        return self._get(Histogram, name, help_text, labels)
+
+    def gauge(self, name, help_text, read, **labels):
+        """注册一个在导出时调用read()取值的指标，重复注册时替换回调"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.metrics[key] = Gauge(read)
+            self.help[name] = help_text
+
+    def snapshot(self):
+        """当前所有指标的值，可以JSON序列化"""
+        with self.lock:
+            items = list(self.metrics.items())
+        snapshot = []
+        for (name, labels), metric in items:
+            value = metric.snapshot()
+            if value is not None:
+                snapshot.append(dict(value, name=name, kind=metric.kind, help=self.help[name], labels=dict(labels)))
+        return snapshot
+
+
+def merge(snapshots):
+    """合并多个快照：同名同标签的计数和直方图相加，gauge也相加（如各worker的连接数）"""
+    merged = {}
+    for snapshot in snapshots:
+        for entry in snapshot:
+            key = (entry['name'], tuple(sorted(entry['labels'].items())))
+            target = merged.get(key)
+            if target is None:
+                merged[key] = dict(entry)
+                if entry['kind'] == 'histogram':
+                    merged[key]['buckets'] = list(entry['buckets'])
+                continue
+            if entry['kind'] == 'histogram':
+                counts = dict(target['buckets'])
+                for index, count in entry['buckets']:
+                    counts[index] = counts.get(index, 0) + count
+                target['buckets'] = sorted(counts.items())
+                target['count'] += entry['count']
+                target['sum'] += entry['sum']
+            else:
+                target['value'] += entry['value']
+    return list(merged.values())
+
+
+def _labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(snapshot):
+    """把快照转换为Prometheus文本格式"""
+    lines = []
+    described = set()
+    for entry in sorted(snapshot, key=lambda item: (item['name'], sorted(item['labels'].items()))):
+        name, labels = entry['name'], entry['labels']
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['kind']}")
+        if entry['kind'] != 'histogram':
+            lines.append(f"{name}{_labels(labels)} {_number(entry['value'])}")
+            continue
+        buckets = entry['buckets']
+        position = 0
+        cumulative = 0
+        for bound in EXPORT_BOUNDS:
+            limit = bound * 1e6
+            # 桶的上界不超过导出上界的样本计入该导出桶
+            while position < len(buckets) and bucket_bounds(buckets[position][0])[1] <= limit:
+                cumulative += buckets[position][1]
+                position += 1
+            lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {entry['count']}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(entry['sum'])}")
+        lines.append(f"{name}_count{_labels(labels)} {entry['count']}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,255 @@
+"""
+每个连接的有界发送队列
+
+广播只把帧放进各连接的队列，由引擎的写线程/事件循环以非阻塞方式发出，
+一个接收缓慢的客户端不会再拖慢其他人。队列满时按慢消费者策略处理：
+  drop_oldest - 丢弃最旧的未发送帧
+  coalesce    - 把积压的帧合并成一条"已跳过N条消息"的系统提示
+  disconnect  - 断开该客户端（队列满或落后超过max_lag秒）
+
+协商了压缩的连接（见compression.py）在帧即将写出时才按顺序压缩，
+已压缩的帧属于连续的压缩流，不会再被丢弃。
+
+传入metrics（MetricsRegistry）时记录每帧在队列中等待的时间、每次写操作的耗时和总发送量。
+"""
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from protocol import encode_message
+from metrics import SERVER_STAGE_SECONDS, SERVER_STAGE_HELP
+
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+DEFAULT_MAX_FRAMES = 1024
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_LAG = 10.0
+
+# 一次写操作最多合并的帧数和字节数（IOV_MAX通常为1024）
+WRITE_BATCH_FRAMES = 256
+WRITE_BATCH_BYTES = 256 * 1024
+# Windows没有sendmsg，退化为拼接后一次send
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+class OutboundQueue:
+    def __init__(self, max_frames=DEFAULT_MAX_FRAMES, max_bytes=DEFAULT_MAX_BYTES,
+                 policy='drop_oldest', max_lag=DEFAULT_MAX_LAG, encode=encode_message, metrics=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"未知的慢消费者策略: {policy}")
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.max_lag = max_lag
+        self.encode = encode
+        self.lock = threading.Lock()
+        self.frames = deque()
+        self.enqueued = deque()  # 每个帧入队的时间，与frames一一对应
+        self.queued_bytes = 0
+        self.offset = 0  # 队首帧已发送的字节数
+        self.compressor = None
+        self.sealed = 0  # 队首已压缩（或确定不压缩）的帧数，这些帧不能再丢弃
+        self.behind_since = None  # 队列开始积压的时间
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.dropped_frames = 0
+        self.writes = 0  # 写系统调用次数，与sent_frames对比可以看出合并效果
+        self.queue_time = self.write_time = None
+        if metrics is not None:
+            self.queue_time = metrics.histogram(SERVER_STAGE_SECONDS, SERVER_STAGE_HELP, stage='queue')
+            self.write_time = metrics.histogram(SERVER_STAGE_SECONDS, SERVER_STAGE_HELP, stage='write')
+            self.total_frames = metrics.counter('chat_server_sent_frames_total', '写出的帧数')
+            self.total_bytes = metrics.counter('chat_server_sent_bytes_total', '写出的字节数')
+            self.total_dropped = metrics.counter('chat_server_dropped_frames_total', '慢消费者策略丢弃的帧数')
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame):
+        """放入一个帧，返回False表示按策略应断开该连接"""
+        with self.lock:
+            now = time.monotonic()
+            if self._is_full(len(frame)):
+                if self.policy == 'disconnect':
+                    return False
+                elif self.policy == 'coalesce':
+                    self._coalesce()
+                else:
+                    self._drop_oldest(len(frame))
+            elif self._lagging(now) and self.policy == 'disconnect':
+                return False
+
+            self.frames.append(frame)
+            self.enqueued.append(now)
+            self.queued_bytes += len(frame)
+            if self.behind_since is None:
+                self.behind_since = now
+            return True
+
+    def enable_compression(self, compressor):
+        """之后写出的帧经过compressor压缩"""
+        with self.lock:
+            self.compressor = compressor
+
+    def pop_all(self):
+        """取出队列中的全部帧，供一次合并写出"""
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+            if self.compressor is not None:
+                frames = [self.compressor.compress_frame(frame) for frame in frames]
+                self.queued_bytes = sum(len(frame) for frame in frames)
+            if self.queue_time is not None:
+                now = time.monotonic()
+                for enqueued in self.enqueued:
+                    self.queue_time.record(now - enqueued)
+                self.total_frames.inc(len(frames))
+                self.total_bytes.inc(self.queued_bytes)
+            self.enqueued.clear()
+            self.sent_frames += len(frames)
+            self.sent_bytes += self.queued_bytes
+            self.queued_bytes = 0
+            self.behind_since = None
+            if frames:
+                self.writes += 1
+            return frames
+
+    def write_to(self, sock):
+        """
+        向非阻塞socket尽量多地写出数据，全部写完返回True
+        队列中积压的多个帧通过一次sendmsg(writev)合并写出
+        """
+        with self.lock:
+            while self.frames:
+                if self.compressor is not None:
+                    self._seal()
+                buffers = self._next_batch()
+                requested = sum(len(buffer) for buffer in buffers)
+                start = time.perf_counter()
+                try:
+                    if HAS_SENDMSG and len(buffers) > 1:
+                        sent = sock.sendmsg(buffers)
+                    else:
+                        sent = sock.send(buffers[0] if len(buffers) == 1 else b''.join(buffers))
+                except (BlockingIOError, InterruptedError):
+                    return False
+                self.writes += 1
+                self.sent_bytes += sent
+                if self.write_time is not None:
+                    self.write_time.record(time.perf_counter() - start)
+                    self.total_bytes.inc(sent)
+                self._advance(sent)
+                if sent < requested:
+                    # 内核缓冲区已满，等待下次可写
+                    return False
+            self.behind_since = None
+            return True
+
+    def _seal(self):
+        """压缩下一批将要写出的帧"""
+        limit = min(len(self.frames), WRITE_BATCH_FRAMES)
+        while self.sealed < limit:
+            frame = self.frames[self.sealed]
+            compressed = self.compressor.compress_frame(frame)
+            if compressed is not frame:
+                self.frames[self.sealed] = compressed
+                self.queued_bytes += len(compressed) - len(frame)
+            self.sealed += 1
+
+    def _next_batch(self):
+        buffers = [memoryview(self.frames[0])[self.offset:]]
+        size = len(buffers[0])
+        for index in range(1, min(len(self.frames), WRITE_BATCH_FRAMES)):
+            frame = self.frames[index]
+            if size + len(frame) > WRITE_BATCH_BYTES:
+                break
+            buffers.append(frame)
+            size += len(frame)
+        return buffers
+
+    def _advance(self, sent):
+        """按已写出的字节数推进队列"""
+        now = time.monotonic()
+        written = 0
+        while sent:
+            frame = self.frames[0]
+            remaining = len(frame) - self.offset
+            if sent < remaining:
+                self.offset += sent
+                break
+            sent -= remaining
+            self.frames.popleft()
+            enqueued = self.enqueued.popleft()
+            if self.queue_time is not None:
+                self.queue_time.record(now - enqueued)
+            self.queued_bytes -= len(frame)
+            self.offset = 0
+            written += 1
+            if self.sealed:
+                self.sealed -= 1
+        self.sent_frames += written
+        if written and self.queue_time is not None:
+            self.total_frames.inc(written)
+
+    def lagging(self, now=None):
+        """是否已落后超过max_lag秒"""
+        with self.lock:
+            return self._lagging(time.monotonic() if now is None else now)
+
+    def stats(self):
+        with self.lock:
+            lag = time.monotonic() - self.behind_since if self.behind_since else 0.0
+            return {
+                'queue_frames': len(self.frames),
+                'queue_bytes': self.queued_bytes - self.offset,
+                'lag_seconds': round(lag, 3),
+                'sent_frames': self.sent_frames,
+                'sent_bytes': self.sent_bytes,
+                'dropped_frames': self.dropped_frames,
+                'writes': self.writes,
+                'compression': self.compressor.stats() if self.compressor is not None else None,
+            }
+
+    def _lagging(self, now):
+        return self.behind_since is not None and now - self.behind_since > self.max_lag
+
+    def _is_full(self, incoming):
+        if not self.frames:
+            # 空队列总能放下一个帧，即使它超过max_bytes
+            return False
+        return len(self.frames) >= self.max_frames or self.queued_bytes + incoming > self.max_bytes
+
+    def _removable(self):
+        """可以丢弃的帧的起始下标（已发送一部分的队首帧不能丢，否则会破坏帧边界；已压缩的帧不能丢，否则会破坏压缩流）"""
+        return max(self.sealed, 1 if self.offset else 0)
+
+    def _drop_oldest(self, incoming):
+        start = self._removable()
+        while len(self.frames) > start and self._is_full(incoming):
+            frame = self.frames[start]
+            del self.frames[start]
+            del self.enqueued[start]
+            self.queued_bytes -= len(frame)
+            self.dropped_frames += 1
+            if self.queue_time is not None:
+                self.total_dropped.inc()
+
+    def _coalesce(self):
+        start = self._removable()
+        skipped = len(self.frames) - start
+        while len(self.frames) > start:
+            self.queued_bytes -= len(self.frames.pop())
+            self.enqueued.pop()
+        self.dropped_frames += skipped
+        if self.queue_time is not None:
+            self.total_dropped.inc(skipped)
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        notice = self.encode({
+            'type': 'system',
+            'content': f"{timestamp} | 网络较慢，已跳过 {skipped} 条消息",
+            'timestamp': timestamp,
+            'skipped': skipped
+        })
+        self.frames.append(notice)
+        self.enqueued.append(time.monotonic())
+        self.queued_bytes += len(notice)
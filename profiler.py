@@ -0,0 +1,236 @@
+"""
+按需采样分析
+
+服务器变慢时不必重启到profiler下：sample() 在调用它的线程中按固定间隔用 sys._current_frames()
+抓取所有线程（handle_client读线程、accept_clients、写线程、事件循环等）的调用栈并计数，持续指定的时间后返回。
+不采样时没有任何钩子或后台线程，对服务器没有开销；采样期间的开销约为每次采样的耗时除以间隔，结果中会给出。
+
+结果可以输出为折叠栈（每行 "线程;外层函数;...;内层函数 次数"），可直接交给 flamegraph.pl、speedscope 等生成火焰图，
+也可以汇总为各线程的采样数和CPU时间，以及自身/累计采样最多的函数。
+
+采样的是墙钟时间：阻塞在 recv、select 上的线程同样会被计数，看各线程的 cpu_seconds 可以区分忙和闲。
+"""
+import os
+import re
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.005
+MIN_INTERVAL = 0.001
+MAX_DURATION = 300.0
+# 调用栈最多保留的层数（从内层数起），避免递归过深时每次采样的开销失控
+MAX_DEPTH = 128
+TOP_FUNCTIONS = 30
+# 未命名线程的默认名称 "Thread-12 (handle_client)"，按目标函数名归并
+_DEFAULT_THREAD_NAME = re.compile(r'^Thread-\d+ \((.+)\)$')
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# 每个线程栈底都有的threading启动函数，不计入栈
+_BOOTSTRAP_CODES = {threading.Thread._bootstrap.__code__, threading.Thread._bootstrap_inner.__code__,
+                    threading.Thread.run.__code__}
+
+# 同一进程同一时间只允许一个采样，避免两次请求互相放大开销
+_active = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """已经有一个采样在进行"""
+
+
+def thread_group(name):
+    match = _DEFAULT_THREAD_NAME.match(name)
+    return match.group(1) if match else name
+
+
+def _frame_label(code, lines, lineno):
+    filename = os.path.basename(code.co_filename)
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({filename}:{lineno if lines else code.co_firstlineno})"
+
+
+def _thread_cpu(native_id):
+    """线程累计的CPU时间（秒），只在Linux上可用"""
+    try:
+        with open(f'/proc/self/task/{native_id}/stat', 'rb') as f:
+            fields = f.read().rsplit(b')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class Profile:
+    """一次采样的结果"""
+
+    def __init__(self, duration, interval):
+        self.duration = duration
+        self.interval = interval
+        self.stacks = {}   # (线程, 外层函数, ..., 内层函数) -> 采样次数
+        self.roots = 1     # 栈开头表示线程（和进程）而不是函数的层数
+        self.threads = {}  # 线程 -> {'samples', 'count', 'cpu_seconds'}
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.elapsed = 0.0
+        self.errors = []   # 多进程模式下没有取到结果的worker
+
+    def add(self, stack, count=1):
+        self.stacks[stack] = self.stacks.get(stack, 0) + count
+
+    def collapsed(self):
+        """折叠栈文本，按次数从多到少"""
+        lines = [f"{';'.join(stack)} {count}"
+                 for stack, count in sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """自身采样（位于栈顶）和累计采样（出现在栈中）最多的函数"""
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            frames = stack[self.roots:]
+            if not frames:
+                continue
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for frame in set(frames):
+                total[frame] = total.get(frame, 0) + count
+        functions = [{'function': frame, 'self': own.get(frame, 0), 'total': count}
+                     for frame, count in total.items()]
+        functions.sort(key=lambda entry: (entry['self'], entry['total']), reverse=True)
+        return functions[:limit]
+
+    def summary(self):
+        return {
+            'duration': round(self.elapsed, 3),
+            'interval': self.interval,
+            'samples': self.samples,
+            # 采样本身占用的时间比例（采样期间持有GIL，其他线程在这段时间里无法运行）
+            'overhead': round(self.sampling_seconds / self.elapsed, 4) if self.elapsed else 0.0,
+            'threads': self.threads,
+            'top': self.top_functions(),
+            'errors': self.errors,
+        }
+
+    def to_dict(self):
+        """可JSON序列化的完整结果，多进程模式下worker经总线发回主进程"""
+        return dict(self.summary(), stacks=[[list(stack), count] for stack, count in self.stacks.items()])
+
+
+def sample(duration, interval=DEFAULT_INTERVAL, lines=False, threads=None):
+    """
+    采样duration秒，返回Profile；lines为True时按行区分（火焰图更细，但同一函数会被拆开），
+    threads为线程名（归并后）的集合时只采样这些线程。已有采样在进行时抛出ProfilerBusy
+    """
+    duration = float(duration)
+    interval = float(interval)
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"采样时长必须在0到{MAX_DURATION:g}秒之间: {duration}")
+    if interval < MIN_INTERVAL:
+        raise ValueError(f"采样间隔不能小于{MIN_INTERVAL}秒: {interval}")
+    if not _active.acquire(blocking=False):
+        raise ProfilerBusy("已有采样正在进行")
+    try:
+        return _sample(duration, interval, lines, threads)
+    finally:
+        _active.release()
+
+
+def _sample(duration, interval, lines, threads):
+    profile = Profile(duration, interval)
+    own = threading.get_ident()
+    # id(code对象)（和行号）-> (code对象, 函数标签)，同一函数只格式化一次；
+    # code对象的哈希每次都要重新计算，用id作键，同时持有code对象保证id不被复用
+    labels = {}
+    cpu_start = {}   # 线程ident -> (归并后的名称, native_id, 开始时的CPU时间)
+    names = {}       # 线程ident -> 归并后的名称，出现新线程时才重新枚举
+    # 线程ident -> (上次采样的栈顶帧, 行号, 栈)；阻塞在recv、select上的线程栈顶帧不变，
+    # 调用链也就不变，直接复用上次的栈，线程很多时采样耗时主要取决于忙碌的线程数
+    last = {}
+    start = time.perf_counter()
+    deadline = start + duration
+    next_sample = start
+    while True:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        if now < next_sample:
+            time.sleep(next_sample - now)
+        next_sample += interval
+        sample_start = time.perf_counter()
+        frames = sys._current_frames()
+        if not names.keys() >= frames.keys():
+            for thread in threading.enumerate():
+                if thread.ident not in names:
+                    names[thread.ident] = thread_group(thread.name)
+                    if thread.ident != own:
+                        cpu_start[thread.ident] = (names[thread.ident], thread.native_id,
+                                                   _thread_cpu(thread.native_id))
+            for ident in frames.keys() - names.keys():
+                # 不是由threading创建的线程
+                names[ident] = f"thread-{ident}"
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            name = names[ident]
+            if threads and name not in threads:
+                continue
+            previous = last.get(ident)
+            if previous is not None and previous[0] is frame and previous[1] == frame.f_lineno:
+                profile.add(previous[2])
+                profile.threads[name]['samples'] += 1
+                continue
+            leaf, lineno = frame, frame.f_lineno
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                if code in _BOOTSTRAP_CODES:
+                    frame = frame.f_back
+                    continue
+                key = (id(code), frame.f_lineno) if lines else id(code)
+                entry = labels.get(key)
+                if entry is None:
+                    entry = labels[key] = (code, _frame_label(code, lines, frame.f_lineno))
+                stack.append(entry[1])
+                frame = frame.f_back
+            stack.append(name)
+            stack.reverse()
+            stack = tuple(stack)
+            last[ident] = (leaf, lineno, stack)
+            profile.add(stack)
+            entry = profile.threads.setdefault(name, {'samples': 0, 'count': 0, 'cpu_seconds': None})
+            entry['samples'] += 1
+        del frames, frame
+        profile.samples += 1
+        profile.sampling_seconds += time.perf_counter() - sample_start
+        if next_sample < time.perf_counter():
+            # 采样跟不上间隔时不补采，避免连续采样占满CPU
+            next_sample = time.perf_counter()
+    profile.elapsed = time.perf_counter() - start
+    last.clear()
+
+    for name, native_id, cpu in cpu_start.values():
+        entry = profile.threads.get(name)
+        if entry is None:
+            continue
+        entry['count'] += 1
+        end = _thread_cpu(native_id) if cpu is not None else None
+        if end is not None:
+            entry['cpu_seconds'] = round((entry['cpu_seconds'] or 0.0) + end - cpu, 3)
+    return profile
+
+
+def merge(profiles, prefixes):
+    """合并多个进程的结果（to_dict()的输出），每个进程的栈前面加上对应的前缀（如worker-0）"""
+    merged = Profile(0.0, 0.0)
+    merged.roots = 2
+    for data, prefix in zip(profiles, prefixes):
+        merged.duration = max(merged.duration, data['duration'])
+        merged.elapsed = max(merged.elapsed, data['duration'])
+        merged.interval = data['interval']
+        merged.samples += data['samples']
+        # 各进程分别采样，开销取最大的一个
+        merged.sampling_seconds = max(merged.sampling_seconds, data['overhead'] * data['duration'])
+        for name, entry in data['threads'].items():
+            merged.threads[f"{prefix};{name}"] = entry
+        for stack, count in data['stacks']:
+            merged.add((prefix,) + tuple(stack), count)
+    return merged
@@ -0,0 +1,125 @@
+"""
+Socket聊天协议的帧编解码
+
+每个帧 = 4字节大端无符号长度前缀 + 消息体（UTF-8编码的JSON，或协商后使用的二进制编码，见codec.py）。
+服务器和客户端共用本模块，保证TCP粘包/拆包时消息不会丢失。
+"""
+import json
+import struct
+from codec import CODEC_BINARY, BINARY_MAGIC, encode_binary, decode_binary
+
+HEADER = struct.Struct('!I')
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # 单帧最大16MB，防止恶意长度耗尽内存
+MIN_READ_SIZE = 4096  # 每次读取前保证缓冲区至少有这么多空闲空间
+
+
+class ProtocolError(Exception):
+    """帧格式错误，例如长度前缀超过上限"""
+
+
+def encode_frame(payload):
+    """为消息体加上长度前缀"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"帧长度 {len(payload)} 超过上限 {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message_data, codec=None):
+    """将消息字典编码为一个完整的帧，codec为CODEC_BINARY时使用二进制编码，否则为JSON"""
+    if codec == CODEC_BINARY:
+        return encode_frame(encode_binary(message_data))
+    return encode_frame(json.dumps(message_data).encode('utf-8'))
+
+
+def decode_message(payload):
+    """将帧的消息体（bytes或memoryview）解析为消息字典，两种编码都能识别"""
+    if payload and payload[0] == BINARY_MAGIC:
+        return decode_binary(payload)
+    if isinstance(payload, memoryview):
+        # 直接从缓冲区解码，避免先复制成bytes
+        return json.loads(str(payload, 'utf-8'))
+    return json.loads(payload)
+
+
+class FrameDecoder:
+    """
+    增量帧解码器
+
+    数据直接读入可复用的bytearray缓冲区，完整的帧以memoryview的形式产出，
+    一次读取可以解出多个帧，超过单次读取大小的帧会跨多次读取拼接，都不会额外复制。
+    注意：产出的memoryview只在下一次读取之前有效。
+    """
+
+    def __init__(self, initial_size=65536, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(initial_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # 未消费数据的起点
+        self._end = 0    # 已写入数据的终点
+        self._need = 0   # 当前不完整帧所需的总字节数
+
+    def pending(self):
+        """缓冲区中尚未解出帧的字节数"""
+        return self._end - self._start
+
+    def get_buffer(self, sizehint=-1):
+        """返回可写入的空闲缓冲区（与asyncio.BufferedProtocol的接口一致）"""
+        self._reserve(max(sizehint, MIN_READ_SIZE))
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes):
+        """通知解码器有nbytes字节已写入get_buffer()返回的缓冲区"""
+        self._end += nbytes
+
+    def recv_into(self, sock):
+        """从socket读取数据到缓冲区，返回读取的字节数（0表示对端已关闭）"""
+        nbytes = sock.recv_into(self.get_buffer())
+        self.buffer_updated(nbytes)
+        return nbytes
+
+    def feed(self, data):
+        """写入一段已经读出的数据（用于无法直接recv_into的场景）"""
+        size = len(data)
+        self._reserve(size)
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def frames(self):
+        """逐个产出缓冲区中所有完整帧的消息体"""
+        while True:
+            available = self._end - self._start
+            if available < HEADER_SIZE:
+                break
+            (length,) = HEADER.unpack_from(self._buffer, self._start)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            if available < HEADER_SIZE + length:
+                self._need = HEADER_SIZE + length
+                break
+            begin = self._start + HEADER_SIZE
+            self._start = begin + length
+            self._need = 0
+            yield self._view[begin:self._start]
+
+        if self._start == self._end:
+            # 缓冲区已全部消费，下次从头开始写
+            self._start = self._end = 0
+
+    def _reserve(self, size):
+        """保证缓冲区尾部至少有size字节空闲，并能容纳当前不完整的帧"""
+        pending = self._end - self._start
+        required = max(pending + size, self._need)
+        if required > len(self._buffer):
+            # 扩容：只复制尚未消费的部分
+            new_buffer = bytearray(max(required, len(self._buffer) * 2))
+            new_buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = new_buffer
+            self._view = memoryview(new_buffer)
+            self._start, self._end = 0, pending
+        elif len(self._buffer) - self._end < size or self._start + self._need > len(self._buffer):
+            # 尾部空间不够：把不完整的数据挪到缓冲区开头
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
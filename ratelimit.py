@@ -0,0 +1,186 @@
+"""
+客户端发送限速
+
+服务器在接收路径上为每个连接和每个IP各维护一个令牌桶：每收到一个帧消耗一个令牌，
+令牌按rate个/秒恢复，最多积累burst个（允许短时间的突发）。两个桶都有令牌时才处理该帧，
+否则按策略处理：
+  drop       - 丢弃这个帧
+  delay      - 预支令牌并推迟处理，期间暂停读取该连接（TCP流控会让客户端慢下来）
+  disconnect - 断开该连接
+rate为0表示不限制。限额可以在运行时修改（见main.py的 /rate_limit），已有的桶立即按新限额恢复令牌。
+"""
+import threading
+import time
+
+RATE_LIMIT_POLICIES = ('drop', 'delay', 'disconnect')
+# 界面启动服务器时的默认限额：每个连接每秒10条、突发30条；同一IP（可能是NAT后的多台电脑）每秒50条
+DEFAULT_RATE_LIMIT = {
+    'rate': 10.0,
+    'burst': 30.0,
+    'ip_rate': 50.0,
+    'ip_burst': 150.0,
+    'policy': 'delay',
+}
+LIMIT_FIELDS = ('rate', 'burst', 'ip_rate', 'ip_burst')
+# 每登记这么多个连接清理一次没有连接且令牌已恢复满的IP
+PRUNE_EVERY = 256
+
+ALLOW = 'allow'
+DROP = 'drop'
+DELAY = 'delay'
+DISCONNECT = 'disconnect'
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated', 'allowed', 'dropped', 'delayed')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.allowed = 0
+        self.dropped = 0
+        self.delayed = 0
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def counters(self):
+        return {'allowed': self.allowed, 'dropped': self.dropped, 'delayed': self.delayed}
+
+
+class RateLimiter:
+    def __init__(self, rate=0.0, burst=0.0, ip_rate=0.0, ip_burst=0.0, policy='delay'):
+        self.lock = threading.Lock()
+        self.rate = self.burst = self.ip_rate = self.ip_burst = 0.0
+        self.policy = 'delay'
+        self.connections = {}  # 连接id -> 令牌桶
+        self.ips = {}          # IP -> [令牌桶, 连接数]；连接数为0的IP保留到令牌恢复满，断开重连不能绕过限速
+        self._adds = 0
+        self.allowed = 0
+        self.dropped = 0
+        self.delayed = 0
+        self.disconnected = 0
+        self.configure(rate=rate, burst=burst, ip_rate=ip_rate, ip_burst=ip_burst, policy=policy)
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or self.ip_rate > 0
+
+    def configure(self, **limits):
+        """修改限额和策略，只修改给出的项；参数无效时抛出ValueError，不做任何修改"""
+        unknown = set(limits) - set(LIMIT_FIELDS) - {'policy'}
+        if unknown:
+            raise ValueError(f"未知的限速参数: {', '.join(sorted(unknown))}")
+        values = {field: float(limits.get(field, getattr(self, field))) for field in LIMIT_FIELDS}
+        policy = limits.get('policy', self.policy)
+        if policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f"未知的限速策略: {policy}")
+        if any(value < 0 for value in values.values()):
+            raise ValueError("限额不能为负数")
+        # 未指定突发量时至少能发一条
+        values['burst'] = max(values['burst'], 1.0) if values['rate'] else values['burst']
+        values['ip_burst'] = max(values['ip_burst'], 1.0) if values['ip_rate'] else values['ip_burst']
+        with self.lock:
+            for field, value in values.items():
+                setattr(self, field, value)
+            self.policy = policy
+        return self.limits()
+
+    def limits(self):
+        return {'rate': self.rate, 'burst': self.burst, 'ip_rate': self.ip_rate,
+                'ip_burst': self.ip_burst, 'policy': self.policy}
+
+    def add(self, conn_id, ip):
+        now = time.monotonic()
+        with self.lock:
+            self._adds += 1
+            if self._adds % PRUNE_EVERY == 0:
+                self._prune(now)
+            self.connections[conn_id] = TokenBucket(self.burst, now)
+            entry = self.ips.get(ip)
+            if entry is None:
+                entry = self.ips[ip] = [TokenBucket(self.ip_burst, now), 0]
+            entry[1] += 1
+
+    def remove(self, conn_id, ip):
+        with self.lock:
+            self.connections.pop(conn_id, None)
+            entry = self.ips.get(ip)
+            if entry is not None:
+                entry[1] -= 1
+
+    def _prune(self, now):
+        idle = []
+        for ip, (bucket, count) in self.ips.items():
+            if count <= 0:
+                bucket.refill(self.ip_rate, self.ip_burst, now)
+                if bucket.tokens >= self.ip_burst:
+                    idle.append(ip)
+        for ip in idle:
+            del self.ips[ip]
+
+    def admit(self, conn_id, ip):
+        """
+        收到一个帧时调用，返回(动作, 等待秒数)
+        动作为ALLOW时立即处理；DELAY时等待后处理（令牌已预支）；DROP丢弃；DISCONNECT断开连接
+        """
+        if not self.enabled:
+            return ALLOW, 0.0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.connections.get(conn_id)
+            entry = self.ips.get(ip)
+            if bucket is None or entry is None:
+                return ALLOW, 0.0
+            checks = []
+            if self.rate > 0:
+                bucket.refill(self.rate, self.burst, now)
+                checks.append((bucket, self.rate))
+            if self.ip_rate > 0:
+                entry[0].refill(self.ip_rate, self.ip_burst, now)
+                checks.append((entry[0], self.ip_rate))
+
+            if all(limited.tokens >= 1 for limited, _ in checks):
+                for limited, _ in checks:
+                    limited.tokens -= 1
+                bucket.allowed += 1
+                entry[0].allowed += 1
+                self.allowed += 1
+                return ALLOW, 0.0
+            if self.policy == 'delay':
+                wait = 0.0
+                for limited, rate in checks:
+                    limited.tokens -= 1
+                    wait = max(wait, -limited.tokens / rate)
+                bucket.delayed += 1
+                entry[0].delayed += 1
+                self.delayed += 1
+                return DELAY, wait
+            if self.policy == 'drop':
+                bucket.dropped += 1
+                entry[0].dropped += 1
+                self.dropped += 1
+                return DROP, 0.0
+            self.disconnected += 1
+            return DISCONNECT, 0.0
+
+    def connection_counters(self, conn_id):
+        with self.lock:
+            bucket = self.connections.get(conn_id)
+            return bucket.counters() if bucket is not None else None
+
+    def stats(self, top=10):
+        """当前限额、总计数和被限速最多的IP"""
+        with self.lock:
+            busiest = sorted(self.ips.items(), key=lambda item: item[1][0].dropped + item[1][0].delayed,
+                             reverse=True)[:top]
+            return dict(self.limits(), **{
+                'enabled': self.enabled,
+                'allowed': self.allowed,
+                'dropped': self.dropped,
+                'delayed': self.delayed,
+                'disconnected': self.disconnected,
+                'connections': len(self.connections),
+                'ips': [dict(entry[0].counters(), ip=ip, connections=entry[1]) for ip, entry in busiest],
+            })
@@ -0,0 +1,126 @@
+"""
+连接注册表
+
+按连接id索引所有客户端连接，增删都是O(1)。广播使用缓存的只读快照遍历，
+不需要持有锁；快照只在连接变化后的下一次广播时重建一次。
+房间成员索引采用同样的方式，每个房间单独缓存快照。
+"""
+import itertools
+import threading
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._snapshot = ()
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, conn_id):
+        return conn_id in self._clients
+
+    def add(self, connection):
+        """登记连接并分配连接id"""
+        with self._lock:
+            connection.id = next(self._ids)
+            self._clients[connection.id] = connection
+            self._snapshot = None
+        return connection.id
+
+    def remove(self, conn_id):
+        """注销连接，返回被移除的连接；已经移除过则返回None"""
+        with self._lock:
+            connection = self._clients.pop(conn_id, None)
+            if connection is not None:
+                self._snapshot = None
+            return connection
+
+    def get(self, conn_id):
+        return self._clients.get(conn_id)
+
+    def snapshot(self):
+        """返回当前所有连接的只读元组，遍历期间的增删不会影响它"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(self._clients.values())
+                snapshot = self._snapshot
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._snapshot = ()
+
+
+class RoomIndex:
+    """
+    房间 -> 成员的索引
+    广播到房间时只遍历该房间的成员快照，开销与房间大小成正比而不是与总连接数成正比
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}       # 房间名 -> {连接id: 连接}
+        self._snapshots = {}   # 房间名 -> 成员元组缓存
+
+    def join(self, room, connection):
+        """加入房间，已经在房间中返回False"""
+        with self._lock:
+            members = self._rooms.setdefault(room, {})
+            if connection.id in members:
+                return False
+            members[connection.id] = connection
+            connection.rooms.add(room)
+            self._snapshots.pop(room, None)
+            return True
+
+    def leave(self, room, connection):
+        """离开房间，不在房间中返回False"""
+        with self._lock:
+            return self._leave(room, connection)
+
+    def leave_all(self, connection):
+        """连接断开时退出所有房间，返回退出的房间列表"""
+        with self._lock:
+            rooms = list(connection.rooms)
+            for room in rooms:
+                self._leave(room, connection)
+            return rooms
+
+    def _leave(self, room, connection):
+        members = self._rooms.get(room)
+        if not members or members.pop(connection.id, None) is None:
+            return False
+        connection.rooms.discard(room)
+        self._snapshots.pop(room, None)
+        if not members:
+            # 空房间直接删除，避免房间名无限增长
+            del self._rooms[room]
+        return True
+
+    def members(self, room):
+        """返回房间成员的只读元组"""
+        snapshot = self._snapshots.get(room)
+        if snapshot is None:
+            with self._lock:
+                members = self._rooms.get(room)
+                if not members:
+                    return ()
+                snapshot = tuple(members.values())
+                self._snapshots[room] = snapshot
+        return snapshot
+
+    def room_sizes(self):
+        """返回每个房间的成员数"""
+        with self._lock:
+            return {room: len(members) for room, members in self._rooms.items()}
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._snapshots.clear()
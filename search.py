@@ -0,0 +1,282 @@
+"""
+聊天记录全文搜索
+
+增量维护的倒排索引。广播时只把消息放进队列，由后台线程分词、建索引，不占用广播路径的时间。
+
+- 分词：中日韩文字按相邻两个字切分（单独一个字时取这个字），其他文字按单词切分并转为小写
+- 查询：查询词同样分词，结果必须包含所有词；从最少见的词开始求交集
+- 排序：按BM25打分（短消息中词频几乎都是1，只考虑逆文档频率和消息长度），分数相同时较新的在前
+- 过滤：用户名、IP、房间也作为特殊的词建索引，与查询词一起求交集；时间范围在交集结果上过滤
+
+单个汉字的查询只能匹配单独成词的字（索引中只有二元组）。
+
+索引只保留最近的max_documents条消息：超出时一次淘汰最旧的一批（上限的十分之一），
+同时截掉各倒排列表的开头，长期运行的服务器内存不会无限增长。
+"""
+import heapq
+import math
+import queue
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from protocol import HEADER_SIZE, decode_message
+
+# 假名、中日韩统一表意文字（含扩展A和兼容区）、韩文音节
+CJK_RANGES = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+TOKEN_PATTERN = re.compile(rf'[{CJK_RANGES}]+|[^\W{CJK_RANGES}]+')
+CJK_PATTERN = re.compile(rf'[{CJK_RANGES}]')
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+# 过滤字段在索引中的前缀，分词结果不会包含\x00
+FIELD_PREFIX = {'username': '\x00u:', 'ip': '\x00i:', 'room': '\x00r:'}
+# BM25参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 索引保留的消息数上限
+DEFAULT_MAX_DOCUMENTS = 200000
+
+
+def tokenize(text):
+    """中日韩文字切成二元组，其他文字按单词切分"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if CJK_PATTERN.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def parse_time(value):
+    """把 "YYYY-MM-DD HH:MM:SS" 或时间戳转为时间戳，无法解析时返回None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for layout in (TIME_FORMAT, "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, layout).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def message_text(message_data):
+    """从格式化后的聊天消息中取出用户输入的正文"""
+    content = message_data.get('content', '')
+    prefix = f"{message_data.get('ip')} | {message_data.get('timestamp')} | {message_data.get('username')}: "
+    return content[len(prefix):] if content.startswith(prefix) else content
+
+
+class SearchIndex:
+    def __init__(self, max_documents=DEFAULT_MAX_DOCUMENTS):
+        if max_documents < 1:
+            raise ValueError(f"索引消息数上限必须大于0: {max_documents}")
+        self.max_documents = max_documents
+        self.lock = threading.Lock()
+        self.postings = {}  # 词 -> 文档编号数组（递增）
+        # 文档按编号存放在并行数组中，下标为编号减去base（已淘汰的文档数）
+        self.base = 0
+        self.evicted = 0
+        self.seqs = array('Q')
+        self.times = array('d')
+        self.lengths = array('H')
+        self.usernames = []
+        self.ips = []
+        self.rooms = []
+        self.texts = []
+        self.total_length = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._index_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, message_data, seq, room=None):
+        """广播时调用：只入队，分词和建索引在后台线程完成"""
+        self._queue.put((message_data, seq, room))
+
+    def submit_frame(self, frame, room=None):
+        """提交一个已编码的消息帧，解析也放到后台线程"""
+        self._queue.put((frame, None, room))
+
+    def submit_log(self, log):
+        """启动时从磁盘日志补建索引，同样在后台线程中分批读取"""
+        self._queue.put((log, log.last_seq, None))
+
+    def _index_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            message_data, seq, room = item
+            try:
+                if hasattr(message_data, 'read_range'):
+                    self._index_log(message_data, seq)
+                    continue
+                if not isinstance(message_data, dict):
+                    message_data = decode_message(memoryview(message_data)[HEADER_SIZE:])
+                    seq = message_data.get('seq', 0)
+                if message_data.get('type', 'message') == 'message':
+                    self.add(message_data, seq, room or message_data.get('room'))
+            except Exception as e:
+                print(f"建立搜索索引失败: {e}")
+
+    def _index_log(self, log, last_seq, chunk=1000):
+        seq = log.first_seq
+        while seq <= last_seq:
+            for record_seq, room, frame in log.read_range(seq, min(seq + chunk - 1, last_seq)):
+                message_data = decode_message(memoryview(frame)[HEADER_SIZE:])
+                if message_data.get('type', 'message') == 'message':
+                    self.add(message_data, record_seq, room)
+            seq += chunk
+
+    def add(self, message_data, seq, room=None):
+        """把一条聊天消息加入索引"""
+        text = message_text(message_data)
+        tokens = set(tokenize(text))
+        length = len(tokens)
+        username = message_data.get('username', '')
+        ip = message_data.get('ip', '')
+        tokens.update(self._field_terms(username, ip, room))
+        timestamp = parse_time(message_data.get('timestamp')) or time.time()
+        with self.lock:
+            doc = self.base + len(self.seqs)
+            self.seqs.append(seq or 0)
+            self.times.append(timestamp)
+            self.lengths.append(min(length, 0xffff))
+            self.usernames.append(username)
+            self.ips.append(ip)
+            self.rooms.append(room)
+            self.texts.append(text)
+            self.total_length += length
+            for token in tokens:
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = array('I')
+                postings.append(doc)
+            if len(self.seqs) > self.max_documents:
+                self._evict(len(self.seqs) - self.max_documents + self.max_documents // 10)
+
+    def _evict(self, count):
+        """淘汰最旧的count条文档，须持有self.lock"""
+        self.total_length -= sum(self.lengths[:count])
+        for column in (self.seqs, self.times, self.lengths, self.usernames, self.ips, self.rooms, self.texts):
+            del column[:count]
+        self.base += count
+        self.evicted += count
+        for token in list(self.postings):
+            postings = self.postings[token]
+            cut = bisect_left(postings, self.base)
+            if cut == len(postings):
+                del self.postings[token]
+            elif cut:
+                del postings[:cut]
+
+    def search(self, query='', username=None, ip=None, room=None, since=None, until=None,
+               page=1, page_size=DEFAULT_PAGE_SIZE):
+        """返回按相关度排序的一页结果，query为空时按时间倒序列出满足过滤条件的消息"""
+        page = max(1, int(page))
+        page_size = min(max(1, int(page_size)), MAX_PAGE_SIZE)
+        since = parse_time(since)
+        until = parse_time(until)
+        terms = set(tokenize(query or ''))
+        fields = self._field_terms(username, ip, room)
+
+        with self.lock:
+            count = len(self.seqs)
+            base = self.base
+            if terms or fields:
+                lists = [self.postings.get(term) for term in terms | fields]
+                candidates = self._intersect(lists) if all(lists) else []
+            else:
+                candidates = range(base, base + count)
+            if since is not None or until is not None:
+                times = self.times
+                low = float('-inf') if since is None else since
+                high = float('inf') if until is None else until
+                candidates = [doc for doc in candidates if low <= times[doc - base] <= high]
+
+            wanted = page * page_size
+            if terms:
+                # 所有结果都包含全部查询词，BM25分数只随消息长度变化：越短越靠前，相同时新的在前
+                lengths = self.lengths
+                top = heapq.nsmallest(wanted, reversed(candidates), key=lambda doc: lengths[doc - base])
+                weight = sum(self._idf(len(self.postings[term]), count) for term in terms) if top else 0.0
+                average = self.total_length / count if count else 1
+                hits = [self._hit(doc - base, self._bm25(weight, lengths[doc - base], average))
+                        for doc in top[wanted - page_size:]]
+            else:
+                # 候选按文档编号递增，从末尾往前取这一页
+                end = max(0, len(candidates) - wanted + page_size)
+                hits = [self._hit(doc - base, 0.0) for doc in reversed(candidates[max(0, end - page_size):end])]
+
+        return {
+            'total': len(candidates),
+            'page': page,
+            'page_size': page_size,
+            'hits': hits,
+        }
+
+    @staticmethod
+    def _field_terms(username=None, ip=None, room=None):
+        values = {'username': username, 'ip': ip, 'room': room}
+        return {FIELD_PREFIX[field] + value for field, value in values.items() if value}
+
+    @staticmethod
+    def _intersect(lists):
+        """从最短的列表开始求交集，交集在C层面完成，结果按文档编号递增"""
+        lists = sorted(lists, key=len)
+        if len(lists) == 1:
+            return lists[0]
+        result = set(lists[0])
+        for postings in lists[1:]:
+            result.intersection_update(postings)
+            if not result:
+                break
+        return sorted(result)
+
+    @staticmethod
+    def _bm25(weight, length, average):
+        return weight * (BM25_K1 + 1) / (1 + BM25_K1 * (1 - BM25_B + BM25_B * length / average))
+
+    @staticmethod
+    def _idf(frequency, count):
+        return math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+    def _hit(self, index, score):
+        """index为文档在并行数组中的下标"""
+        return {
+            'seq': self.seqs[index],
+            'timestamp': datetime.fromtimestamp(self.times[index]).strftime(TIME_FORMAT),
+            'username': self.usernames[index],
+            'ip': self.ips[index],
+            'room': self.rooms[index],
+            'content': self.texts[index],
+            'score': round(score, 3),
+        }
+
+    def stats(self):
+        with self.lock:
+            return {
+                'documents': len(self.seqs),
+                'max_documents': self.max_documents,
+                'evicted': self.evicted,
+                'terms': len(self.postings),
+                'pending': self._queue.qsize(),
+            }
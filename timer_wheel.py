@@ -0,0 +1,89 @@
+"""
+分层时间轮
+
+为大量连接维护超时时间：添加、取消都是O(1)，每个tick只处理当前槽位中到期的项，
+与连接总数无关。第0层每个槽位一个tick，第n层每个槽位覆盖slots**n个tick；
+较远的超时先放在高层，转到对应时间段时再下放到低层（级联）。
+
+超出最高层范围的超时会被截断到最远的位置，提前到期；调用方到期时应自行核对真正的截止时间
+（心跳检测正是这样做的：到期后根据最后一次收到数据的时间决定发ping、断开还是重新登记）。
+"""
+import math
+import time
+
+DEFAULT_TICK = 0.5
+DEFAULT_SLOTS = 64
+DEFAULT_LEVELS = 3  # 0.5秒一个tick时可覆盖约36小时
+
+
+class TimerWheel:
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, levels=DEFAULT_LEVELS, clock=time.monotonic):
+        if tick <= 0 or slots < 2 or levels < 1:
+            raise ValueError(f"时间轮参数无效: tick={tick}, slots={slots}, levels={levels}")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self.origin = clock()
+        self.current = 0  # 已处理到的tick
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]  # 槽位: 键 -> 到期的tick
+        self.positions = {}  # 键 -> (层, 槽位)
+        self.spans = [slots ** (level + 1) for level in range(levels)]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def schedule(self, key, delay):
+        """delay秒后到期，已登记的键会被重新登记"""
+        self.cancel(key)
+        self._place(key, self.current + max(1, math.ceil(delay / self.tick)))
+
+    def cancel(self, key):
+        position = self.positions.pop(key, None)
+        if position is not None:
+            level, slot = position
+            del self.wheels[level][slot][key]
+
+    def advance(self, now=None):
+        """推进到当前时间，返回这期间到期的键"""
+        now = self.clock() if now is None else now
+        target = int((now - self.origin) / self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            # 低层转完一圈时，把高层对应槽位中的项下放
+            for level in range(1, self.levels):
+                if self.current % self.spans[level - 1]:
+                    break
+                slot = (self.current // self.spans[level - 1]) % self.slots
+                bucket, self.wheels[level][slot] = self.wheels[level][slot], {}
+                for key, expires in bucket.items():
+                    self._place(key, expires)
+            slot = self.current % self.slots
+            bucket = self.wheels[0][slot]
+            if bucket:
+                self.wheels[0][slot] = {}
+                for key in bucket:
+                    del self.positions[key]
+                expired.extend(bucket)
+        return expired
+
+    def _place(self, key, expires):
+        ticks = expires - self.current
+        if ticks < self.slots:
+            slot = expires % self.slots
+            self.wheels[0][slot][key] = expires
+            self.positions[key] = (0, slot)
+            return
+        if ticks >= self.spans[-1]:
+            expires = self.current + self.spans[-1] - 1
+            ticks = expires - self.current
+        for level in range(self.levels):
+            if ticks < self.spans[level]:
+                slot = (expires // (self.spans[level] // self.slots)) % self.slots
+                self.wheels[level][slot][key] = expires
+                self.positions[key] = (level, slot)
+                return
@@ -0,0 +1,543 @@
+"""
+WebSocket网关
+
+浏览器不能直接建立TCP连接，原来每个浏览器用户都要经过一对 Flask + ChatClient 中转：
+页面 -> /send_message -> ChatClient -> 服务器 -> ChatClient队列 -> /get_messages -> 页面，每一跳都要解码、再编码一次。
+网关在单独的端口上接受WebSocket连接（RFC 6455），为每个浏览器连接建立一条到聊天服务器的普通连接，之后只转换帧格式：
+服务器发来的帧去掉4字节长度头、换上WebSocket帧头发给浏览器，浏览器发来的文本帧加上长度头发给服务器，消息本身不重新编码。
+所有连接由一个事件循环处理，一个进程可以服务几百个浏览器用户；聊天服务器可以是任意引擎，包括多进程模式。
+
+浏览器上说的就是聊天协议本身：连上后收到welcome，发送 message、join、leave、resume，收到ping时回复pong。
+二进制编码和压缩不经过网关协商，浏览器发来的hello只保留heartbeat。
+网关连上服务器后先发送 {"type": "forwarded", "ip", "port"}，服务器只接受来自本机的forwarded，
+此后限速和消息中的IP都按浏览器的地址计算；浏览器自己发送的forwarded会被丢弃。
+
+对网关端口的普通HTTP请求（GET /）返回一个简单的聊天页面，浏览器打开即可聊天。
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+from protocol import FrameDecoder, ProtocolError, encode_frame, encode_message
+from chat_server import LISTEN_BACKLOG
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+DEFAULT_MAX_CONNECTIONS = 1000
+# 浏览器发来的单条消息上限，聊天消息不需要更大
+MAX_MESSAGE_SIZE = 1024 * 1024
+# 建立连接后必须在这个时间（秒）内发完HTTP请求头
+HANDSHAKE_TIMEOUT = 10.0
+# 发往浏览器的数据积压超过这个字节数时暂停读取服务器，由服务器端的发送队列按慢消费者策略处理
+WRITE_BUFFER_HIGH = 1024 * 1024
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED = 1003
+CLOSE_TOO_BIG = 1009
+
+
+class WebSocketError(ProtocolError):
+    """浏览器违反了WebSocket协议，code为关闭连接时发给浏览器的状态码"""
+
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+
+def accept_key(key):
+    """握手响应中的 Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + WEBSOCKET_GUID).digest()).decode('ascii')
+
+
+def frame_header(length, opcode=OP_TEXT):
+    """服务器发出的帧头（不带掩码）"""
+    if length < 126:
+        return bytes((0x80 | opcode, length))
+    if length < 65536:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length)
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+
+def close_frame(code, reason=''):
+    payload = struct.pack('!H', code) + reason.encode('utf-8')[:123]
+    return frame_header(len(payload), OP_CLOSE) + payload
+
+
+def unmask(payload, mask):
+    """还原浏览器发来的数据：把整段数据和重复的4字节掩码当作大整数异或，比逐字节快得多"""
+    length = len(payload)
+    if not length:
+        return b''
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(length, 'little')
+
+
+async def read_frame(reader, max_size=MAX_MESSAGE_SIZE):
+    """读取浏览器发来的一个帧，返回 (fin, opcode, 数据)"""
+    first, second = await reader.readexactly(2)
+    if first & 0x70:
+        raise WebSocketError(CLOSE_PROTOCOL_ERROR, "不支持WebSocket扩展")
+    if not second & 0x80:
+        raise WebSocketError(CLOSE_PROTOCOL_ERROR, "浏览器发来的帧必须带掩码")
+    fin = bool(first & 0x80)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack('!Q', await reader.readexactly(8))
+    if opcode >= OP_CLOSE and (length > 125 or not fin):
+        raise WebSocketError(CLOSE_PROTOCOL_ERROR, "控制帧格式错误")
+    if length > max_size:
+        raise WebSocketError(CLOSE_TOO_BIG, f"消息过大: {length}")
+    mask = await reader.readexactly(4)
+    return fin, opcode, unmask(await reader.readexactly(length), mask)
+
+
+async def read_http_request(reader):
+    """读取HTTP请求头，返回 (方法, 路径, 小写的头部字典)"""
+    data = await reader.readuntil(b'\r\n\r\n')
+    lines = data.decode('latin-1').split('\r\n')
+    method, path, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if separator:
+            headers[name.strip().lower()] = value.strip()
+    return method, path, headers
+
+
+def http_response(status, body=b'', content_type='text/plain; charset=utf-8'):
+    return (f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n").encode('latin-1') + body
+
+
+def filter_message(payload):
+    """
+    检查浏览器发来的消息，返回要转发给服务器的数据，None表示丢弃：
+    不是JSON对象的丢弃（也就无法切换到二进制编码），forwarded丢弃，hello只保留heartbeat，其他原样转发
+    """
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(message, dict):
+        return None
+    message_type = message.get('type')
+    if message_type == 'forwarded':
+        return None
+    if message_type == 'hello':
+        if not message.get('heartbeat'):
+            return None
+        return json.dumps({'type': 'hello', 'heartbeat': True}).encode('utf-8')
+    return payload
+
+
+class UpstreamProtocol(asyncio.BufferedProtocol):
+    """
+    网关到聊天服务器的连接：数据由事件循环直接写入帧解码器的缓冲区，
+    一次读到的所有帧换上WebSocket帧头后合并成一次写入浏览器的连接，中间没有await
+    """
+
+    def __init__(self, gateway, writer):
+        self.gateway = gateway
+        self.writer = writer
+        self.decoder = FrameDecoder(initial_size=0)
+        self.transport = None
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        out = bytearray()
+        count = 0
+        try:
+            for payload in self.decoder.frames():
+                out += frame_header(len(payload))
+                out += payload
+                count += 1
+        except ProtocolError as e:
+            self.transport.abort()
+            self._finish((CLOSE_PROTOCOL_ERROR, str(e)))
+            return
+        if not count:
+            return
+        self.gateway.messages_out += count
+        self.gateway.bytes_out += len(out)
+        self.writer.write(out)
+        if self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_HIGH:
+            self.transport.pause_reading()
+            asyncio.ensure_future(self._resume_after_drain())
+
+    async def _resume_after_drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            return
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        self._finish((CLOSE_GOING_AWAY, '聊天服务器断开了连接'))
+
+    def _finish(self, result):
+        if not self.closed.done():
+            self.closed.set_result(result)
+
+
+class WebSocketGateway:
+    """在单独的端口上接受浏览器的WebSocket连接，逐个转接到聊天服务器"""
+
+    def __init__(self, upstream_host, upstream_port, host='0.0.0.0', port=0,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
+        if max_connections < 1:
+            raise ValueError(f"最大连接数必须大于0: {max_connections}")
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.running = False
+        self.loop = None
+        self._server = None
+        self._thread = None
+        # 以下统计只在事件循环线程中修改
+        self.active = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.pages = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def start(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(started,), name='ws_gateway', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.running
+
+    def stop(self):
+        self.running = False
+        if self.loop and self._thread and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+        print("WebSocket网关已停止")
+
+    def _run_loop(self, started):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._server = self.loop.run_until_complete(asyncio.start_server(
+                self._handle, self.host, self.port, backlog=LISTEN_BACKLOG))
+            self.port = self._server.sockets[0].getsockname()[1]
+            self.running = True
+            print(f"WebSocket网关已启动，端口 {self.port}，转接到 {self.upstream_host}:{self.upstream_port}")
+        except OSError as e:
+            print(f"WebSocket网关启动失败: {e}")
+            self.loop.close()
+            return
+        finally:
+            started.set()
+
+        try:
+            self.loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self._server.wait_closed())
+            self.loop.close()
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            try:
+                method, path, headers = await asyncio.wait_for(read_http_request(reader), HANDSHAKE_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    ValueError, ConnectionError):
+                return
+            if headers.get('upgrade', '').lower() != 'websocket':
+                self._serve_page(writer, method, path)
+                return
+            key = headers.get('sec-websocket-key')
+            if method != 'GET' or not key or headers.get('sec-websocket-version') != '13':
+                writer.write(http_response('400 Bad Request', '不是有效的WebSocket握手'.encode('utf-8')))
+                return
+            if self.active >= self.max_connections:
+                self.rejected += 1
+                writer.write(http_response('503 Service Unavailable', '连接数已满'.encode('utf-8')))
+                return
+            try:
+                upstream, protocol = await asyncio.get_running_loop().create_connection(
+                    lambda: UpstreamProtocol(self, writer), self.upstream_host, self.upstream_port)
+            except OSError as e:
+                print(f"WebSocket网关无法连接聊天服务器: {e}")
+                writer.write(http_response('502 Bad Gateway', '聊天服务器不可用'.encode('utf-8')))
+                return
+            writer.write((f"HTTP/1.1 101 Switching Protocols\r\n"
+                          f"Upgrade: websocket\r\n"
+                          f"Connection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n").encode('latin-1'))
+            self.active += 1
+            self.accepted += 1
+            try:
+                await self._relay(reader, writer, upstream, protocol, peer)
+            finally:
+                self.active -= 1
+                upstream.close()
+        finally:
+            writer.close()
+
+    def _serve_page(self, writer, method, path):
+        if method == 'GET' and path.split('?', 1)[0] in ('/', '/index.html'):
+            self.pages += 1
+            writer.write(http_response('200 OK', PAGE.encode('utf-8'), 'text/html; charset=utf-8'))
+        else:
+            writer.write(http_response('404 Not Found', b'Not Found'))
+
+    async def _relay(self, reader, writer, upstream, protocol, peer):
+        """双向转发直到一方断开，最后向浏览器发送关闭帧"""
+        upstream.write(encode_message({'type': 'forwarded', 'ip': peer[0], 'port': peer[1]}))
+        tasks = {protocol.closed, asyncio.ensure_future(self._to_server(reader, writer, upstream))}
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+        code, reason = CLOSE_GOING_AWAY, ''
+        for task in done:
+            if task.cancelled():
+                continue
+            error = task.exception()
+            if isinstance(error, WebSocketError):
+                code, reason = error.code, str(error)
+            elif error is None and task.result() is not None:
+                code, reason = task.result()
+        if reason and code != CLOSE_NORMAL:
+            print(f"WebSocket客户端 {peer} 断开: {reason}")
+        try:
+            writer.write(close_frame(code, reason))
+            await asyncio.wait_for(writer.drain(), 1.0)
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+    async def _to_server(self, reader, writer, upstream):
+        """浏览器 -> 服务器：处理控制帧，拼接分片，文本消息加上长度头转发"""
+        fragments = None
+        while True:
+            try:
+                fin, opcode, payload = await read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return None
+            if opcode == OP_CLOSE:
+                code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                return code, ''
+            if opcode == OP_PING:
+                writer.write(frame_header(len(payload), OP_PONG) + payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CONTINUATION:
+                if fragments is None:
+                    raise WebSocketError(CLOSE_PROTOCOL_ERROR, "没有开始帧的后续帧")
+                fragments += payload
+                if len(fragments) > MAX_MESSAGE_SIZE:
+                    raise WebSocketError(CLOSE_TOO_BIG, f"消息过大: {len(fragments)}")
+                if not fin:
+                    continue
+                payload, fragments = bytes(fragments), None
+            elif opcode == OP_TEXT:
+                if fragments is not None:
+                    raise WebSocketError(CLOSE_PROTOCOL_ERROR, "上一条分片消息尚未结束")
+                if not fin:
+                    fragments = bytearray(payload)
+                    continue
+            elif opcode == OP_BINARY:
+                raise WebSocketError(CLOSE_UNSUPPORTED, "只支持文本消息")
+            else:
+                raise WebSocketError(CLOSE_PROTOCOL_ERROR, f"未知的操作码: {opcode}")
+            self.messages_in += 1
+            self.bytes_in += len(payload)
+            payload = filter_message(payload)
+            if payload is None:
+                continue
+            upstream.write(encode_frame(payload))
+
+    def stats(self):
+        return {
+            'port': self.port,
+            'upstream': f"{self.upstream_host}:{self.upstream_port}",
+            'active': self.active,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'pages': self.pages,
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+
+
+PAGE = '''<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>网页聊天</title>
+<style>
+    body { font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; background: #f5f5f5; }
+    .bar { display: flex; gap: 10px; margin-bottom: 10px; align-items: center; }
+    input { padding: 8px; border: 1px solid #ccc; border-radius: 4px; }
+    button { padding: 8px 16px; background: #007bff; color: white; border: none; border-radius: 4px; cursor: pointer; }
+    #messages { height: 420px; overflow-y: auto; background: white; border: 1px solid #ddd; padding: 10px; }
+    .message { padding: 4px 0; border-bottom: 1px solid #f0f0f0; word-break: break-all; }
+    .system { color: #888; }
+    .error { color: #c00; }
+    #status { color: #666; font-size: 12px; }
+</style>
+</head>
+<body>
+<h2>网页聊天</h2>
+<div class="bar">
+    用户名 <input id="username" value="网页用户">
+    房间 <input id="room" value="大厅" size="10"><button onclick="changeRoom()">进入</button>
+    <span id="status">连接中...</span>
+</div>
+<div id="messages"></div>
+<div class="bar">
+    <input id="content" style="flex: 1" placeholder="输入消息，回车发送">
+    <button onclick="sendMessage()">发送</button>
+</div>
+<script>
+const DEFAULT_ROOM = '大厅';
+let socket = null;
+let room = DEFAULT_ROOM;
+let epoch = null;
+let lastSeq = 0;
+
+function show(text, kind) {
+    const box = document.getElementById('messages');
+    const div = document.createElement('div');
+    div.className = 'message ' + (kind || '');
+    div.textContent = text;
+    box.appendChild(div);
+    box.scrollTop = box.scrollHeight;
+}
+
+function send(message) {
+    if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify(message));
+        return true;
+    }
+    return false;
+}
+
+function receive(message) {
+    if (message.seq) {
+        lastSeq = Math.max(lastSeq, message.seq);
+    }
+    switch (message.type) {
+        case 'ping':
+            send({type: 'pong'});
+            break;
+        case 'pong':
+            break;
+        case 'welcome':
+            if (message.heartbeat) {
+                send({type: 'hello', heartbeat: true});
+            }
+            if (lastSeq && message.epoch === epoch) {
+                // 重连：回到之前的房间并补发断开期间的消息
+                if (room !== DEFAULT_ROOM) {
+                    send({type: 'join', room: room});
+                }
+                send({type: 'resume', since: lastSeq, epoch: epoch});
+            } else {
+                epoch = message.epoch;
+                lastSeq = message.seq || 0;
+                if (room !== DEFAULT_ROOM) {
+                    send({type: 'join', room: room, since: 0, epoch: epoch});
+                }
+            }
+            break;
+        case 'history':
+            epoch = message.epoch;
+            (message.messages || []).forEach(receive);
+            break;
+        default:
+            if (message.content) {
+                show(message.content, message.type);
+            }
+    }
+}
+
+function connect() {
+    const scheme = location.protocol === 'https:' ? 'wss://' : 'ws://';
+    socket = new WebSocket(scheme + location.host + '/');
+    socket.onopen = () => { document.getElementById('status').textContent = '已连接'; };
+    socket.onmessage = (event) => receive(JSON.parse(event.data));
+    socket.onclose = () => {
+        document.getElementById('status').textContent = '连接断开，正在重连...';
+        setTimeout(connect, 2000);
+    };
+}
+
+function sendMessage() {
+    const input = document.getElementById('content');
+    const content = input.value.trim();
+    if (!content) {
+        return;
+    }
+    const username = document.getElementById('username').value.trim() || '网页用户';
+    if (send({type: 'message', username: username, content: content, room: room})) {
+        input.value = '';
+    } else {
+        show('未连接到服务器', 'error');
+    }
+}
+
+function changeRoom() {
+    const target = document.getElementById('room').value.trim() || DEFAULT_ROOM;
+    if (target === room) {
+        return;
+    }
+    if (room !== DEFAULT_ROOM) {
+        send({type: 'leave', room: room});
+    }
+    if (target !== DEFAULT_ROOM) {
+        send({type: 'join', room: target, since: 0, epoch: epoch});
+    }
+    room = target;
+}
+
+document.getElementById('content').addEventListener('keypress', (event) => {
+    if (event.key === 'Enter') {
+        sendMessage();
+    }
+});
+connect();
+</script>
+</body>
+</html>
+'''